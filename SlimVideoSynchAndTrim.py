@@ -1,13 +1,61 @@
+import json
 import os
+import re
+import subprocess
 import sys
-import librosa
 import time
 import moviepy.editor as mp
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
-from scipy import signal
+from moviepy.config import get_setting
+from scipy import fft, signal
+from scipy.io import wavfile
 from pathlib import Path
 
+from VideoProbe import PROBE_CACHE_FILE_NAME, probe_videos, scan_video_packets
+
+# coarse-to-fine lag search settings: the envelope is correlated at DEFAULT_ENVELOPE_RATE Hz, then the lag is refined at the full
+# audio rate within DEFAULT_REFINE_WINDOW_SECONDS of that using a DEFAULT_REFINE_EXCERPT_SECONDS long excerpt of the audio
+DEFAULT_ENVELOPE_RATE = 1000
+DEFAULT_REFINE_WINDOW_SECONDS = 0.01
+DEFAULT_REFINE_EXCERPT_SECONDS = 10
+# lags with a lower peak-to-sidelobe ratio than this get flagged as possibly bad syncs
+DEFAULT_MINIMUM_LAG_CONFIDENCE = 8
+# multi_reference lag solving: each camera's envelope is correlated with the next DEFAULT_PAIRS_PER_CAMERA cameras' envelopes, and pairs that
+# disagree with the least squares solution by more than DEFAULT_MAX_LAG_RESIDUAL_SECONDS (half the refine window, so a lag that close
+# still refines to the right one) are thrown out
+DEFAULT_PAIRS_PER_CAMERA = 2
+DEFAULT_MAX_LAG_RESIDUAL_SECONDS = 0.005
+LAG_METHODS = ['coarse_to_fine', 'full', 'multi_reference']
+
+TRIM_MODES = ['stream_copy', 'reencode']
+# video codecs that can be stream copied, and the encoder used to re-encode the head of the video before the first keyframe to match
+STREAM_COPY_ENCODERS = {'h264': 'libx264', 'hevc': 'libx265'}
+STREAM_COPY_TIMESCALE = "90000" # exact for 24, 25, 30, 60 and 29.97 fps frame times
+
+# saved in SyncedVideos, so cameras added to a session later can be synced without redoing the others (see sync_session)
+SYNC_MANIFEST_FILE_NAME = "sync_manifest.json"
+SYNC_FINGERPRINTS_FILE_NAME = "sync_fingerprints.npz"
+SYNC_MANIFEST_FORMAT_VERSION = 1
+
+class AudioExcerptReader:
+    '''Stands in for the audio array of a video without decoding it all: slicing it decodes just that excerpt.
+    Used for the reference camera when syncing against its fingerprint, where only the excerpt around the lag is needed.'''
+
+    def __init__(self, synch_and_trim, video_file_path, sample_rate, num_samples):
+        self.synch_and_trim = synch_and_trim
+        self.video_file_path = video_file_path
+        self.sample_rate = sample_rate
+        self.size = num_samples
+
+    def __getitem__(self, excerpt):
+        start_sample, end_sample, step = excerpt.indices(self.size)
+        if step != 1:
+            raise Exception("audio excerpts can only be read with a step of 1")
+        return self.synch_and_trim.extract_audio(self.video_file_path, self.sample_rate, start_sample, max(end_sample - start_sample, 0))
+
+
 class VideoSynchTrimming:
     '''Class of functions for time synchronizing and trimming video files based on cross correlaiton of their audio.'''
     
@@ -35,48 +83,80 @@ class VideoSynchTrimming:
         os.chdir(base_path)
         return unique_clip_list
 
-    def get_files(self, base_path, clip_list):
-        '''Get video files from clip_list, extract the audio, and put the video and audio files in a list.
-        Return a list of lists containing the video file name and file, and audio name and file.
-        Also return a list containing the audio sample rate from each file.'''
-    
-        # create empty list for storing audio and video files, will contain sublists formatted like [video_file_name,video_file,audio_file_name,audio_file] 
-        file_list = []
-
-        # create empty list to hold audio sample rate, so we can verify samplerate is the same across all audio files
-        sample_rate_list = []
+    def get_files(self, base_path, clip_list, write_wav_files=False, num_workers=None):
+        '''Get video files from clip_list, extract the audio, and put the video info and audio files in a list.
+        Return a list of lists containing the video file name and info (a VideoProbe.VideoInfo read from the file's headers, with .duration, .fps etc.), and audio name and file.
+        Also return a list containing the audio sample rate from each file.
+        The audio of every clip is decoded at the same time (one ffmpeg process per clip, num_workers at once) straight into memory.
+        Set write_wav_files to True to also save the audio as .wav files in the AudioFiles folder for debugging.'''
 
         video_path = base_path / "RawVideos"
 
-        audio_path = base_path / "AudioFiles"
-        os.makedirs(audio_path, exist_ok=True)
+        # probe all the clips at once, and check the audio sample rates first, so a mismatch is caught before any audio gets decoded
+        video_info_list = probe_videos([video_path / clip for clip in clip_list], num_workers, cache_path=video_path / PROBE_CACHE_FILE_NAME)
+        sample_rate_list = [video_info.audio_sample_rate for video_info in video_info_list]
+        self.check_audio_sample_rates(clip_list, sample_rate_list)
+
+        # decode the audio of all the clips in parallel, each ffmpeg process runs on its own so threads are enough to keep them all busy
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            audio_signal_list = list(executor.map(self.extract_audio, [video_path / clip for clip in clip_list], sample_rate_list))
+
+        if write_wav_files:
+            audio_path = base_path / "AudioFiles"
+            os.makedirs(audio_path, exist_ok=True)
+
+        # create empty list for storing audio and video files, will contain sublists formatted like [video_file_name,video_file,audio_file_name,audio_file] 
+        file_list = []
 
-        # iterate through clip_list, open video files and audio files, and store in file_list
-        for clip in clip_list:
+        # iterate through clip_list, and store the video info in file_list with their audio
+        for clip, video_info, audio_signal, audio_rate in zip(clip_list, video_info_list, audio_signal_list, sample_rate_list):
             # take vid_name and change extension to create audio file name
             vid_name = clip
             audio_name = clip.split(".")[0] + '.wav'
-            # open video files
-            video_file = mp.VideoFileClip(str(video_path / vid_name), audio=True)
 
             # get length of video clip
-            vid_length = video_file.duration
+            vid_length = video_info.duration
 
-            # create .wav file of clip audio
-            video_file.audio.write_audiofile(str(audio_path / audio_name))
-
-            # extract raw audio from Wav file
-            audio_signal, audio_rate = librosa.load(audio_path / audio_name, sr = None)
-            sample_rate_list.append(audio_rate)
+            if write_wav_files:
+                wavfile.write(str(audio_path / audio_name), audio_rate, audio_signal)
 
             # save video and audio file names and files in list
-            file_list.append([vid_name, video_file, audio_name, audio_signal])
+            file_list.append([vid_name, video_info, audio_name, audio_signal])
 
             # print relevant video and audio info
             print("video length:", vid_length, "seconds", "audio sample rate", audio_rate, "Hz")
 
         return file_list, sample_rate_list
 
+    def get_audio_sample_rates(self, video_path, clip_list, num_workers=None):
+        '''Read the audio sample rate of each clip from its header (without decoding anything), None for clips with no audio.'''
+        video_info_list = probe_videos([video_path / clip for clip in clip_list], num_workers, cache_path=video_path / PROBE_CACHE_FILE_NAME)
+        return [video_info.audio_sample_rate for video_info in video_info_list]
+
+    def check_audio_sample_rates(self, clip_list, sample_rate_list):
+        '''Throw an exception naming the clips if any clip has no audio or the clips' audio sample rates differ.'''
+        clip_sample_rates = dict(zip(clip_list, sample_rate_list))
+        if None in sample_rate_list:
+            raise Exception(f"no audio found in {[clip for clip, rate in clip_sample_rates.items() if rate is None]}, can't sync without audio")
+        if len(set(sample_rate_list)) > 1:
+            raise Exception(f"audio sample rates are not equal, rates are {clip_sample_rates}")
+
+    def extract_audio(self, video_file_path, sample_rate, start_sample=0, num_samples=None):
+        '''Decode the audio track of a video file with ffmpeg and return it as a mono float32 array at the given sample rate.
+        Give start_sample and num_samples to only decode that excerpt of it (padded with zeros if the audio ends first).'''
+        excerpt_options = []
+        if num_samples is not None:
+            excerpt_options = ["-ss", f"{start_sample / sample_rate:.9f}", "-t", f"{(num_samples + 1) / sample_rate:.9f}"]
+        ffmpeg_command = [get_setting("FFMPEG_BINARY"), "-v", "error"] + excerpt_options + ["-i", str(video_file_path), "-vn",
+                          "-ac", "1", "-ar", str(sample_rate), "-f", "f32le", "-acodec", "pcm_f32le", "-"]
+        ffmpeg_process = subprocess.run(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if ffmpeg_process.returncode != 0:
+            raise Exception(f"could not extract audio from {video_file_path}: {ffmpeg_process.stderr.decode(errors='replace')}")
+        audio_signal = np.frombuffer(ffmpeg_process.stdout, dtype=np.float32)
+        if num_samples is not None:
+            audio_signal = np.pad(audio_signal[:num_samples], (0, max(num_samples - audio_signal.size, 0)))
+        return audio_signal
+
     def get_fps_list(self, file_list):
         '''Retrieve frames per second of each video clip in file_list'''
         return [file[1].fps for file in file_list]
@@ -113,14 +193,289 @@ class VideoSynchTrimming:
 
         return lag
 
-    def find_lags(self, file_list, sample_rate):
+    def calculate_audio_envelope(self, audio_file, decimation_factor):
+        '''Rectify the audio and average it over blocks of decimation_factor samples, giving a z-score normalized envelope at a much lower rate.'''
+        num_blocks = audio_file.size // decimation_factor
+        envelope = np.abs(audio_file[:num_blocks * decimation_factor]).reshape(num_blocks, decimation_factor).mean(axis=1, dtype=np.float64)
+        if envelope.size == 0 or np.std(envelope) == 0:
+            return np.zeros_like(envelope) # silent audio has no envelope to line up
+        return self.normalize_audio(envelope)
+
+    def calculate_peak_to_sidelobe_ratio(self, corr, peak_index, exclusion_half_width):
+        '''How many standard deviations the correlation peak stands above the rest of the correlation (ignoring the main lobe around the peak).
+        A clean sync has one sharp peak and scores high, a bad one (no shared sound, repetitive sound) has peaks everywhere and scores low.'''
+        sidelobe = np.concatenate([corr[:max(peak_index - exclusion_half_width, 0)], corr[peak_index + exclusion_half_width + 1:]])
+        if sidelobe.size < 2 or np.std(sidelobe) == 0:
+            return 0.0
+        return float((corr[peak_index] - np.mean(sidelobe)) / np.std(sidelobe))
+
+    def cross_correlate_coarse_to_fine(self, audio1, audio2, sample_rate, max_lag_seconds=None, envelope_rate=DEFAULT_ENVELOPE_RATE,
+                                       refine_window_seconds=DEFAULT_REFINE_WINDOW_SECONDS, refine_excerpt_seconds=DEFAULT_REFINE_EXCERPT_SECONDS, envelope1=None, envelope2=None):
+        '''Find the lag between two audio files without a full rate correlation of the whole recording.
+        First the audio envelopes, decimated down to envelope_rate, are correlated over lags of up to max_lag_seconds (None for every lag).
+        Then the lag is refined at the full sample rate within refine_window_seconds of that, correlating only a refine_excerpt_seconds long
+        excerpt of the loudest part of the overlap, and a parabola is fitted to the peak to get the lag to a fraction of a sample.
+        Return the lag (in audio samples, same sign convention as cross_correlate) and the peak-to-sidelobe ratio of the envelope correlation as a confidence score.
+        envelope1 can be given if audio1's envelope is already known (e.g. a fingerprint from the sync manifest), then audio1 only has to support .size and slicing
+        (like an AudioExcerptReader), since only the excerpt around the lag is read. envelope2 can be given the same way, to save recomputing it.
+        '''
+
+        # coarse search on the envelopes
+        decimation_factor = max(int(sample_rate // envelope_rate), 1)
+        if envelope1 is None:
+            envelope1 = self.calculate_audio_envelope(audio1, decimation_factor)
+        if envelope2 is None:
+            envelope2 = self.calculate_audio_envelope(audio2, decimation_factor)
+
+        envelope_corr = signal.correlate(envelope1, envelope2, mode='full', method='fft')
+        coarse_lag, confidence = self.find_coarse_lag(envelope_corr, envelope1.size, envelope2.size, sample_rate, decimation_factor,
+                                                      max_lag_seconds=max_lag_seconds, refine_window_seconds=refine_window_seconds)
+        lag = self.refine_lag(audio1, audio2, coarse_lag, sample_rate, decimation_factor, refine_window_seconds=refine_window_seconds,
+                              refine_excerpt_seconds=refine_excerpt_seconds)
+        return lag, confidence
+
+    def find_coarse_lag(self, envelope_corr, envelope1_size, envelope2_size, sample_rate, decimation_factor, max_lag_seconds=None,
+                        refine_window_seconds=DEFAULT_REFINE_WINDOW_SECONDS):
+        '''The coarse step of cross_correlate_coarse_to_fine: the peak of the (full mode) correlation of two envelopes, within max_lag_seconds.
+        Return it as a lag in audio samples, with its peak-to-sidelobe ratio as a confidence score.'''
+        envelope_lags = signal.correlation_lags(envelope1_size, envelope2_size, mode="full")
+        if max_lag_seconds is not None:
+            in_lag_window = np.abs(envelope_lags) <= max_lag_seconds * sample_rate / decimation_factor
+            envelope_corr = envelope_corr[in_lag_window]
+            envelope_lags = envelope_lags[in_lag_window]
+
+        coarse_peak_index = int(np.argmax(envelope_corr))
+        # the main lobe of the envelope correlation is about as wide as the refinement window
+        exclusion_half_width = max(int(np.ceil(refine_window_seconds * sample_rate / decimation_factor)), 1)
+        confidence = self.calculate_peak_to_sidelobe_ratio(envelope_corr, coarse_peak_index, exclusion_half_width)
+        return int(envelope_lags[coarse_peak_index]) * decimation_factor, confidence
+
+    def refine_lag(self, audio1, audio2, coarse_lag, sample_rate, decimation_factor, refine_window_seconds=DEFAULT_REFINE_WINDOW_SECONDS,
+                   refine_excerpt_seconds=DEFAULT_REFINE_EXCERPT_SECONDS):
+        '''The fine step of cross_correlate_coarse_to_fine: refine a coarse lag (in audio samples) to a fraction of a sample, searching within
+        refine_window_seconds of it. Return the coarse lag as it is if the overlap is too short to refine.'''
+        # fine search at full rate: correlate an excerpt of audio2 against the part of audio1 it should line up with, give or take the refine window
+        refine_half_width = max(int(refine_window_seconds * sample_rate), 2 * decimation_factor)
+        overlap_start = max(0, -coarse_lag)
+        overlap_end = min(audio2.size, audio1.size - coarse_lag)
+        excerpt_length = min(int(refine_excerpt_seconds * sample_rate), overlap_end - overlap_start - 2 * refine_half_width)
+        if excerpt_length <= 0:
+            return float(coarse_lag) # the overlap is too short to refine, the coarse lag is the best we have
+
+        first_excerpt_start = overlap_start + refine_half_width
+        last_excerpt_start = overlap_end - refine_half_width - excerpt_length
+
+        # start the excerpt at the loudest stretch of audio2, which has the most to line up
+        block_energy = np.abs(audio2[:(audio2.size // decimation_factor) * decimation_factor]).reshape(-1, decimation_factor).sum(axis=1, dtype=np.float64)
+        excerpt_blocks = max(excerpt_length // decimation_factor, 1)
+        cumulative_energy = np.concatenate([[0.0], np.cumsum(block_energy)])
+        window_energy = cumulative_energy[excerpt_blocks:] - cumulative_energy[:-excerpt_blocks]
+        candidate_blocks = np.arange(first_excerpt_start // decimation_factor, min(last_excerpt_start // decimation_factor, window_energy.size - 1) + 1)
+        excerpt_start = first_excerpt_start
+        if candidate_blocks.size > 0:
+            excerpt_start = int(np.clip(candidate_blocks[np.argmax(window_energy[candidate_blocks])] * decimation_factor, first_excerpt_start, last_excerpt_start))
+
+        excerpt2 = audio2[excerpt_start:excerpt_start + excerpt_length]
+        search_start = excerpt_start + coarse_lag - refine_half_width
+        search_segment1 = audio1[search_start:search_start + excerpt_length + 2 * refine_half_width]
+        fine_corr = signal.correlate(search_segment1, excerpt2, mode='valid', method='fft') # fine_corr[j] is the correlation at lag coarse_lag - refine_half_width + j
+
+        fine_peak_index = int(np.argmax(fine_corr))
+        sub_sample_offset = 0.0
+        if 0 < fine_peak_index < fine_corr.size - 1:
+            # fit a parabola through the peak and its neighbours, its vertex is the sub-sample peak
+            y0, y1, y2 = fine_corr[fine_peak_index - 1:fine_peak_index + 2].astype(np.float64)
+            curvature = y0 - 2 * y1 + y2
+            if curvature < 0:
+                sub_sample_offset = 0.5 * (y0 - y2) / curvature
+
+        return coarse_lag - refine_half_width + fine_peak_index + sub_sample_offset
+
+    def calculate_audio_envelopes(self, file_list, sample_rate, executor):
+        '''Every clip's audio envelope at DEFAULT_ENVELOPE_RATE (see calculate_audio_envelope), computed once so it can be reused in each of the clip's correlations.'''
+        decimation_factor = max(int(sample_rate // DEFAULT_ENVELOPE_RATE), 1)
+        return list(executor.map(lambda file: self.calculate_audio_envelope(file[3], decimation_factor), file_list))
+
+    def calculate_envelope_spectra(self, envelopes):
+        '''The spectrum of every envelope, zero padded to a shared length long enough that correlate_envelope_spectra gives
+        the full (non circular) correlation of any two of them. Return the spectra and that length.'''
+        fft_length = fft.next_fast_len(2 * max(envelope.size for envelope in envelopes) - 1, real=True)
+        return [fft.rfft(envelope, fft_length) for envelope in envelopes], fft_length
+
+    def correlate_envelope_spectra(self, spectrum1, spectrum2, envelope1_size, envelope2_size, fft_length):
+        '''The same full mode correlation as signal.correlate(envelope1, envelope2), from the envelopes' spectra (see calculate_envelope_spectra),
+        so each envelope is only transformed once however many pairs it's in.'''
+        circular_corr = fft.irfft(spectrum1 * np.conj(spectrum2), fft_length)
+        # the negative lags wrap around to the end
+        return np.concatenate([circular_corr[fft_length - (envelope2_size - 1):], circular_corr[:envelope1_size]])
+
+    def get_lag_pairs(self, num_clips, pairs_per_camera=DEFAULT_PAIRS_PER_CAMERA):
+        '''The camera pairs to correlate for multi_reference lag solving: every camera with the next pairs_per_camera cameras (wrapping around),
+        a ring of neighbouring cameras plus chords, so each camera is in about 2 * pairs_per_camera pairs and the pairs form loops that
+        can be checked against each other.'''
+        lag_pairs = set()
+        for first_clip in range(num_clips):
+            for step in range(1, min(pairs_per_camera, num_clips - 1) + 1):
+                second_clip = (first_clip + step) % num_clips
+                lag_pairs.add((min(first_clip, second_clip), max(first_clip, second_clip)))
+        return sorted(lag_pairs)
+
+    def get_connected_clips(self, num_clips, lag_pairs, reference_clip=0):
+        '''The clips that the pairs link (directly or through other clips) to the reference clip, as a boolean array.'''
+        connected = np.zeros(num_clips, dtype=bool)
+        connected[reference_clip] = True
+        while True:
+            newly_connected = [clip for pair in lag_pairs for clip in pair if connected[pair[0]] != connected[pair[1]]]
+            if not newly_connected:
+                return connected
+            connected[newly_connected] = True
+
+    def get_refine_pairs(self, num_clips, lag_pairs, pair_confidences, reference_clip=0):
+        '''The pairs whose lags multi_reference refines at full rate: a spanning tree of the pairs, grown from the reference clip by always
+        adding the most confident pair that links up another clip. Return (linked clip, new clip) for each pair, in the order they were added.'''
+        connected = np.zeros(num_clips, dtype=bool)
+        connected[reference_clip] = True
+        refine_pairs = []
+        while not connected.all():
+            linking_pairs = [pair_index for pair_index, pair in enumerate(lag_pairs) if connected[pair[0]] != connected[pair[1]]]
+            if not linking_pairs:
+                break
+            first_clip, second_clip = lag_pairs[max(linking_pairs, key=lambda pair_index: pair_confidences[pair_index])]
+            linked_clip, new_clip = (first_clip, second_clip) if connected[first_clip] else (second_clip, first_clip)
+            refine_pairs.append((linked_clip, new_clip))
+            connected[new_clip] = True
+        return refine_pairs
+
+    def solve_pairwise_lags(self, num_clips, lag_pairs, pair_lags, pair_weights, reference_clip=0):
+        '''Weighted least squares solution for the lag of every clip from the lags measured between pairs of clips,
+        where the lag measured for pair (i, j) is lag j - lag i, and the reference clip's lag is 0.
+        Return the lags and the residual of each pair (solved lag j - lag i minus the measured lag).'''
+        design_matrix = np.zeros((len(lag_pairs), num_clips))
+        design_matrix[np.arange(len(lag_pairs)), [first_clip for first_clip, second_clip in lag_pairs]] = -1
+        design_matrix[np.arange(len(lag_pairs)), [second_clip for first_clip, second_clip in lag_pairs]] = 1
+
+        solved_clips = np.arange(num_clips) != reference_clip
+        weight_roots = np.sqrt(pair_weights)
+        lags = np.zeros(num_clips)
+        lags[solved_clips] = np.linalg.lstsq(design_matrix[:, solved_clips] * weight_roots[:, None], pair_lags * weight_roots, rcond=None)[0]
+        return lags, design_matrix @ lags - pair_lags
+
+    def find_lags_multi_reference(self, file_list, sample_rate, pairs_per_camera=DEFAULT_PAIRS_PER_CAMERA, max_lag_seconds=None,
+                                  minimum_confidence=DEFAULT_MINIMUM_LAG_CONFIDENCE, max_residual_seconds=DEFAULT_MAX_LAG_RESIDUAL_SECONDS, num_workers=None):
+        '''Find every clip's lag (relative to the first clip, in audio samples) from a sparse set of clip pairs (see get_lag_pairs), instead of correlating
+        every clip against one reference, so one camera with bad audio can't throw off the rest.
+        Only the pairs' envelopes are correlated (find_coarse_lag, each clip's envelope spectrum computed once), and the coarse lags solved by least squares,
+        weighted by each pair's confidence. Pairs below minimum_confidence are left out (unless a clip can't be linked up without them), and then the pair that
+        fits the solution worst is thrown out and the lags solved again, until every pair left is within max_residual_seconds.
+        Then just enough of the pairs left to link every clip (see get_refine_pairs) are refined at full rate (refine_lag) to get the final lags.
+        That's one full rate refinement per clip, like coarse_to_fine, which is most of its time, and about as many envelope transforms as coarse_to_fine
+        with the default pairs_per_camera, so it takes no longer (compare the find_lags times of the benchmark's lag methods).
+        Return each clip's lag and confidence (the best confidence among the pairs it's in). The pairs are reported in self.lag_pair_report and
+        each clip's RMS residual (in seconds, over the pairs it's in, against the coarse lags) in self.lag_residual_list.
+        '''
+        num_clips = len(file_list)
+        if num_clips < 2:
+            self.lag_pair_report, self.lag_residual_list = [], [0.0] * num_clips
+            return [(0.0, np.nan)] * num_clips # nothing to sync against
+
+        lag_pairs = self.get_lag_pairs(num_clips, pairs_per_camera)
+        decimation_factor = max(int(sample_rate // DEFAULT_ENVELOPE_RATE), 1)
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            envelopes = self.calculate_audio_envelopes(file_list, sample_rate, executor)
+            envelope_spectra, fft_length = self.calculate_envelope_spectra(envelopes)
+            pair_results = list(executor.map(lambda pair: self.find_coarse_lag(self.correlate_envelope_spectra(envelope_spectra[pair[0]], envelope_spectra[pair[1]],
+                                                                                                               envelopes[pair[0]].size, envelopes[pair[1]].size, fft_length),
+                                                                               envelopes[pair[0]].size, envelopes[pair[1]].size, sample_rate, decimation_factor,
+                                                                               max_lag_seconds=max_lag_seconds), lag_pairs))
+        pair_lags = np.array([lag for lag, confidence in pair_results], dtype=np.float64)
+        pair_confidences = np.array([confidence for lag, confidence in pair_results], dtype=np.float64)
+
+        # start from the confident pairs, and add back the most confident of the others until every clip is linked to the first one
+        in_solution = pair_confidences >= minimum_confidence
+        for pair_index in np.argsort(-pair_confidences):
+            if self.get_connected_clips(num_clips, [pair for pair, used in zip(lag_pairs, in_solution) if used]).all():
+                break
+            in_solution[pair_index] = True
+
+        # a wrong pair in a loop of pairs disagrees with the others, drop the worst one at a time (a pair that isn't in any loop always fits exactly)
+        while True:
+            lags, residuals = self.solve_pairwise_lags(num_clips, [pair for pair, used in zip(lag_pairs, in_solution) if used],
+                                                       pair_lags[in_solution], np.maximum(pair_confidences[in_solution], 1e-3))
+            worst_pair = np.flatnonzero(in_solution)[np.argmax(np.abs(residuals))]
+            if np.abs(residuals).max() <= max_residual_seconds * sample_rate:
+                break
+            in_solution[worst_pair] = False
+            if not self.get_connected_clips(num_clips, [pair for pair, used in zip(lag_pairs, in_solution) if used]).all():
+                in_solution[worst_pair] = True
+                break
+
+        all_residuals = np.array([lags[second_clip] - lags[first_clip] for first_clip, second_clip in lag_pairs]) - pair_lags
+
+        # refine the coarse solution along a tree of the pairs that are left, each clip's lag is the lag of the clip it's linked to plus their refined lag
+        used_pairs = [pair for pair, used in zip(lag_pairs, in_solution) if used]
+        refine_pairs = self.get_refine_pairs(num_clips, used_pairs, pair_confidences[in_solution])
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            refined_lags = list(executor.map(lambda pair: self.refine_lag(file_list[pair[0]][3], file_list[pair[1]][3], int(round(lags[pair[1]] - lags[pair[0]])),
+                                                                          sample_rate, decimation_factor), refine_pairs))
+        coarse_lags, lags = lags, np.zeros(num_clips)
+        for (linked_clip, new_clip), refined_lag in zip(refine_pairs, refined_lags):
+            lags[new_clip] = lags[linked_clip] + refined_lag
+
+        refined_pairs = {tuple(sorted(pair)) for pair in refine_pairs}
+        self.lag_pair_report = [dict(clips=[file_list[first_clip][0], file_list[second_clip][0]], lag=float(pair_lag / sample_rate), confidence=float(confidence),
+                                     residual=float(residual / sample_rate), used=bool(used), refined=(first_clip, second_clip) in refined_pairs)
+                                for (first_clip, second_clip), pair_lag, confidence, residual, used in zip(lag_pairs, pair_lags, pair_confidences, all_residuals, in_solution)]
+
+        clip_confidences, self.lag_residual_list = [], []
+        for clip in range(num_clips):
+            in_clip_pairs = np.array([clip in pair for pair in lag_pairs]) & in_solution
+            clip_confidences.append(float(pair_confidences[in_clip_pairs].max()))
+            self.lag_residual_list.append(float(np.sqrt(np.mean(all_residuals[in_clip_pairs] ** 2)) / sample_rate))
+
+        rejected_pairs = [pair_report["clips"] for pair_report in self.lag_pair_report if not pair_report["used"]]
+        print(f"solved lags from {int(in_solution.sum())} of {len(lag_pairs)} camera pairs (refining {len(refine_pairs)}), left out {rejected_pairs}")
+        print("lag residuals (seconds):", dict(zip([file[0] for file in file_list], self.lag_residual_list)))
+
+        return list(zip(lags, clip_confidences))
+
+    def find_lags(self, file_list, sample_rate, method='coarse_to_fine', max_lag_seconds=None, minimum_confidence=DEFAULT_MINIMUM_LAG_CONFIDENCE,
+                  pairs_per_camera=DEFAULT_PAIRS_PER_CAMERA, num_workers=None):
         '''Take a file list containing video and audio files, as well as the sample rate of the audio, cross correlate the audio files, and output a lag list.
         The lag list is normalized so that the lag of the latest video to start in time is 0, and all other lags are positive.
+        method is 'coarse_to_fine' (see cross_correlate_coarse_to_fine, lags to a fraction of an audio sample), 'full' (full length cross_correlate
+        of the raw audio, which needs a lot of memory for long recordings) or 'multi_reference' (see find_lags_multi_reference, coarse_to_fine lags
+        between pairs of cameras solved together, for large camera rigs or when the first camera's audio might be bad).
+        The coarse_to_fine and multi_reference correlations run num_workers at a time.
+        The confidence of each lag (NaN for 'full') is kept in self.lag_confidence_list, and clips whose confidence is
+        below minimum_confidence are flagged in self.low_confidence_clips and printed, so they can be checked by hand.
         '''
-        
-        lag_list = [self.cross_correlate(file_list[0][3],file[3])/sample_rate for file in file_list] # cross correlates all audio to the first audio file in the list
+
+        if method == 'coarse_to_fine':
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                envelopes = self.calculate_audio_envelopes(file_list, sample_rate, executor)
+                lags_and_confidences = list(executor.map(lambda file, envelope: self.cross_correlate_coarse_to_fine(file_list[0][3], file[3], sample_rate, max_lag_seconds=max_lag_seconds,
+                                                                                                                   envelope1=envelopes[0], envelope2=envelope),
+                                                         file_list, envelopes))
+        elif method == 'full':
+            lags_and_confidences = [(self.cross_correlate(file_list[0][3], file[3]), np.nan) for file in file_list] # no confidence score for the full correlation
+        elif method == 'multi_reference':
+            lags_and_confidences = self.find_lags_multi_reference(file_list, sample_rate, pairs_per_camera=pairs_per_camera, max_lag_seconds=max_lag_seconds,
+                                                                  minimum_confidence=minimum_confidence, num_workers=num_workers)
+        else:
+            raise Exception(f"unknown lag finding method {method}, use one of {LAG_METHODS}")
+
+        lag_list = [lag/sample_rate for lag, confidence in lags_and_confidences] # cross correlates all audio to the first audio file in the list
         #also divides by the audio sample rate in order to get the lag in seconds
         
+        # the first clip is correlated against itself (except with multi_reference), so its confidence doesn't say anything about the sync
+        self.lag_list = lag_list
+        self.lag_confidence_list = [confidence for lag, confidence in lags_and_confidences]
+        checked_clips = slice(0, None) if method == 'multi_reference' else slice(1, None)
+        self.low_confidence_clips = [file[0] for file, confidence in zip(file_list[checked_clips], self.lag_confidence_list[checked_clips]) if confidence < minimum_confidence]
+        print("lag confidence (peak-to-sidelobe ratio):", dict(zip([file[0] for file in file_list], self.lag_confidence_list)))
+        for clip in self.low_confidence_clips:
+            print(f"WARNING: low confidence lag for {clip}, check that its audio actually overlaps with {file_list[0][0]}")
 
         #now that we have our lag array, we subtract every value in the array from the max value
         #this creates a normalized lag array where the latest video has lag of 0
@@ -131,61 +486,328 @@ class VideoSynchTrimming:
         
         return norm_lag_list
 
-    def trim_videos(self, file_list, lag_list, base_path):
+    def get_keyframe_times(self, video_file_path):
+        '''Return the times (in seconds from the start of the video) of every keyframe in the video, only the keyframes get decoded.'''
+        ffmpeg_command = [get_setting("FFMPEG_BINARY"), "-hide_banner", "-skip_frame", "nokey", "-i", str(video_file_path),
+                          "-map", "0:v:0", "-an", "-vf", "showinfo", "-f", "null", "-"]
+        ffmpeg_process = subprocess.run(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if ffmpeg_process.returncode != 0:
+            raise Exception(f"could not read keyframes from {video_file_path}: {ffmpeg_process.stderr.decode(errors='replace')}")
+        return np.array([float(pts_time) for pts_time in re.findall(r"pts_time:\s*([-0-9.eE+]+)", ffmpeg_process.stderr.decode(errors='replace'))])
+
+    def get_video_codec(self, video_file_path):
+        '''Return the name of the codec of the first video stream (e.g. h264), as ffmpeg reports it.'''
+        return probe_videos([video_file_path])[0].video_codec
+
+    def run_ffmpeg(self, ffmpeg_arguments):
+        '''Run ffmpeg with the given arguments, throwing an exception with its error output if it fails.'''
+        ffmpeg_process = subprocess.run([get_setting("FFMPEG_BINARY"), "-hide_banner", "-v", "error", "-y"] + ffmpeg_arguments, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if ffmpeg_process.returncode != 0:
+            raise Exception(f"ffmpeg {' '.join(ffmpeg_arguments)} failed: {ffmpeg_process.stderr.decode(errors='replace')}")
+
+    def get_trim_frames(self, start_time, duration, fps):
+        '''The frames a trim keeps: the index of the frame showing at start_time, and how many frames fit in duration.
+        The lags come from the audio, so they're a hair off whole frames, which mustn't add or drop a frame.'''
+        return int(start_time * fps + 0.00001), int(duration * fps + 0.00001)
+
+    def trim_video_reencode(self, video_file_path, video_name, start_time, duration):
+        '''Frame accurate trim: re-encode every frame from start_time to start_time + duration with moviepy.'''
+        video_file = mp.VideoFileClip(str(video_file_path), audio=True)
+        first_frame, frame_count = self.get_trim_frames(start_time, duration, video_file.fps)
+        # moviepy writes a frame every 1/fps until the end time, ending half a frame early keeps float error from adding one
+        video_file.subclip(start_time, start_time + (frame_count - 0.5) / video_file.fps).write_videofile(video_name)
+        video_file.close()
+        return {"mode": "reencode"}
+
+    def trim_video_stream_copy(self, video_file_path, video_name, start_time, duration, fps):
+        '''Trim without re-encoding the whole video. The same frames as trim_video_reencode are kept, but every whole GOP (keyframe to keyframe)
+        among them is copied as it is, and only the frames before the first of those keyframes and after the last one get re-encoded (with the same codec)
+        and joined on either end. The audio is re-encoded.
+        Falls back to trim_video_reencode's moviepy re-encode (returning None) if the codec can't be matched, there's no whole GOP to copy,
+        or the copied frames don't come out as the expected run of frames (e.g. open GOP video).'''
+        codec = self.get_video_codec(video_file_path)
+        if codec not in STREAM_COPY_ENCODERS:
+            return None
+
+        # keep the same frames as trim_video_reencode
+        first_frame, frame_count = self.get_trim_frames(start_time, duration, fps)
+        end_frame = first_frame + frame_count
+
+        keyframe_times = self.get_keyframe_times(video_file_path)
+        keyframes = np.round(keyframe_times * fps).astype(int)
+        # copy from the first keyframe in the trim to the last one (which starts the GOP that's cut short, or is the end of the trim itself)
+        in_trim = (keyframes >= first_frame) & (keyframes <= end_frame)
+        if np.count_nonzero(in_trim) < 2:
+            return None
+        copy_start_frame, copy_end_frame = int(keyframes[in_trim][0]), int(keyframes[in_trim][-1])
+        # seek to the keyframe's own time, a seek even a little past it would copy the keyframe with a negative time and players would skip it
+        copy_start_time = keyframe_times[in_trim][0] + 0.000001
+
+        synced_path = Path(video_name).absolute().parent
+        temporary_file_stem = "." + Path(video_name).stem
+        head_path = synced_path / (temporary_file_stem + "_head.mp4")
+        copy_path = synced_path / (temporary_file_stem + "_copy.mp4")
+        tail_path = synced_path / (temporary_file_stem + "_tail.mp4")
+        joined_video_path = synced_path / (temporary_file_stem + "_video.mp4")
+        concat_list_path = synced_path / (temporary_file_stem + "_concat.txt")
+
+        def reencode_frames(part_start_frame, part_frame_count, part_path):
+            # seeking to half a frame before the first frame keeps it, however its time got rounded. That leaves it half a frame after 0,
+            # so its timestamps are reset to start at 0 (the output would otherwise duplicate it to fill the gap, pushing the part's last frame
+            # out of -frames:v), and the frame rate setpts drops is set again. The last frame is repeated if the video ends early (as moviepy does)
+            self.run_ffmpeg(["-ss", f"{max(part_start_frame - 0.5, 0) / fps:.6f}", "-i", str(video_file_path), "-frames:v", str(part_frame_count),
+                             "-map", "0:v:0", "-an", "-vf", f"setpts=PTS-STARTPTS,tpad=stop_mode=clone:stop={part_frame_count}", "-r", str(fps),
+                             "-c:v", STREAM_COPY_ENCODERS[codec], "-video_track_timescale", STREAM_COPY_TIMESCALE, str(part_path)])
+
+        try:
+            # the video is trimmed on its own, all the parts in a fine shared timescale so the frame times line up exactly where they're joined
+            # whole GOPs are contiguous in decode order (for closed GOPs), so copying a count of packets from a keyframe gives exactly those frames
+            self.run_ffmpeg(["-ss", f"{copy_start_time:.6f}", "-i", str(video_file_path), "-frames:v", str(copy_end_frame - copy_start_frame),
+                             "-map", "0:v:0", "-an", "-c", "copy", "-video_track_timescale", STREAM_COPY_TIMESCALE, str(copy_path)])
+            copied_frames = np.round(scan_video_packets(copy_path) * fps).astype(int)
+            if not np.array_equal(copied_frames, np.arange(copy_end_frame - copy_start_frame)):
+                return None
+
+            video_parts = [copy_path]
+            if copy_start_frame > first_frame:
+                reencode_frames(first_frame, copy_start_frame - first_frame, head_path)
+                video_parts.insert(0, head_path)
+            if end_frame > copy_end_frame:
+                reencode_frames(copy_end_frame, end_frame - copy_end_frame, tail_path)
+                video_parts.append(tail_path)
+
+            if len(video_parts) == 1:
+                joined_video_path = copy_path # the cut already lands on keyframes, nothing to re-encode
+            else:
+                # the concat demuxer puts each part's codec parameters in the stream, so the re-encoded parts don't have to match the original encoder settings
+                with open(concat_list_path, "w") as concat_list_file:
+                    concat_list_file.writelines(f"file '{video_part.as_posix()}'\n" for video_part in video_parts)
+                self.run_ffmpeg(["-f", "concat", "-safe", "0", "-i", str(concat_list_path), "-c", "copy", str(joined_video_path)])
+
+            # the audio is cut exactly at start_time and re-encoded, which is quick next to the video
+            self.run_ffmpeg(["-i", str(joined_video_path), "-ss", f"{start_time:.6f}", "-t", f"{frame_count / fps:.6f}", "-i", str(video_file_path),
+                             "-map", "0:v:0", "-map", "1:a?", "-c:v", "copy", "-c:a", "aac", "-shortest", "-movflags", "+faststart", video_name])
+        finally:
+            for temporary_path in (head_path, copy_path, tail_path, joined_video_path, concat_list_path):
+                if temporary_path.exists():
+                    temporary_path.unlink()
+
+        return {"mode": "stream_copy", "frame_count": frame_count, "keyframe_time": float(keyframe_times[in_trim][0]),
+                "reencoded_head_duration": float((copy_start_frame - first_frame) / fps), "reencoded_tail_duration": float((end_frame - copy_end_frame) / fps)}
+
+    def get_synced_video_name(self, clip):
+        '''The name of a clip's synced video, raw_Cam0.mp4 -> synced_Cam0.mp4'''
+        if clip.split("_")[0] == "raw":
+            return "synced_" + clip[4:]
+        return "synced_" + clip
+
+    def trim_videos(self, file_list, lag_list, base_path, mode='stream_copy', num_workers=None, duration=None):
         # this takes a list of video files and a list of lags, and shortens the beginning of the video by the lags, and trims the ends so they're all the same length
-        
+        # (or to the given duration, when only some of a session's videos are being trimmed)
+        # mode 'stream_copy' copies the video from the first keyframe after the lag and only re-encodes the part before that keyframe (see trim_video_stream_copy),
+        # cameras it can't be used for are re-encoded. mode 'reencode' re-encodes every frame with moviepy, which is frame accurate but slow.
+        # all the cameras are trimmed at the same time, and the mode used for each camera is saved in SyncedVideos/trim_report.json
+        if mode not in TRIM_MODES:
+            raise Exception(f"unknown trim mode {mode}, use one of {TRIM_MODES}")
+
+        video_path = (base_path / "RawVideos").absolute()
+
         # create new SyncedVideos folder
         synced_path = base_path / "SyncedVideos"
         os.makedirs(synced_path, exist_ok=True)
 
         # change directory to SyncedVideos folder
         os.chdir(synced_path)
-        
-        front_trimmed_videos = []
-
-        # for each video in the list, create a new video trimmed from the begining by the lag value for that video, and add it to the empty list
-        for i in range(len(file_list)):
-            print(file_list[i][1])
-            front_trimmed_video = file_list[i][1].subclip(lag_list[i],file_list[i][1].duration)
-            #front_trimmed_video = file_list[i][1].subclip(lag_list[i]) # this is a cleaner way of writing this, but needs testing
-            front_trimmed_videos.append([file_list[i][0], front_trimmed_video])
-        
-        print(front_trimmed_videos)
 
-        # now we find the duration of each video and add it to a list to find the shortest video duration
-        min_duration = min([video[1].duration for video in front_trimmed_videos])
-        print(f"shortest video is {min_duration}")
+        # now we find the duration of each video once the front is trimmed off by its lag, to find the shortest video duration
+        if duration is None:
+            min_duration = min([file[1].duration - lag for file, lag in zip(file_list, lag_list)])
+            print(f"shortest video is {min_duration}")
+        else:
+            min_duration = duration
 
         # create list to store names of final videos
-        video_names = []
-        # trim all videos to length of shortest video, and give it a new name
-      
-        for video in front_trimmed_videos:
-            print(video)
-            fully_trimmed_video = video[1].subclip(0,min_duration)
-            if video[0].split("_")[0] == "raw":
-                video_name = "synced_" + video[0][4:]
-            else:
-                video_name = "synced_" + video[0]
-            video_names.append(video_name) #add new name to list to reference for plotting
-            fully_trimmed_video.write_videofile(video_name)
-            print(f"Cam name: {video_name}, Video Duration: {fully_trimmed_video.duration}")
+        video_names = [self.get_synced_video_name(file[0]) for file in file_list] #add new name to list to reference for plotting
+
+        def trim_video(file, lag, video_name):
+            # trim each video from the beginning by its lag, to the length of the shortest video
+            trim_info = None
+            if mode == 'stream_copy':
+                trim_info = self.trim_video_stream_copy(video_path / file[0], video_name, lag, min_duration, file[1].fps)
+            if trim_info is None:
+                trim_info = self.trim_video_reencode(video_path / file[0], video_name, lag, min_duration)
+            print(f"Cam name: {video_name}, Video Duration: {min_duration}, trimmed with {trim_info['mode']}")
+            return dict(video_name=video_name, source_video=file[0], lag=float(lag), duration=float(min_duration), **trim_info)
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            self.trim_report = list(executor.map(trim_video, file_list, lag_list, video_names))
+
+        with open("trim_report.json", "w") as trim_report_file:
+            json.dump(self.trim_report, trim_report_file, indent=4)
 
         # reset our working directory
         os.chdir(base_path)
 
         return video_names # return names of new videos to reference for plotting
 
+    def get_source_key(self, video_file_path):
+        '''Size and modification time of a raw video, to tell if it changed since the sync manifest was saved.'''
+        file_stat = Path(video_file_path).stat()
+        return dict(size=file_stat.st_size, mtime_ns=file_stat.st_mtime_ns)
+
+    def load_sync_manifest(self, synced_path):
+        '''Load the sync manifest and fingerprints saved by sync_session, (None, None) if there aren't any (or they're from another version).'''
+        manifest_path = synced_path / SYNC_MANIFEST_FILE_NAME
+        fingerprints_path = synced_path / SYNC_FINGERPRINTS_FILE_NAME
+        if not manifest_path.exists() or not fingerprints_path.exists():
+            return None, None
+
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get("format_version") != SYNC_MANIFEST_FORMAT_VERSION:
+            return None, None
+
+        with np.load(fingerprints_path) as fingerprint_file:
+            fingerprints = {clip: fingerprint_file[clip] for clip in fingerprint_file.files}
+        return manifest, fingerprints
+
+    def save_sync_manifest(self, synced_path, manifest, fingerprints):
+        np.savez(synced_path / SYNC_FINGERPRINTS_FILE_NAME, **fingerprints)
+        with open(synced_path / SYNC_MANIFEST_FILE_NAME, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+
+    def sync_session(self, base_path, file_type="MP4", mode='stream_copy', incremental=True, num_workers=None, write_wav_files=False,
+                     minimum_confidence=DEFAULT_MINIMUM_LAG_CONFIDENCE, lag_method='coarse_to_fine'):
+        '''Sync and trim all the videos in base_path/RawVideos, and save a sync manifest in SyncedVideos recording every camera's lag, confidence,
+        trim and audio fingerprint (its audio envelope, in sync_fingerprints.npz). lag_method is find_lags' method, used whenever every camera gets synced.
+        With incremental=True and a manifest from an earlier run, only the cameras that are new (or whose raw video changed) have their audio extracted,
+        and they're synced against the reference camera's fingerprint, decoding just the excerpt of the reference's audio needed to refine the lag.
+        Only the synced videos whose trim (start or length) changed are written again: adding a camera that started last or stopped first changes every trim,
+        any other camera leaves the old synced videos as they are. The synced videos of cameras that were removed are deleted, so they don't get picked up with the others.
+        Return the names of the synced videos, the cameras that were (re)trimmed are kept in self.retrimmed_clips.'''
+
+        clip_list = self.get_clip_list(base_path, file_type)
+        video_path = base_path / "RawVideos"
+        synced_path = base_path / "SyncedVideos"
+        source_keys = {clip: self.get_source_key(video_path / clip) for clip in clip_list}
+
+        manifest, fingerprints = self.load_sync_manifest(synced_path)
+        # every synced video the last sync wrote, the ones no camera is synced to any more get deleted at the end
+        previous_video_names = {trim["video_name"] for trim in manifest["trims"].values()} if manifest is not None else set()
+        if not incremental:
+            manifest = None
+        if manifest is not None:
+            # forget the cameras that were removed or changed since the last sync, changed ones get synced again (and retrimmed) as new cameras
+            cameras = {clip: camera for clip, camera in manifest["cameras"].items() if source_keys.get(clip) == camera["source"]}
+            manifest["trims"] = {clip: trim for clip, trim in manifest["trims"].items() if clip in cameras}
+            if manifest["reference_clip"] not in cameras:
+                print(f"reference camera {manifest['reference_clip']} was removed or changed, syncing every camera again")
+                manifest = None
+
+        if manifest is None:
+            # sync every camera, the same way main used to
+            files, sr = self.get_files(base_path, clip_list, write_wav_files=write_wav_files, num_workers=num_workers)
+            self.check_rates(self.get_fps_list(files))
+            sample_rate = self.check_rates(sr)
+            self.find_lags(files, sample_rate, method=lag_method, minimum_confidence=minimum_confidence, num_workers=num_workers)
+            lags_and_confidences = zip(self.lag_list, self.lag_confidence_list)
+
+            manifest = dict(format_version=SYNC_MANIFEST_FORMAT_VERSION, reference_clip=clip_list[0], sample_rate=sample_rate, envelope_rate=DEFAULT_ENVELOPE_RATE, trims={})
+            cameras, fingerprints = {}, {}
+        else:
+            files = []
+            sample_rate = manifest["sample_rate"]
+            new_clips = [clip for clip in clip_list if clip not in cameras]
+            if new_clips:
+                files, sr = self.get_files(base_path, new_clips, write_wav_files=write_wav_files, num_workers=num_workers)
+                if self.check_rates(sr) != sample_rate:
+                    raise Exception(f"audio sample rate of {new_clips} is {sr[0]}, the synced cameras' is {sample_rate}")
+                self.check_rates(self.get_fps_list(files) + [camera["fps"] for camera in cameras.values()])
+
+            # correlate the new cameras against the reference camera's fingerprint, its audio is only decoded around each lag
+            reference_clip = manifest["reference_clip"]
+            reference_audio = AudioExcerptReader(self, video_path / reference_clip, sample_rate, cameras[reference_clip]["audio_samples"])
+            lags_and_confidences = []
+            for file in files:
+                lag, confidence = self.cross_correlate_coarse_to_fine(reference_audio, file[3], sample_rate, envelope_rate=manifest["envelope_rate"],
+                                                                      envelope1=fingerprints[reference_clip].astype(np.float64))
+                lags_and_confidences.append((lag / sample_rate, confidence))
+            print(f"synced new cameras {new_clips} against {reference_clip}, kept the lags of {list(cameras)}")
+
+        decimation_factor = max(int(sample_rate // manifest["envelope_rate"]), 1)
+        for file, (lag, confidence) in zip(files, lags_and_confidences):
+            fingerprints[file[0]] = self.calculate_audio_envelope(file[3], decimation_factor).astype(np.float32)
+            cameras[file[0]] = dict(source=source_keys[file[0]], lag=float(lag), confidence=float(confidence), duration=file[1].duration, fps=file[1].fps,
+                                    audio_samples=int(file[3].size))
+
+        # lags are saved relative to the reference camera, normalize them so the camera that started last has lag 0 (as in find_lags)
+        synced_clips = [clip for clip in clip_list if clip in cameras]
+        latest_lag = max(cameras[clip]["lag"] for clip in synced_clips)
+        norm_lags = {clip: latest_lag - cameras[clip]["lag"] for clip in synced_clips}
+        min_duration = min(cameras[clip]["duration"] - norm_lags[clip] for clip in synced_clips)
+
+        self.lag_confidence_list = [cameras[clip]["confidence"] for clip in synced_clips]
+        self.low_confidence_clips = [clip for clip in synced_clips if clip != manifest["reference_clip"] and cameras[clip]["confidence"] < minimum_confidence]
+        for clip in self.low_confidence_clips:
+            print(f"WARNING: low confidence lag for {clip}, check that its audio actually overlaps with {manifest['reference_clip']}")
+
+        # only write the synced videos whose trim changed (or that went missing)
+        previous_trims = manifest["trims"]
+        def trim_is_unchanged(clip):
+            previous_trim = previous_trims.get(clip)
+            return (previous_trim is not None and previous_trim["requested_mode"] == mode and (synced_path / previous_trim["video_name"]).exists()
+                    and abs(previous_trim["lag"] - norm_lags[clip]) < 1e-6 and abs(previous_trim["duration"] - min_duration) < 1e-6)
+        self.retrimmed_clips = [clip for clip in synced_clips if not trim_is_unchanged(clip)]
+
+        trims = {clip: previous_trims[clip] for clip in synced_clips if clip not in self.retrimmed_clips}
+        if self.retrimmed_clips:
+            video_info_list = probe_videos([video_path / clip for clip in self.retrimmed_clips], num_workers, cache_path=video_path / PROBE_CACHE_FILE_NAME)
+            trim_file_list = [[clip, video_info, None, None] for clip, video_info in zip(self.retrimmed_clips, video_info_list)]
+            self.trim_videos(trim_file_list, [norm_lags[clip] for clip in self.retrimmed_clips], base_path, mode=mode, num_workers=num_workers, duration=min_duration)
+            trims.update({clip: dict(trim_info, requested_mode=mode) for clip, trim_info in zip(self.retrimmed_clips, self.trim_report)})
+        print(f"trimmed {self.retrimmed_clips}, synced videos of {[clip for clip in synced_clips if clip not in self.retrimmed_clips]} were already up to date")
+
+        stale_video_names = sorted(previous_video_names - {trim["video_name"] for trim in trims.values()})
+        for stale_video_name in stale_video_names:
+            if (synced_path / stale_video_name).exists():
+                (synced_path / stale_video_name).unlink()
+        if stale_video_names:
+            print(f"deleted the synced videos of removed cameras: {stale_video_names}")
+
+        # the trim report covers every camera, not just the ones trimmed this time
+        self.trim_report = [trims[clip] for clip in synced_clips]
+        os.makedirs(synced_path, exist_ok=True)
+        with open(synced_path / "trim_report.json", "w") as trim_report_file:
+            json.dump(self.trim_report, trim_report_file, indent=4)
+
+        manifest.update(cameras=cameras, trims=trims, duration=min_duration)
+        self.save_sync_manifest(synced_path, manifest, {clip: fingerprints[clip] for clip in synced_clips})
+
+        return [trims[clip]["video_name"] for clip in synced_clips]
+
 def main():
     '''Run the functions from the VideoSynchTrimming class to sync all videos with the given file type in the base path folder.
-    Takes 2 command line arguments, session ID and folder path, with default arguments to allow paths to be entered manually.
+    Takes 2 command line arguments, session ID and folder path, with default arguments to allow paths to be entered manually,
+    plus an optional --write-wav flag to save the extracted audio, an optional --incremental flag to only sync the cameras added
+    (or changed) since the last run, using the sync manifest it saved, and an optional --lag-method followed by one of LAG_METHODS
+    (e.g. --lag-method multi_reference for large camera rigs).
     '''
 
     # start timer to measure performance
     start_timer = time.time()
 
-    # get arguments from command line
+    # get arguments from command line, pass --write-wav to also save the extracted audio as .wav files for debugging
     args = sys.argv[1:]
+    write_wav_files = "--write-wav" in args
+    incremental = "--incremental" in args
+    args = [arg for arg in args if arg not in ("--write-wav", "--incremental")]
+    lag_method = 'coarse_to_fine'
+    if "--lag-method" in args:
+        lag_method_index = args.index("--lag-method")
+        lag_method = args[lag_method_index + 1]
+        del args[lag_method_index:lag_method_index + 2]
+        if lag_method not in LAG_METHODS:
+            raise Exception(f"unknown lag finding method {lag_method}, use one of {LAG_METHODS}")
 
     #parse arguments from command line, with excepts covering hardcoded default values - maybe get rid of these try/except for final script
     try:
@@ -193,7 +815,7 @@ def main():
     except: 
         sessionID = "partial_charuco_test_7_27_22"
     try:
-        fmc_data_path = args[1]
+        fmc_data_path = Path(args[1])
     except: 
         fmc_data_path = Path("/Users/Philip/freemocap_data/")
 
@@ -206,24 +828,9 @@ def main():
     # set the base path and file type
     file_type = "MP4"  # should work with or without a period at the front, and in either case
     
-    # create list of video clip in base path folder
-    clip_list = synch_and_trim.get_clip_list(base_path, file_type)
-
-    # get the files and store in list
-    files, sr = synch_and_trim.get_files(base_path, clip_list)
-
-    # find the frames per second of each video
-    fps = synch_and_trim.get_fps_list(files)
-    
-    # check that our frame rates and audio sample rates are all equal
-    synch_and_trim.check_rates(fps)
-    synch_and_trim.check_rates(sr)
-    
-    # find the lags
-    lag_list = synch_and_trim.find_lags(files, synch_and_trim.check_rates(sr))
-    
-    # use lags to trim the videos
-    trimmed_videos = synch_and_trim.trim_videos(files, lag_list, base_path)
+    # get the clips, check their frame rates and audio sample rates are all equal, find the lags and use them to trim the videos
+    # (see sync_session, which also saves the sync manifest so cameras added later can be synced with --incremental)
+    trimmed_videos = synch_and_trim.sync_session(base_path, file_type, incremental=incremental, write_wav_files=write_wav_files, lag_method=lag_method)
 
     # end performance timer
     end_timer = time.time()
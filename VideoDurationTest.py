@@ -1,12 +1,14 @@
 import os
-import moviepy.editor as mp
-import librosa
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from matplotlib import pyplot as plt
 import numpy as np
 from scipy import signal
 from pathlib import Path
 
+from VideoProbe import PROBE_CACHE_FILE_NAME, probe_videos, scan_video_packets
+
 def get_clip_list(base_path, file_type):
     '''Return a list of all video files in the base_path folder that match the given file type.'''
 
@@ -29,25 +31,24 @@ def get_clip_list(base_path, file_type):
     return unique_clip_list
 
 def get_files(base_path, clip_list):
-    '''Get video files from clip_list and store them in a list.
-    Return a list of lists containing the video file name and file.
+    '''Get video info (duration, fps etc. read from the headers, see VideoProbe) for the videos in clip_list and store them in a list.
+    Return a list of lists containing the video file name and info.
     '''
 
-    # create empty list for storing video files, will contain sublists formatted like [video_file_name,video_file] 
+    # create empty list for storing video info, will contain sublists formatted like [video_file_name,video_info] 
     file_list = []
 
     video_path = base_path / "SyncedVideos"
 
-    # iterate through clip_list, open video files and store in file_list
-    for clip in clip_list:
-        # take vid_name and change extension to create audio file name
-        vid_name = clip
+    # probe all the videos at once, without opening any of them
+    video_info_list = probe_videos([video_path / clip for clip in clip_list], cache_path=video_path / PROBE_CACHE_FILE_NAME)
 
-        # open video files
-        video_file = mp.VideoFileClip(os.path.join(video_path,vid_name), audio=True)
+    # iterate through clip_list and store the video info in file_list
+    for clip, video_info in zip(clip_list, video_info_list):
+        vid_name = clip
 
-        # add name and file to file list
-        file_list.append([vid_name, video_file])
+        # add name and info to file list
+        file_list.append([vid_name, video_info])
         
 
     return file_list
@@ -71,33 +72,107 @@ def get_durations(file_list):
 
     return name_duration_list
 
-def check_durations(duration_list):
-    '''Check if video durations are equal, throw an exception if not (or if no durations are given).'''
+def check_durations(duration_list, tolerance=0.02):
+    '''Check if video durations are equal (to within tolerance seconds, container durations are rounded), throw an exception if not (or if no durations are given).'''
     duration_list_without_names = [list_item[1] for list_item in duration_list]
 
     if len(duration_list_without_names) == 0:
         raise Exception("No durations given")
     else:
-        if duration_list_without_names.count(duration_list_without_names[1]) == len(duration_list_without_names):
-            print("all rates are equal to", duration_list_without_names[1])
-            return duration_list_without_names[1]
+        if max(duration_list_without_names) - min(duration_list_without_names) <= tolerance:
+            print("all durations are equal to", duration_list_without_names[0])
+            return duration_list_without_names[0]
         else:
             raise Exception(f"durations are not equal, durations are {duration_list_without_names}")
 
-# set data paths
-fmc_data_path = Path("/Users/Philip/Documents/Humon Research Lab/Freemocap_Data/")
-sessionID = "partial_charuco_test_7_27_22"
+def compare_frame_times(frame_times, reference_frame_times, frame_duration):
+    '''Compare a video's frame times to the reference video's, both counted from their first frame.
+    Return the drift in frames (how many more frames the video has than the reference) and the first time where the two stop lining up
+    (a frame more than half a frame off, or the end of the shorter video if they only differ in length), None if every frame lines up.'''
+    drift_frames = len(frame_times) - len(reference_frame_times)
+    frame_times = frame_times - frame_times[0]
+    reference_frame_times = reference_frame_times - reference_frame_times[0]
+
+    shared_frame_count = min(len(frame_times), len(reference_frame_times))
+    divergent_frames = np.flatnonzero(np.abs(frame_times[:shared_frame_count] - reference_frame_times[:shared_frame_count]) > frame_duration / 2)
+    if divergent_frames.size > 0:
+        return drift_frames, float(reference_frame_times[divergent_frames[0]])
+    if drift_frames != 0:
+        longer_frame_times = frame_times if drift_frames > 0 else reference_frame_times
+        return drift_frames, float(longer_frame_times[shared_frame_count])
+    return drift_frames, None
+
+def verify_frame_counts(base_path, clip_list, num_workers=None):
+    '''Frame exact check of the synced videos: read every frame's timestamp from the containers (no decoding, see VideoProbe.scan_video_packets),
+    all the videos at the same time, and compare each video's frame count and frame times to the first video's.
+    Return a report with each video's frame count, drift in frames and first divergent timestamp (in seconds from the first frame),
+    and throw an exception after printing it if any video doesn't line up with the first one.'''
+    if len(clip_list) == 0:
+        raise Exception("No videos given")
+
+    video_path = base_path / "SyncedVideos"
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        frame_times_list = list(executor.map(scan_video_packets, [video_path / clip for clip in clip_list]))
+
+    reference_frame_times = frame_times_list[0]
+    frame_duration = np.median(np.diff(reference_frame_times)) if len(reference_frame_times) > 1 else np.inf
+
+    frame_count_report = []
+    for clip, frame_times in zip(clip_list, frame_times_list):
+        if len(frame_times) == 0:
+            raise Exception(f"no video frames found in {clip}")
+        drift_frames, first_divergent_time = compare_frame_times(frame_times, reference_frame_times, frame_duration)
+        frame_count_report.append(dict(video_name=clip, frame_count=len(frame_times), start_time=float(frame_times[0]),
+                                       drift_frames=drift_frames, first_divergent_time=first_divergent_time))
+        print(f"{clip}: {len(frame_times)} frames, drift {drift_frames:+d} frames, "
+              + (f"diverges from {clip_list[0]} at {first_divergent_time:.3f} s" if first_divergent_time is not None else "lines up frame for frame"))
+
+    misaligned_videos = [report["video_name"] for report in frame_count_report if report["first_divergent_time"] is not None]
+    if misaligned_videos:
+        raise Exception(f"frames don't line up with {clip_list[0]} in {misaligned_videos}")
+    print("all videos have", len(reference_frame_times), "frames")
+
+    return frame_count_report
+
+def main():
+    '''Check that the synced videos of a session all have the same duration.
+    Takes 2 command line arguments, session ID and folder path, with default arguments to allow paths to be entered manually,
+    plus an optional --verify-frames flag to also compare the videos frame by frame (from the containers' timestamps, nothing is decoded).
+    '''
+
+    # get arguments from command line
+    args = sys.argv[1:]
+    verify_frames = "--verify-frames" in args
+    args = [arg for arg in args if arg != "--verify-frames"]
+
+    # set data paths
+    try:
+        sessionID = args[0]
+    except:
+        sessionID = "partial_charuco_test_7_27_22"
+    try:
+        fmc_data_path = Path(args[1])
+    except:
+        fmc_data_path = Path("/Users/Philip/Documents/Humon Research Lab/Freemocap_Data/")
+
+    fmc_session_path = fmc_data_path / sessionID
+
+    # get list of clips in SyncedVideos folder
+    clip_list = get_clip_list(fmc_session_path, "MP4")
+
+    # get files for each video in clip list
+    clip_files = get_files(fmc_session_path, clip_list)
 
-fmc_session_path = fmc_data_path / sessionID
+    # find duration of each video file
+    duration_list = get_durations(clip_files)
 
-# get list of clips in SyncedVideos folder
-clip_list = get_clip_list(fmc_session_path, "MP4")
+    # check if all durations are equal
+    duration = check_durations(duration_list)
 
-# get files for each video in clip list
-clip_files = get_files(fmc_session_path, clip_list)
+    # check the frame counts and timestamps of every video
+    if verify_frames:
+        verify_frame_counts(fmc_session_path, clip_list)
 
-# find duration of each video file
-duration_list = get_durations(clip_files)
 
-# check if all durations are equal
-duration = check_durations(duration_list)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from moviepy.config import get_setting
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+# saved next to the videos by the sync and duration scripts, so a second run on the same folder doesn't probe anything
+PROBE_CACHE_FILE_NAME = ".video_probe_cache.json"
+
+# every probe made by this process, keyed by (path, mtime, size) so an edited or replaced video gets probed again
+_video_info_cache = {}
+
+
+class VideoInfo(NamedTuple):
+    '''What probe_video reads from a video's headers. Anything the file doesn't have (e.g. the audio of a video without audio) is None.'''
+    duration: float
+    fps: Optional[float]
+    frame_count: Optional[int]
+    width: Optional[int]
+    height: Optional[int]
+    audio_sample_rate: Optional[int]
+    video_codec: Optional[str]
+
+
+def get_ffprobe_binary():
+    '''ffprobe from the PATH or next to moviepy's ffmpeg, None if there isn't one (e.g. imageio-ffmpeg only ships ffmpeg).'''
+    ffmpeg_binary = Path(get_setting("FFMPEG_BINARY"))
+    ffprobe_next_to_ffmpeg = ffmpeg_binary.with_name(ffmpeg_binary.name.replace("ffmpeg", "ffprobe"))
+    if ffprobe_next_to_ffmpeg != ffmpeg_binary and ffprobe_next_to_ffmpeg.is_file():
+        return str(ffprobe_next_to_ffmpeg)
+    return shutil.which("ffprobe")
+
+
+def parse_frame_rate(frame_rate):
+    '''ffprobe frame rates are fractions like 30000/1001, 0/0 when it doesn't know the rate.'''
+    try:
+        frame_rate = Fraction(frame_rate)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return float(frame_rate) if frame_rate > 0 else None
+
+
+def probe_video_ffprobe(video_file_path, ffprobe_binary):
+    '''Read the video info with ffprobe, whose frame count is the one in the container (not estimated from the duration).'''
+    ffprobe_process = subprocess.run([ffprobe_binary, "-v", "error", "-of", "json",
+                                      "-show_entries", "format=duration:stream=codec_type,codec_name,width,height,avg_frame_rate,r_frame_rate,nb_frames,sample_rate",
+                                      str(video_file_path)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if ffprobe_process.returncode != 0:
+        raise Exception(f"could not probe {video_file_path}: {ffprobe_process.stderr.decode(errors='replace')}")
+    probe = json.loads(ffprobe_process.stdout)
+
+    video_stream = next((stream for stream in probe.get("streams", []) if stream.get("codec_type") == "video"), {})
+    audio_stream = next((stream for stream in probe.get("streams", []) if stream.get("codec_type") == "audio"), {})
+
+    duration = float(probe["format"]["duration"])
+    fps = parse_frame_rate(video_stream.get("avg_frame_rate", "0/0")) or parse_frame_rate(video_stream.get("r_frame_rate", "0/0"))
+    frame_count = int(video_stream["nb_frames"]) if video_stream.get("nb_frames", "N/A") != "N/A" else None
+    if frame_count is None and fps is not None:
+        frame_count = round(duration * fps) # some containers (e.g. mkv) don't store the frame count
+
+    return VideoInfo(duration=duration, fps=fps, frame_count=frame_count, width=video_stream.get("width"), height=video_stream.get("height"),
+                     audio_sample_rate=int(audio_stream["sample_rate"]) if "sample_rate" in audio_stream else None, video_codec=video_stream.get("codec_name"))
+
+
+def probe_video_ffmpeg(video_file_path):
+    '''Read the video info from the stream summary ffmpeg prints when it opens a file (what moviepy does), for when there's no ffprobe.
+    Nothing gets decoded. The frame count is estimated from the duration and fps.'''
+    ffmpeg_process = subprocess.run([get_setting("FFMPEG_BINARY"), "-hide_banner", "-i", str(video_file_path)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    ffmpeg_info = ffmpeg_process.stderr.decode(errors="replace") # ffmpeg fails without an output file, but the info is printed first
+
+    duration_match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", ffmpeg_info)
+    if duration_match is None:
+        raise Exception(f"could not probe {video_file_path}: {ffmpeg_info}")
+    hours, minutes, seconds = duration_match.groups()
+    duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    video_match = re.search(r"Stream #.*?Video: (\w+).*", ffmpeg_info)
+    video_codec, fps, width, height = None, None, None, None
+    if video_match:
+        video_codec = video_match.group(1)
+        size_match = re.search(r" (\d+)x(\d+)[,\s]", video_match.group(0))
+        fps_match = re.search(r"(\d+(?:\.\d+)?)(k?) fps", video_match.group(0)) or re.search(r"(\d+(?:\.\d+)?)(k?) tbr", video_match.group(0))
+        if size_match:
+            width, height = int(size_match.group(1)), int(size_match.group(2))
+        if fps_match:
+            fps = float(fps_match.group(1)) * (1000 if fps_match.group(2) else 1)
+
+    audio_match = re.search(r"Stream #.*?Audio: .*?(\d+) Hz", ffmpeg_info)
+
+    return VideoInfo(duration=duration, fps=fps, frame_count=round(duration * fps) if fps else None, width=width, height=height,
+                     audio_sample_rate=int(audio_match.group(1)) if audio_match else None, video_codec=video_codec)
+
+
+def probe_video(video_file_path):
+    '''Read a video's duration, fps, frame count, resolution, audio sample rate and codec from its headers, with ffprobe if there is one.'''
+    ffprobe_binary = get_ffprobe_binary()
+    if ffprobe_binary is not None:
+        return probe_video_ffprobe(video_file_path, ffprobe_binary)
+    return probe_video_ffmpeg(video_file_path)
+
+
+def clear_probe_cache(cache_path=None):
+    '''Forget every probe made so far, and delete the cache file at cache_path if there is one.'''
+    _video_info_cache.clear()
+    if cache_path is not None and Path(cache_path).exists():
+        Path(cache_path).unlink()
+
+
+def scan_video_packets(video_file_path):
+    '''Return the presentation time (in seconds, sorted) of every packet of the first video stream, one packet per frame.
+    Only the container is read (ffprobe's packet list, or ffmpeg copying the stream into its framemd5 packet list), nothing gets decoded.'''
+    ffprobe_binary = get_ffprobe_binary()
+    if ffprobe_binary is not None:
+        scan_process = subprocess.run([ffprobe_binary, "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time", "-of", "csv=p=0",
+                                       str(video_file_path)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if scan_process.returncode != 0:
+            raise Exception(f"could not scan the packets of {video_file_path}: {scan_process.stderr.decode(errors='replace')}")
+        packet_times = [float(pts_time) for pts_time in scan_process.stdout.decode().split() if pts_time.strip(",") not in ("", "N/A")]
+        return np.sort(np.array(packet_times))
+
+    scan_process = subprocess.run([get_setting("FFMPEG_BINARY"), "-hide_banner", "-v", "error", "-i", str(video_file_path),
+                                   "-map", "0:v:0", "-c", "copy", "-f", "framemd5", "-"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if scan_process.returncode != 0:
+        raise Exception(f"could not scan the packets of {video_file_path}: {scan_process.stderr.decode(errors='replace')}")
+    packet_list = scan_process.stdout.decode()
+    # the packet list is in the stream's time base, e.g. "#tb 0: 1/15360", then one "stream, dts, pts, duration, size, hash" line per packet
+    time_base = Fraction(re.search(r"^#tb 0: (\d+/\d+)", packet_list, re.MULTILINE).group(1))
+    packet_pts = [int(packet_line.split(",")[2]) for packet_line in packet_list.splitlines() if packet_line and not packet_line.startswith("#")]
+    return np.sort(np.array(packet_pts, dtype=np.int64)) * float(time_base)
+
+
+def get_cache_key(video_file_path):
+    video_file_path = Path(video_file_path).absolute()
+    file_stat = video_file_path.stat()
+    return (str(video_file_path), file_stat.st_mtime_ns, file_stat.st_size)
+
+
+def load_probe_cache(cache_path):
+    '''Load a probe cache file into the in memory cache and return the keys it had, an unreadable cache file is just ignored.'''
+    try:
+        with open(cache_path) as cache_file:
+            cached_probes = json.load(cache_file)
+    except (OSError, ValueError):
+        return []
+    cache_keys = []
+    for cached_probe in cached_probes:
+        try:
+            cache_key = tuple(cached_probe["key"])
+            _video_info_cache[cache_key] = VideoInfo(**cached_probe["info"])
+        except (KeyError, TypeError):
+            continue # written by a different version of VideoInfo
+        cache_keys.append(cache_key)
+    return cache_keys
+
+
+def save_probe_cache(cache_path, cache_keys):
+    cached_probes = [dict(key=list(cache_key), info=_video_info_cache[cache_key]._asdict()) for cache_key in cache_keys]
+    temporary_cache_path = Path(str(cache_path) + ".tmp")
+    with open(temporary_cache_path, "w") as cache_file:
+        json.dump(cached_probes, cache_file, indent=1)
+    os.replace(temporary_cache_path, cache_path)
+
+
+def probe_videos(video_file_paths, num_workers=None, cache_path=None):
+    '''Probe a list of videos at the same time (one ffprobe/ffmpeg process per video, num_workers at once), returning their VideoInfo in the same order.
+    Videos whose path, modification time and size haven't changed since they were last probed aren't probed again.
+    With a cache path, the probes are also saved to (and loaded from) that json file, so they're kept between runs.'''
+    cached_keys = load_probe_cache(cache_path) if cache_path is not None else []
+
+    cache_keys = [get_cache_key(video_file_path) for video_file_path in video_file_paths]
+    videos_to_probe = {cache_key: video_file_path for cache_key, video_file_path in zip(cache_keys, video_file_paths) if cache_key not in _video_info_cache}
+
+    if videos_to_probe:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            _video_info_cache.update(zip(videos_to_probe, executor.map(probe_video, videos_to_probe.values())))
+        if cache_path is not None:
+            # keep the other videos already in the cache file, dropping the old probes of videos that changed
+            probed_paths = {cache_key[0] for cache_key in cache_keys}
+            save_probe_cache(cache_path, [cache_key for cache_key in cached_keys if cache_key[0] not in probed_paths] + list(dict.fromkeys(cache_keys)))
+
+    return [_video_info_cache[cache_key] for cache_key in cache_keys]
@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from contextlib import contextmanager
+from datetime import datetime
+from moviepy.config import get_setting
+from scipy import signal
+from scipy.io import wavfile
+from pathlib import Path
+
+from SlimVideoSynchAndTrim import VideoSynchTrimming, LAG_METHODS, TRIM_MODES
+from VideoProbe import PROBE_CACHE_FILE_NAME, clear_probe_cache, probe_videos
+
+# each scenario is one synthetic session: every camera records the same master audio track, camera i starting offsets[i] seconds into it
+BENCHMARK_SCENARIOS = {
+    "three_cameras_chirps": dict(offsets=[0.0, 1.3, 2.7], duration=20, audio="chirps"),
+    "six_cameras_clicks": dict(offsets=[0.0, 0.45, 3.1, 1.25, 2.05, 0.8], duration=20, audio="clicks"),
+    "two_cameras_long": dict(offsets=[4.25, 0.0], duration=120, audio="chirps"),
+    "sixteen_cameras": dict(offsets=[round(0.37 * camera_number % 3.3, 2) for camera_number in range(16)], duration=15, audio="clicks"),
+    # the first camera barely hears the shared audio, which throws off every lag found against it with coarse_to_fine, so it's synced with multi_reference
+    "sixteen_cameras_noisy_first": dict(offsets=[round(0.37 * camera_number % 3.3, 2) for camera_number in range(16)], duration=15, audio="chirps",
+                                        noise_levels=[1.2] + [0.0] * 15),
+}
+# scenarios that only pass with a particular lag method are always synced with it, whatever --lag-method says (compare_lag_methods still shows the others)
+SCENARIO_LAG_METHODS = {"sixteen_cameras_noisy_first": "multi_reference"}
+SCENARIO_DEFAULTS = dict(fps=30, sample_rate=48000, keyframe_interval=60, frame_size="640x480", seed=0, noise_levels=None)
+BENCHMARK_STAGES = ["get_clip_list", "get_files", "find_lags", "trim_videos"]
+# find_lags is also timed with each of these on every scenario, whichever --lag-method is used for the sync ('full' needs too much memory on long sessions)
+COMPARED_LAG_METHODS = ["coarse_to_fine", "multi_reference"]
+SESSION_INFO_FILE_NAME = "synthetic_session.json"
+
+
+def make_master_audio(total_duration, sample_rate, audio, seed):
+    '''Make the audio track all the cameras record, 'chirps' (frequency sweeps) or 'clicks' (short broadband bursts) at random times
+    over a little background noise. The events are spaced randomly so the audio never repeats and there's only one lag that lines it up.'''
+    rng = np.random.default_rng(seed)
+    master_audio = rng.normal(scale=0.01, size=int(total_duration * sample_rate))
+
+    event_time = rng.uniform(0.1, 0.5)
+    while event_time < total_duration - 0.5:
+        event_start = int(event_time * sample_rate)
+        if audio == "chirps":
+            event_length = rng.uniform(0.1, 0.4)
+            t = np.arange(int(event_length * sample_rate)) / sample_rate
+            event = 0.5 * signal.chirp(t, f0=rng.uniform(200, 2000), t1=event_length, f1=rng.uniform(2000, 8000)) * np.hanning(len(t))
+        elif audio == "clicks":
+            event = rng.normal(scale=0.5, size=int(0.002 * sample_rate))
+        else:
+            raise Exception(f"unknown audio type {audio}, use 'chirps' or 'clicks'")
+        master_audio[event_start:event_start + len(event)] += event
+        event_time += rng.uniform(0.2, 0.8)
+
+    return np.clip(master_audio, -1, 1).astype(np.float32)
+
+
+def generate_synthetic_session(session_path, offsets, duration, audio="chirps", fps=30, sample_rate=48000, keyframe_interval=60, frame_size="640x480", seed=0,
+                               noise_levels=None):
+    '''Write a session folder with a RawVideos/raw_Cam{i}.mp4 test pattern video per camera, each with the master audio starting offsets[i] seconds in,
+    plus noise_levels[i] (standard deviation) of its own noise if given.
+    The test pattern's timer counts master time, so synced videos should all show the same time on the same frame.
+    Return the ground truth lag of each clip, the lag find_lags should give it.'''
+    raw_video_path = session_path / "RawVideos"
+    os.makedirs(raw_video_path, exist_ok=True)
+
+    total_duration = max(offsets) + duration + 1
+    master_audio = make_master_audio(total_duration, sample_rate, audio, seed)
+    noise_levels = noise_levels or [0.0] * len(offsets)
+    rng = np.random.default_rng(seed + 1)
+    camera_audio_path = session_path / "camera_audio.wav"
+
+    expected_lags = {}
+    for camera_number, (offset, noise_level) in enumerate(zip(offsets, noise_levels)):
+        clip = f"raw_Cam{camera_number}.mp4"
+        camera_audio = master_audio[int(round(offset * sample_rate)):][:int(duration * sample_rate)]
+        camera_audio = np.clip(camera_audio + rng.normal(scale=noise_level, size=camera_audio.size), -1, 1).astype(np.float32)
+        wavfile.write(str(camera_audio_path), sample_rate, camera_audio)
+        subprocess.run([get_setting("FFMPEG_BINARY"), "-hide_banner", "-v", "error", "-y",
+                        "-ss", f"{offset:.6f}", "-f", "lavfi", "-i", f"testsrc=size={frame_size}:rate={fps}:duration={total_duration}",
+                        "-i", str(camera_audio_path), "-t", f"{duration:.6f}",
+                        "-c:v", "libx264", "-pix_fmt", "yuv420p", "-g", str(keyframe_interval), "-c:a", "aac", "-ar", str(sample_rate),
+                        str(raw_video_path / clip)], check=True)
+        # the camera that started last gets lag 0, every other camera is trimmed by how much earlier it started
+        expected_lags[clip] = max(offsets) - offset
+
+    camera_audio_path.unlink()
+    return expected_lags
+
+
+def get_synthetic_session(work_path, scenario_name, scenario):
+    '''Generate the scenario's session in the work folder, or reuse it if it was already generated with the same settings.'''
+    session_path = work_path / scenario_name
+    session_info_path = session_path / SESSION_INFO_FILE_NAME
+    if session_info_path.exists():
+        with open(session_info_path) as session_info_file:
+            session_info = json.load(session_info_file)
+        if session_info["scenario"] == scenario:
+            return session_path, session_info["expected_lags"]
+
+    shutil.rmtree(session_path, ignore_errors=True)
+    print(f"generating synthetic session {scenario_name}: {len(scenario['offsets'])} cameras, {scenario['duration']} s, {scenario['audio']}")
+    expected_lags = generate_synthetic_session(session_path, **scenario)
+    with open(session_info_path, "w") as session_info_file:
+        json.dump(dict(scenario=scenario, expected_lags=expected_lags), session_info_file, indent=4)
+    return session_path, expected_lags
+
+
+@contextmanager
+def time_stage(stage_times, stage):
+    start_timer = time.perf_counter()
+    yield
+    stage_times[stage] = time.perf_counter() - start_timer
+
+
+def calculate_lag_errors(clip_list, lag_list, expected_lags):
+    '''How far (in seconds) each clip's lag is from the ground truth.'''
+    return {clip: lag - expected_lags[clip] for clip, lag in zip(clip_list, lag_list)}
+
+
+def run_synch_and_trim(session_path, expected_lags, fps, trim_mode="stream_copy", lag_method="coarse_to_fine"):
+    '''Run the VideoSynchTrimming stages the same way SlimVideoSynchAndTrim's main does, timing each one, and check the lags against the ground truth.'''
+    shutil.rmtree(session_path / "SyncedVideos", ignore_errors=True)
+    clear_probe_cache(session_path / "RawVideos" / PROBE_CACHE_FILE_NAME) # time the first run on a folder, not a rerun with every video already probed
+    synch_and_trim = VideoSynchTrimming()
+    stage_times = {}
+    working_directory = os.getcwd() # the class changes directory as it goes
+
+    try:
+        with time_stage(stage_times, "get_clip_list"):
+            # glob order depends on the file system, sorting it makes raw_Cam0 the reference camera the scenarios are written around
+            clip_list = sorted(synch_and_trim.get_clip_list(session_path, "MP4"))
+        with time_stage(stage_times, "get_files"):
+            files, sr = synch_and_trim.get_files(session_path, clip_list)
+        with time_stage(stage_times, "find_lags"):
+            lag_list = synch_and_trim.find_lags(files, synch_and_trim.check_rates(sr), method=lag_method)
+        with time_stage(stage_times, "trim_videos"):
+            trimmed_videos = synch_and_trim.trim_videos(files, lag_list, session_path, mode=trim_mode)
+    finally:
+        os.chdir(working_directory)
+
+    lag_errors = calculate_lag_errors(clip_list, lag_list, expected_lags)
+    synced_video_infos = probe_videos([session_path / "SyncedVideos" / video_name for video_name in trimmed_videos])
+    synced_video_durations = {video_name: video_info.duration for video_name, video_info in zip(trimmed_videos, synced_video_infos)}
+
+    return dict(
+        stage_times=stage_times,
+        lag_errors=lag_errors,
+        max_lag_error_frames=max(abs(lag_error) for lag_error in lag_errors.values()) * fps,
+        lag_confidences=dict(zip(clip_list, synch_and_trim.lag_confidence_list)),
+        low_confidence_clips=synch_and_trim.low_confidence_clips,
+        trim_modes={trim_info["video_name"]: trim_info["mode"] for trim_info in synch_and_trim.trim_report},
+        synced_video_durations=synced_video_durations,
+    )
+
+
+def compare_lag_methods(session_path, expected_lags, fps, repeats=3, lag_methods=COMPARED_LAG_METHODS):
+    '''Time find_lags with each of lag_methods on the same extracted audio (the median over repeats), along with each method's max lag error in frames.'''
+    synch_and_trim = VideoSynchTrimming()
+    working_directory = os.getcwd() # the class changes directory as it goes
+    try:
+        clip_list = sorted(synch_and_trim.get_clip_list(session_path, "MP4"))
+        files, sr = synch_and_trim.get_files(session_path, clip_list)
+    finally:
+        os.chdir(working_directory)
+    sample_rate = synch_and_trim.check_rates(sr)
+
+    lag_method_results = {}
+    for lag_method in lag_methods:
+        find_lags_times = []
+        for repeat in range(repeats):
+            start_timer = time.perf_counter()
+            lag_list = synch_and_trim.find_lags(files, sample_rate, method=lag_method)
+            find_lags_times.append(time.perf_counter() - start_timer)
+        lag_errors = calculate_lag_errors(clip_list, lag_list, expected_lags)
+        lag_method_results[lag_method] = dict(find_lags_time=statistics.median(find_lags_times), find_lags_times_all_repeats=find_lags_times,
+                                              max_lag_error_frames=max(abs(lag_error) for lag_error in lag_errors.values()) * fps)
+    return lag_method_results
+
+
+def benchmark_scenario(work_path, scenario_name, scenario, repeats=3, trim_mode="stream_copy", lag_method="coarse_to_fine", max_lag_error_frames=0.5):
+    '''Run a scenario repeats times and summarize it, the stage times are the median over the repeats, and compare the lag methods' find_lags times
+    (see compare_lag_methods). The scenario passes if every lag is within max_lag_error_frames of the ground truth and the synced videos all have the same duration.'''
+    session_path, expected_lags = get_synthetic_session(work_path, scenario_name, scenario)
+    runs = [run_synch_and_trim(session_path, expected_lags, scenario["fps"], trim_mode, lag_method) for repeat in range(repeats)]
+
+    last_run = runs[-1]
+    synced_video_durations = list(last_run["synced_video_durations"].values())
+    duration_spread = max(synced_video_durations) - min(synced_video_durations)
+    max_lag_error = max(run["max_lag_error_frames"] for run in runs)
+
+    return dict(
+        scenario=scenario,
+        lag_method=lag_method,
+        expected_lags=expected_lags,
+        stage_times={stage: statistics.median(run["stage_times"][stage] for run in runs) for stage in BENCHMARK_STAGES},
+        stage_times_all_repeats={stage: [run["stage_times"][stage] for run in runs] for stage in BENCHMARK_STAGES},
+        total_time=statistics.median(sum(run["stage_times"].values()) for run in runs),
+        lag_errors=last_run["lag_errors"],
+        max_lag_error_frames=max_lag_error,
+        lag_confidences=last_run["lag_confidences"],
+        low_confidence_clips=last_run["low_confidence_clips"],
+        trim_modes=last_run["trim_modes"],
+        synced_video_duration_spread=duration_spread,
+        lag_methods=compare_lag_methods(session_path, expected_lags, scenario["fps"], repeats),
+        passed=bool(max_lag_error <= max_lag_error_frames and duration_spread <= 1 / scenario["fps"]),
+    )
+
+
+def get_git_info():
+    '''The commit being benchmarked, and whether the working tree had uncommitted changes (None if this isn't a git checkout).'''
+    repo_path = Path(__file__).absolute().parent
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_path, capture_output=True, text=True, check=True).stdout.strip()
+        uncommitted_changes = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo_path, capture_output=True, text=True, check=True).stdout.strip() != ""
+    except (OSError, subprocess.CalledProcessError):
+        return dict(commit=None, uncommitted_changes=None)
+    return dict(commit=commit, uncommitted_changes=uncommitted_changes)
+
+
+def compare_results(results, baseline_results):
+    '''Print how much each stage's time changed from a previous results file, e.g. one made on another commit.'''
+    print(f"compared to {baseline_results['git']['commit']} ({baseline_results['date']}):")
+    for scenario_name, scenario_results in results["scenarios"].items():
+        if scenario_name not in baseline_results["scenarios"]:
+            continue
+        baseline_stage_times = baseline_results["scenarios"][scenario_name]["stage_times"]
+        for stage, stage_time in scenario_results["stage_times"].items():
+            if stage in baseline_stage_times:
+                print(f"  {scenario_name} {stage}: {baseline_stage_times[stage]:.3f} s -> {stage_time:.3f} s ({stage_time / baseline_stage_times[stage]:.2f}x)")
+
+
+def main():
+    '''Benchmark SlimVideoSynchAndTrim on synthetic sessions with known lags, and save the stage times and lag accuracy as json
+    so runs on different commits can be compared, e.g.
+        python VideoSynchBenchmark.py --output before.json
+        (change something)
+        python VideoSynchBenchmark.py --output after.json --compare before.json
+    '''
+    parser = argparse.ArgumentParser(description="Time each stage of the video sync and trim on synthetic sessions and check the lags against the ground truth")
+    parser.add_argument("--scenarios", nargs="+", default=list(BENCHMARK_SCENARIOS), choices=list(BENCHMARK_SCENARIOS), help="which scenarios to run (defaults to all)")
+    parser.add_argument("--work-folder", type=Path, default=Path(tempfile.gettempdir()) / "video_synch_benchmark",
+                        help="where the synthetic sessions are generated, they're reused between runs")
+    parser.add_argument("--repeats", type=int, default=3, help="how many times each scenario is run, stage times are the median")
+    parser.add_argument("--trim-mode", default="stream_copy", choices=TRIM_MODES)
+    parser.add_argument("--lag-method", default="coarse_to_fine", choices=LAG_METHODS)
+    parser.add_argument("--max-lag-error-frames", type=float, default=0.5, help="a scenario fails if any lag is further than this from the ground truth")
+    parser.add_argument("--output", type=Path, default=None, help="results json path (defaults to video_synch_benchmark_<commit>_<date>.json in the work folder)")
+    parser.add_argument("--compare", type=Path, default=None, help="a previous results json to compare the stage times to")
+    args = parser.parse_args()
+
+    work_path = args.work_folder.absolute()
+    os.makedirs(work_path, exist_ok=True)
+
+    results = dict(
+        date=datetime.now().isoformat(timespec="seconds"),
+        git=get_git_info(),
+        python=sys.version.split()[0],
+        platform=platform.platform(),
+        cpu_count=os.cpu_count(),
+        ffmpeg=get_setting("FFMPEG_BINARY"),
+        settings=dict(repeats=args.repeats, trim_mode=args.trim_mode, lag_method=args.lag_method, max_lag_error_frames=args.max_lag_error_frames),
+        scenarios={},
+    )
+
+    for scenario_name in args.scenarios:
+        scenario = dict(SCENARIO_DEFAULTS, **BENCHMARK_SCENARIOS[scenario_name])
+        lag_method = SCENARIO_LAG_METHODS.get(scenario_name, args.lag_method)
+        results["scenarios"][scenario_name] = benchmark_scenario(work_path, scenario_name, scenario, args.repeats, args.trim_mode, lag_method, args.max_lag_error_frames)
+
+    output_path = args.output
+    if output_path is None:
+        output_path = work_path / f"video_synch_benchmark_{(results['git']['commit'] or 'nogit')[:8]}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(output_path, "w") as output_file:
+        json.dump(results, output_file, indent=4)
+
+    for scenario_name, scenario_results in results["scenarios"].items():
+        stage_times = ", ".join(f"{stage} {stage_time:.3f} s" for stage, stage_time in scenario_results["stage_times"].items())
+        print(f"{scenario_name}: {'PASSED' if scenario_results['passed'] else 'FAILED'}, max lag error {scenario_results['max_lag_error_frames']:.3f} frames, {stage_times}")
+        lag_method_times = ", ".join(f"{lag_method} {lag_method_results['find_lags_time']:.3f} s (max lag error {lag_method_results['max_lag_error_frames']:.3f} frames)"
+                                     for lag_method, lag_method_results in scenario_results["lag_methods"].items())
+        print(f"    find_lags by lag method: {lag_method_times}")
+    print("results saved to", output_path)
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            compare_results(results, json.load(baseline_file))
+
+    if not all(scenario_results["passed"] for scenario_results in results["scenarios"].values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Reprocess many freemocap sessions at once with the filter/align/COM pipeline.
+
+Run from the repo root, e.g.:
+    python -m freemocap_post_processing.batch_runner "D:/FreeMoCapProject/FreeMocap_Data" --overrides overrides.json --workers 4
+
+The overrides file is a json dictionary of pipeline parameters (see DEFAULT_PIPELINE_PARAMETERS) keyed by session ID.
+Parameters under the '*' key apply to every session, and a session's own entry wins over them:
+    {"*": {"cutoff": 6}, "sesh_2022-09-19_16_16_50_in_class_jsm": {"good_frame": 475}}
+
+Every finished session (whether it worked or not) gets a line in the batch log, so rerunning the same command skips the
+sessions that already finished with the same parameters and picks up from where the last batch stopped.
+"""
+import argparse
+import json
+import time
+import traceback
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+from rich.progress import track
+
+from freemocap_post_processing.pipeline import build_pipeline_parameters, find_sessions, process_session
+from freemocap_post_processing.stage_cache import DEFAULT_MAX_CACHE_SIZE_BYTES, StageCache
+
+
+BATCH_LOG_FILE_NAME = 'freemocap_batch_log.jsonl'
+ALL_SESSIONS_KEY = '*'
+
+
+def load_parameter_overrides(overrides_path) -> dict:
+    if overrides_path is None:
+        return {}
+    with open(overrides_path) as overrides_file:
+        return json.load(overrides_file)
+
+
+def get_session_parameters(session_id: str, parameter_overrides: dict) -> dict:
+    session_parameter_overrides = dict(parameter_overrides.get(ALL_SESSIONS_KEY, {}))
+    session_parameter_overrides.update(parameter_overrides.get(session_id, {}))
+    return build_pipeline_parameters(session_parameter_overrides)
+
+
+def load_completed_sessions(batch_log_path) -> dict:
+    """The parameters of the latest successful run of each session in the batch log, keyed by session ID"""
+    completed_sessions = {}
+    batch_log_path = Path(batch_log_path)
+    if not batch_log_path.exists():
+        return completed_sessions
+
+    with open(batch_log_path) as batch_log_file:
+        for line in batch_log_file:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue #a line cut short by a batch that got killed mid write
+            if record['status'] == 'completed':
+                completed_sessions[record['session_id']] = record['parameters']
+            else:
+                completed_sessions.pop(record['session_id'], None)
+
+    return completed_sessions
+
+
+def append_to_batch_log(batch_log_path, record: dict):
+    #one line per session, flushed straight away so a killed batch only ever loses the sessions still running
+    with open(batch_log_path, 'a') as batch_log_file:
+        batch_log_file.write(json.dumps(record) + '\n')
+
+
+def run_session(session_folder_path, parameters: dict, stage_cache: StageCache = None) -> dict:
+    """Process one session, catching any error so one bad session doesn't take down the rest of the batch"""
+    record = {'session_id': Path(session_folder_path).name, 'parameters': parameters}
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    try:
+        record.update(process_session(session_folder_path, parameters, stage_cache=stage_cache))
+        record['status'] = 'completed'
+    except Exception as error:
+        record['status'] = 'failed'
+        record['error'] = repr(error)
+        record['traceback'] = traceback.format_exc()
+    finally:
+        record['wall_time_s'] = time.perf_counter() - start_time
+        record['peak_memory_mb'] = tracemalloc.get_traced_memory()[1]/1e6 #numpy allocations are traced, memory mapped files are not
+        tracemalloc.stop()
+
+    record['finished_at'] = datetime.now().isoformat(timespec='seconds')
+    return record
+
+
+def run_batch(freemocap_data_folder_path, parameter_overrides: dict = None, num_workers: int = None, batch_log_path=None, resume: bool = True, session_ids: list = None,
+              stage_cache: StageCache = None) -> list:
+    """
+    Run the pipeline on every session under the FreeMocap_Data folder across a pool of processes.
+
+    Input:
+        freemocap data folder path: the folder holding all the session folders
+        parameter overrides: pipeline parameters keyed by session ID (and/or ALL_SESSIONS_KEY)
+        num workers: number of processes to use, None for one per cpu
+        batch log path: the jsonl log of finished sessions, defaults to BATCH_LOG_FILE_NAME in the data folder
+        resume: skip sessions that already completed with the same parameters according to the batch log
+        session ids: only run these sessions
+        stage cache: a StageCache shared by all the sessions, so only the stages whose parameters changed get recomputed
+
+    Output:
+        the batch log records of the sessions run in this batch
+    """
+    freemocap_data_folder_path = Path(freemocap_data_folder_path)
+    parameter_overrides = parameter_overrides or {}
+    batch_log_path = Path(batch_log_path) if batch_log_path is not None else freemocap_data_folder_path/BATCH_LOG_FILE_NAME
+
+    session_folder_paths = find_sessions(freemocap_data_folder_path)
+    if session_ids is not None:
+        session_folder_paths = [session_folder_path for session_folder_path in session_folder_paths if session_folder_path.name in session_ids]
+
+    completed_sessions = load_completed_sessions(batch_log_path) if resume else {}
+
+    sessions_to_run = {}
+    for session_folder_path in session_folder_paths:
+        parameters = get_session_parameters(session_folder_path.name, parameter_overrides)
+        if completed_sessions.get(session_folder_path.name) == parameters:
+            continue
+        sessions_to_run[session_folder_path] = parameters
+
+    print(f'Found {len(session_folder_paths)} sessions, {len(session_folder_paths) - len(sessions_to_run)} already done, running {len(sessions_to_run)}')
+
+    batch_records = []
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(run_session, session_folder_path, parameters, stage_cache): (session_folder_path, parameters)
+                   for session_folder_path, parameters in sessions_to_run.items()}
+
+        for future in track(as_completed(futures), total=len(futures), description='Processing sessions'):
+            session_folder_path, parameters = futures[future]
+            try:
+                record = future.result()
+            except Exception as error:
+                #the worker process itself died (e.g. it ran out of memory), so run_session never got to catch anything
+                record = {'session_id': session_folder_path.name, 'parameters': parameters, 'status': 'failed', 'error': repr(error),
+                          'finished_at': datetime.now().isoformat(timespec='seconds')}
+
+            append_to_batch_log(batch_log_path, record)
+            batch_records.append(record)
+
+            if record['status'] == 'completed':
+                print(f"{record['session_id']}: done in {record['wall_time_s']:.1f} s, peak memory {record['peak_memory_mb']:.0f} MB, good frame {record['good_frame']}")
+            else:
+                print(f"{record['session_id']}: FAILED - {record['error']}")
+
+    num_failed = sum(record['status'] != 'completed' for record in batch_records)
+    print(f'Finished {len(batch_records) - num_failed} sessions, {num_failed} failed (see {batch_log_path})')
+
+    return batch_records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the freemocap filter/align/COM pipeline on every session in a FreeMocap_Data folder')
+    parser.add_argument('freemocap_data_folder', type=Path, help='the folder holding the session folders')
+    parser.add_argument('--overrides', type=Path, default=None, help='json file of pipeline parameters keyed by session ID (or * for every session)')
+    parser.add_argument('--workers', type=int, default=None, help='number of sessions to process at once (defaults to one per cpu)')
+    parser.add_argument('--log', type=Path, default=None, help=f'batch log path (defaults to {BATCH_LOG_FILE_NAME} in the data folder)')
+    parser.add_argument('--sessions', nargs='+', default=None, help='only process these session IDs')
+    parser.add_argument('--rerun', action='store_true', help="rerun sessions even if the batch log says they're already done")
+    parser.add_argument('--cache', type=Path, default=None, help='stage cache folder, so rerun sessions only recompute the stages whose parameters changed')
+    parser.add_argument('--cache-size-gb', type=float, default=DEFAULT_MAX_CACHE_SIZE_BYTES/1024**3, help='the least recently used cache entries are deleted past this size')
+    args = parser.parse_args()
+
+    stage_cache = StageCache(args.cache, max_size_bytes=int(args.cache_size_gb*1024**3)) if args.cache is not None else None
+
+    batch_records = run_batch(args.freemocap_data_folder, load_parameter_overrides(args.overrides), num_workers=args.workers,
+                              batch_log_path=args.log, resume=not args.rerun, session_ids=args.sessions, stage_cache=stage_cache)
+
+    if any(record['status'] != 'completed' for record in batch_records):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import numpy as np
+
+
+def calculate_segment_COM(segment_array: np.ndarray, segment_COM_lengths, out: np.ndarray = None) -> np.ndarray:
+    """
+    Calculate the center of mass of every segment for every frame in one broadcast.
+
+    Input:
+        segment array: a (frames, segments, 2, 3) array of the proximal and distal XYZ of each segment (see SegmentDefinition)
+        segment COM lengths: the distance from the proximal joint to the segment COM, as a fraction of the segment
+                             length (one value per segment, from the Winter tables)
+        out: optional (frames, segments, 3) float array to write the segment COMs into
+
+    Output:
+        segment COM: a (frames, segments, 3) array of segment COM XYZ. Segments with a missing endpoint come out as NaN
+    """
+    segment_COM_lengths = np.asarray(segment_COM_lengths, dtype=np.float64)
+    if segment_COM_lengths.shape != (segment_array.shape[1],):
+        raise ValueError(f"Expected {segment_array.shape[1]} segment COM lengths, got {segment_COM_lengths.shape}")
+
+    proximal_XYZ = segment_array[:, :, 0, :]
+    distal_XYZ = segment_array[:, :, 1, :]
+
+    if out is None:
+        out = np.empty(proximal_XYZ.shape, dtype=np.result_type(segment_array.dtype, np.float32))
+
+    #proximal + length*(distal - proximal)
+    np.subtract(distal_XYZ, proximal_XYZ, out=out)
+    out *= segment_COM_lengths[np.newaxis, :, np.newaxis]
+    out += proximal_XYZ
+
+    return out
+
+
+def calculate_total_body_COM(segment_COM: np.ndarray, segment_COM_percentages, minimum_mass_fraction: float = 0.) -> np.ndarray:
+    """
+    Calculate the total body center of mass for every frame as a mass weighted sum of the segment COMs.
+
+    When a segment is missing (NaN) on a frame, the weights of the segments that are there get renormalised to sum
+    to 1, so the total body COM stays the COM of the tracked segments rather than getting pulled toward the origin.
+
+    Input:
+        segment COM: a (frames, segments, 3) array from calculate_segment_COM
+        segment COM percentages: each segment's fraction of total body mass (one value per segment, from the Winter tables)
+        minimum mass fraction: frames where the tracked segments make up less than this fraction of the total mass
+                               are set to NaN instead of being estimated from too little of the body
+
+    Output:
+        total body COM: a (frames, 3) array of total body COM XYZ
+    """
+    segment_COM_percentages = np.asarray(segment_COM_percentages, dtype=np.float64)
+    if segment_COM_percentages.shape != (segment_COM.shape[1],):
+        raise ValueError(f"Expected {segment_COM.shape[1]} segment COM percentages, got {segment_COM_percentages.shape}")
+
+    segment_is_tracked = np.all(np.isfinite(segment_COM), axis=2)
+    segment_weights = np.where(segment_is_tracked, segment_COM_percentages, 0.)
+
+    tracked_mass_fraction = segment_weights.sum(axis=1) / segment_COM_percentages.sum()
+    weighted_segment_COM_sum = np.einsum('fs,fsx->fx', segment_weights, np.where(segment_is_tracked[:, :, np.newaxis], segment_COM, 0.))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        total_body_COM = weighted_segment_COM_sum / segment_weights.sum(axis=1, keepdims=True)
+
+    total_body_COM[(tracked_mass_fraction <= 0) | (tracked_mass_fraction < minimum_mass_fraction)] = np.nan
+
+    return total_body_COM
@@ -0,0 +1,115 @@
+from functools import lru_cache
+
+import numpy as np
+from scipy import signal
+
+
+OUTPUT_DTYPES = [np.float32, np.float64]
+
+
+@lru_cache(maxsize=None)
+def design_butter_lowpass_filter(cutoff: float, sampling_rate: float, order: int, use_sos: bool = False):
+    """
+    Get the coefficients for a low pass butterworth filter. Each set of filter settings is only designed once,
+    later calls with the same settings get the cached coefficients (so don't modify the returned arrays)
+
+    Output:
+        sos: the second order sections array, if use_sos is True
+        (b, a): the numerator/denominator polynomials otherwise
+    """
+    nyquist_freq = 0.5*sampling_rate
+    normal_cutoff = cutoff / nyquist_freq
+    if use_sos:
+        return signal.butter(order, normal_cutoff, btype='low', analog=False, output='sos')
+    return signal.butter(order, normal_cutoff, btype='low', analog=False)
+
+
+def calculate_filtfilt_padding(cutoff, sampling_rate, order, use_sos=False) -> int:
+    """How many samples filtfilt/sosfiltfilt pad each end of the signal with by default, for these filter settings"""
+    if use_sos:
+        sos = design_butter_lowpass_filter(cutoff, sampling_rate, order, use_sos=True)
+        return 3*(2*len(sos) + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum()))
+    b, a = design_butter_lowpass_filter(cutoff, sampling_rate, order)
+    return 3*max(len(a), len(b))
+
+
+def butter_lowpass_filter(data, cutoff, sampling_rate, order, axis=0, use_sos=False, padlen=None):
+    """
+    Run a zero phase low pass butterworth filter along one axis of the data (the frame axis by default),
+    which filters every column of a multi column array at once
+
+    use_sos filters with second order sections, which stays numerically stable at high orders or low cutoffs
+    where the (b, a) form can blow up. padlen overrides filtfilt's default padding (see calculate_filtfilt_padding)
+    """
+    if use_sos:
+        sos = design_butter_lowpass_filter(cutoff, sampling_rate, order, use_sos=True)
+        return signal.sosfiltfilt(sos, data, axis=axis, padlen=padlen)
+
+    b, a = design_butter_lowpass_filter(cutoff, sampling_rate, order)
+    return signal.filtfilt(b, a, data, axis=axis, padlen=padlen)
+
+
+def butter_lowpass_filter_finite_runs(column_data, cutoff, sampling_rate, order, use_sos=False):
+    """
+    Filter a (frames, columns) array that has NaNs in it (e.g. gaps longer than fill_gaps' max_gap), filtering each run
+    of finite samples of each column on its own so the NaNs stay where they are instead of spreading over the whole column.
+
+    Columns with the same missing data pattern (e.g. the 3 axes of a marker) are filtered together, and runs shorter than
+    filtfilt's padding are filtered with as much padding as they have samples for
+    """
+    filtered_column_data = np.full(column_data.shape, np.nan)
+    missing_data_mask = ~np.isfinite(column_data)
+    filtfilt_padding = calculate_filtfilt_padding(cutoff, sampling_rate, order, use_sos=use_sos)
+
+    missing_data_patterns, pattern_of_each_column = np.unique(missing_data_mask.T, axis=0, return_inverse=True)
+    pattern_of_each_column = pattern_of_each_column.reshape(-1)
+
+    for pattern_number, missing_data_pattern in enumerate(missing_data_patterns):
+        pattern_columns = np.flatnonzero(pattern_of_each_column == pattern_number)
+        #a run starts where the pattern goes from missing to valid, and ends where it goes back to missing
+        run_edges = np.diff(np.concatenate([[True], missing_data_pattern, [True]]).astype(np.int8))
+        for run_start, run_end in zip(np.flatnonzero(run_edges == -1), np.flatnonzero(run_edges == 1)):
+            filtered_column_data[run_start:run_end, pattern_columns] = butter_lowpass_filter(column_data[run_start:run_end, pattern_columns], cutoff, sampling_rate, order,
+                                                                                             axis=0, use_sos=use_sos, padlen=min(filtfilt_padding, run_end - run_start - 1))
+
+    return filtered_column_data
+
+
+def filter_skeleton(skeleton_3d_data, cutoff, sampling_rate, order, use_sos=False, out=None, dtype=np.float64, markers_per_block=64):
+    """
+    Take in a 3d skeleton numpy array and run a low pass butterworth filter on each marker in the data.
+    Markers with NaNs left in them (gaps longer than fill_gaps' max_gap) are filtered a run of finite frames at a time,
+    and stay NaN in those gaps
+
+    Input:
+        skeleton 3d data: a (frames, markers, 3) numpy array of skeleton data in freemocap format
+        cutoff, sampling rate, order: the butterworth filter settings
+        use sos: filter with second order sections instead of (b, a) coefficients
+        out: optional float32/float64 array with the same shape to write the filtered data into. This can be the
+             skeleton data itself (to filter in place) or a memory mapped array
+        dtype: float32 or float64, the dtype of the output array when out isn't given
+        markers per block: how many markers get filtered together, which bounds the size of the temporary arrays
+
+    Output:
+        filtered data: the filtered skeleton data (the 'out' array, if one was given)
+    """
+    if out is None:
+        if dtype not in OUTPUT_DTYPES:
+            raise ValueError(f"dtype must be one of {OUTPUT_DTYPES}, got {dtype}")
+        out = np.empty(skeleton_3d_data.shape, dtype=dtype)
+    elif out.shape != skeleton_3d_data.shape or out.dtype.type not in OUTPUT_DTYPES:
+        raise ValueError(f"out must be a float32 or float64 array of shape {skeleton_3d_data.shape}, got a {out.dtype} array of shape {out.shape}")
+
+    num_markers = skeleton_3d_data.shape[1]
+    for block_start in range(0, num_markers, markers_per_block):
+        block_markers = slice(block_start, block_start + markers_per_block)
+        #always filter in float64, the result gets cast to the output dtype when it is written
+        marker_block_data = np.asarray(skeleton_3d_data[:, block_markers, :], dtype=np.float64)
+        if np.isfinite(marker_block_data).all():
+            out[:, block_markers, :] = butter_lowpass_filter(marker_block_data, cutoff, sampling_rate, order, axis=0, use_sos=use_sos)
+        else:
+            marker_block_shape = marker_block_data.shape
+            out[:, block_markers, :] = butter_lowpass_filter_finite_runs(marker_block_data.reshape(marker_block_shape[0], -1), cutoff, sampling_rate, order,
+                                                                         use_sos=use_sos).reshape(marker_block_shape)
+
+    return out
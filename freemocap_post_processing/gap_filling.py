@@ -0,0 +1,155 @@
+import numpy as np
+from scipy.interpolate import CubicSpline
+
+
+GAP_FILLING_METHODS = ['linear', 'cubic']
+EDGE_FILL_METHODS = ['mean', 'nearest', None]
+
+
+def find_neighbouring_valid_frames(missing_data_mask: np.ndarray):
+    """
+    For every sample of a (frames, columns) missing data mask, find the closest frame before and after it that has data.
+
+    Output:
+        previous valid frame: -1 where there is no valid frame before the sample
+        next valid frame: num_frames where there is no valid frame after the sample
+    """
+    num_frames = missing_data_mask.shape[0]
+    frame_numbers = np.arange(num_frames, dtype=np.int64)[:, np.newaxis]
+
+    previous_valid_frame = np.where(missing_data_mask, -1, frame_numbers)
+    np.maximum.accumulate(previous_valid_frame, axis=0, out=previous_valid_frame)
+
+    next_valid_frame = np.where(missing_data_mask, num_frames, frame_numbers)[::-1]
+    next_valid_frame = np.minimum.accumulate(next_valid_frame, axis=0)[::-1]
+
+    return previous_valid_frame, next_valid_frame
+
+
+def calculate_observed_column_means(column_data: np.ndarray, missing_data_mask: np.ndarray) -> np.ndarray:
+    """Mean of the observed (non NaN) samples in each column, NaN for columns with no data at all"""
+    observed_sample_count = np.count_nonzero(~missing_data_mask, axis=0)
+    observed_sample_sum = np.where(missing_data_mask, 0, column_data).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return observed_sample_sum/observed_sample_count
+
+
+def fill_interior_gaps_linear(column_data, filled_column_data, gap_mask, previous_valid_frame, next_valid_frame):
+    """Draw a straight line across each interior gap, between the valid samples on either side of it"""
+    gap_frames, gap_columns = np.nonzero(gap_mask)
+    gap_start_frames = previous_valid_frame[gap_frames, gap_columns]
+    gap_end_frames = next_valid_frame[gap_frames, gap_columns]
+
+    gap_start_values = column_data[gap_start_frames, gap_columns]
+    gap_end_values = column_data[gap_end_frames, gap_columns]
+    fraction_of_gap = (gap_frames - gap_start_frames)/(gap_end_frames - gap_start_frames)
+
+    filled_column_data[gap_frames, gap_columns] = gap_start_values + fraction_of_gap*(gap_end_values - gap_start_values)
+
+
+def fill_interior_gaps_cubic(column_data, filled_column_data, missing_data_mask, gap_mask):
+    """
+    Fit a cubic spline through the valid samples of each column and use it to fill the interior gaps.
+
+    Columns with the same missing data pattern (e.g. the 3 axes of a marker, or every marker of a hand that dropped out)
+    share their spline knots, so they are fit together as one multi column spline.
+    """
+    columns_with_gaps = np.flatnonzero(gap_mask.any(axis=0))
+    if columns_with_gaps.size == 0:
+        return
+
+    missing_data_patterns, pattern_of_each_column = np.unique(missing_data_mask[:, columns_with_gaps].T, axis=0, return_inverse=True)
+    pattern_of_each_column = pattern_of_each_column.reshape(-1)
+
+    for pattern_number, missing_data_pattern in enumerate(missing_data_patterns):
+        valid_frames = np.flatnonzero(~missing_data_pattern)
+        if valid_frames.size < 2:
+            continue
+
+        pattern_columns = columns_with_gaps[pattern_of_each_column == pattern_number]
+        gap_frames = np.flatnonzero(gap_mask[:, pattern_columns[0]]) #every column with this pattern has the same gaps
+        if gap_frames.size == 0:
+            continue
+
+        spline = CubicSpline(valid_frames, column_data[np.ix_(valid_frames, pattern_columns)], axis=0)
+        filled_column_data[np.ix_(gap_frames, pattern_columns)] = spline(gap_frames)
+
+
+def fill_edge_gaps(column_data, filled_column_data, missing_data_mask, previous_valid_frame, next_valid_frame, edge_fill):
+    """Fill the NaNs before the first and after the last valid sample of each column (each axis of each marker separately)"""
+    leading_gap_mask = missing_data_mask & (previous_valid_frame < 0)
+    trailing_gap_mask = missing_data_mask & (next_valid_frame >= column_data.shape[0])
+
+    if edge_fill == 'mean':
+        observed_column_means = calculate_observed_column_means(column_data, missing_data_mask)
+        edge_gap_mask = leading_gap_mask | trailing_gap_mask
+        filled_column_data[edge_gap_mask] = np.broadcast_to(observed_column_means, column_data.shape)[edge_gap_mask]
+
+    elif edge_fill == 'nearest':
+        #columns with no data at all have nothing to hold, so they are left as NaN
+        leading_frames, leading_columns = np.nonzero(leading_gap_mask & (next_valid_frame < column_data.shape[0]))
+        filled_column_data[leading_frames, leading_columns] = column_data[next_valid_frame[leading_frames, leading_columns], leading_columns]
+
+        trailing_frames, trailing_columns = np.nonzero(trailing_gap_mask & (previous_valid_frame >= 0))
+        filled_column_data[trailing_frames, trailing_columns] = column_data[previous_valid_frame[trailing_frames, trailing_columns], trailing_columns]
+
+
+def fill_gaps(freemocap_marker_data: np.ndarray, method: str = 'linear', max_gap: int = None, edge_fill: str = 'mean', out: np.ndarray = None, columns_per_block: int = 512):
+    """
+    Takes in a 3d skeleton numpy array from freemocap and fills in missing (NaN) values for every marker and axis in one pass
+
+    Input:
+        freemocap marker data: a (frames, markers, 3) numpy array of skeleton data in freemocap format
+        method: 'linear' or 'cubic' (spline through the valid samples) interpolation across interior gaps
+        max gap: if given, only gaps of at most this many frames get interpolated, longer gaps stay NaN
+                 (filter_skeleton filters around them, so they stay NaN through the rest of the pipeline)
+        edge fill: how to fill the NaNs before the first/after the last valid sample of each axis of each marker.
+                   'mean' uses the mean of that axis' observed samples, 'nearest' holds the first/last valid sample,
+                   None leaves them as NaN
+        out: optional float array with the same shape to write the filled data into (any memory layout)
+        columns_per_block: how many marker axes are filled at a time (rounded down to whole markers), which bounds the size of the temporary arrays
+
+    Output:
+        filled data: the gap filled skeleton data (the 'out' array, if one was given)
+        gap map: a boolean (frames, markers, 3) array that is True for every sample that was synthesised by the gap filling
+    """
+    if method not in GAP_FILLING_METHODS:
+        raise ValueError(f"method must be one of {GAP_FILLING_METHODS}, got {method!r}")
+    if edge_fill not in EDGE_FILL_METHODS:
+        raise ValueError(f"edge_fill must be one of {EDGE_FILL_METHODS}, got {edge_fill!r}")
+
+    num_frames, num_markers, num_axes = freemocap_marker_data.shape
+    if out is None:
+        out = np.empty(freemocap_marker_data.shape, dtype=np.float64)
+    elif out.shape != freemocap_marker_data.shape or not np.issubdtype(out.dtype, np.floating):
+        raise ValueError(f"out must be a float array of shape {freemocap_marker_data.shape}, got a {out.dtype} array of shape {out.shape}")
+    gap_map = np.zeros(freemocap_marker_data.shape, dtype=bool)
+
+    #treat every axis of every marker as its own column so the whole session can be filled with array operations.
+    #the blocks are whole markers, read and written by indexing so neither array has to be contiguous
+    markers_per_block = max(columns_per_block//num_axes, 1)
+    for block_start in range(0, num_markers, markers_per_block):
+        block_markers = slice(block_start, block_start + markers_per_block)
+        column_data = np.asarray(freemocap_marker_data[:, block_markers, :], dtype=np.float64).reshape(num_frames, -1)
+        filled_column_data = column_data.copy()
+
+        missing_data_mask = ~np.isfinite(column_data)
+        if missing_data_mask.any():
+            previous_valid_frame, next_valid_frame = find_neighbouring_valid_frames(missing_data_mask)
+
+            interior_gap_mask = missing_data_mask & (previous_valid_frame >= 0) & (next_valid_frame < num_frames)
+            if max_gap is not None:
+                interior_gap_mask &= (next_valid_frame - previous_valid_frame - 1) <= max_gap
+
+            if method == 'linear':
+                fill_interior_gaps_linear(column_data, filled_column_data, interior_gap_mask, previous_valid_frame, next_valid_frame)
+            else:
+                fill_interior_gaps_cubic(column_data, filled_column_data, missing_data_mask, interior_gap_mask)
+
+            fill_edge_gaps(column_data, filled_column_data, missing_data_mask, previous_valid_frame, next_valid_frame, edge_fill)
+
+            gap_map[:, block_markers, :] = (missing_data_mask & np.isfinite(filled_column_data)).reshape(num_frames, -1, num_axes)
+
+        out[:, block_markers, :] = filled_column_data.reshape(num_frames, -1, num_axes)
+
+    return out, gap_map
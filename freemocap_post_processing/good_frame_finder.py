@@ -0,0 +1,59 @@
+import numpy as np
+
+
+FOOT_MARKER_NAMES = ['right_heel', 'right_foot_index', 'left_heel', 'left_foot_index']
+
+
+def calculate_foot_stillness_score(skeleton_data: np.ndarray, skeleton_indices: list, foot_marker_names: list = FOOT_MARKER_NAMES, axes: tuple = (0, 1, 2)) -> np.ndarray:
+    """
+    Score how still the feet are at every frame, in one vectorized pass over the session.
+
+    The score of a frame is the speed (distance moved since the previous frame, using the given axes) of whichever
+    foot marker moved the most, so a lower score means stiller feet. Frame 0 has no previous frame and frames with
+    missing data can't be scored, so they get a score of infinity.
+    """
+    foot_marker_indices = [skeleton_indices.index(marker_name) for marker_name in foot_marker_names]
+    foot_marker_data = np.asarray(skeleton_data[:, foot_marker_indices, :], dtype=np.float64)[:, :, list(axes)]
+
+    foot_marker_velocity = np.diff(foot_marker_data, axis=0)
+    foot_marker_speed = np.sqrt(np.sum(foot_marker_velocity**2, axis=2))
+
+    foot_stillness_score = np.full(skeleton_data.shape[0], np.inf)
+    foot_stillness_score[1:] = np.max(foot_marker_speed, axis=1) #add 1 to account for the difference in indices between the position and velocity data
+    foot_stillness_score[~np.isfinite(foot_stillness_score)] = np.inf
+
+    return foot_stillness_score
+
+
+def find_good_frame(skeleton_data, skeleton_indices: list, exclusion_window: tuple = (0, 75), top_k: int = None, foot_marker_names: list = FOOT_MARKER_NAMES, axes: tuple = (0, 1, 2)):
+    """
+    Finds a frame (called the good frame) where the velocity of both feet are closest to 0
+
+    Input:
+        skeleton data: a 3D numpy array of skeleton data in freemocap format
+        skeleton indices: a list of joints being tracked by mediapipe/your 2d pose estimator
+        exclusion window: (first frame, last frame) range of frames that can't be picked, e.g. to skip the start of the
+                          recording where the subject is still walking into place. None to search every frame
+        top k: if given, return the k best frames (best first) instead of just the best one
+        foot marker names: the markers that have to be still
+        axes: which axes to measure the foot velocity along (all three by default)
+
+    Output:
+        good frame: the frame with the stillest feet (or an array of the top k frames). Frames that tie are ranked
+                    by frame number, so the result is always the same for the same data
+    """
+    foot_stillness_score = calculate_foot_stillness_score(skeleton_data, skeleton_indices, foot_marker_names, axes)
+
+    if exclusion_window is not None:
+        foot_stillness_score[exclusion_window[0]:exclusion_window[1] + 1] = np.inf
+
+    #a stable sort keeps tied frames in frame order, so the earliest of any tied frames wins
+    ranked_frames = np.argsort(foot_stillness_score, kind='stable')
+    ranked_frames = ranked_frames[np.isfinite(foot_stillness_score[ranked_frames])]
+
+    if ranked_frames.size == 0:
+        raise ValueError('No frames left to pick a good frame from, check the exclusion window and for missing foot data')
+
+    if top_k is not None:
+        return ranked_frames[:top_k]
+    return int(ranked_frames[0])
@@ -0,0 +1,120 @@
+mediapipe_indices = [
+    'nose',
+    'left_eye_inner',
+    'left_eye',
+    'left_eye_outer',
+    'right_eye_inner',
+    'right_eye',
+    'right_eye_outer',
+    'left_ear',
+    'right_ear',
+    'mouth_left',
+    'mouth_right',
+    'left_shoulder',
+    'right_shoulder',
+    'left_elbow',
+    'right_elbow',
+    'left_wrist',
+    'right_wrist',
+    'left_pinky',
+    'right_pinky',
+    'left_index',
+    'right_index',
+    'left_thumb',
+    'right_thumb',
+    'left_hip',
+    'right_hip',
+    'left_knee',
+    'right_knee',
+    'left_ankle',
+    'right_ankle',
+    'left_heel',
+    'right_heel',
+    'left_foot_index',
+    'right_foot_index'
+    ]
+
+
+#values for segment weight and segment mass percentages taken from Winter anthropometry tables
+#https://imgur.com/a/aD74j
+#Winter, D.A. (2005) Biomechanics and Motor Control of Human Movement. 3rd Edition, John Wiley & Sons, Inc., Hoboken.
+
+segments = [
+'head',
+'trunk',
+'right_upper_arm',
+'left_upper_arm',
+'right_forearm',
+'left_forearm',
+'right_hand',
+'left_hand',
+'right_thigh',
+'left_thigh',
+'right_shin',
+'left_shin',
+'right_foot',
+'left_foot'
+]
+
+joint_connections = [
+['left_ear','right_ear'],
+['mid_chest_marker', 'mid_hip_marker'],
+['right_shoulder','right_elbow'],
+['left_shoulder','left_elbow'],
+['right_elbow', 'right_wrist'],
+['left_elbow', 'left_wrist'],
+['right_wrist', 'right_hand_marker'],
+['left_wrist', 'left_hand_marker'],
+['right_hip', 'right_knee'],
+['left_hip', 'left_knee'],
+['right_knee', 'right_ankle'],
+['left_knee', 'left_ankle'],
+['right_back_of_foot_marker', 'right_foot_index'],
+['left_back_of_foot_marker', 'left_foot_index']
+]
+
+segment_COM_lengths = [
+.5,
+.5,
+.436,
+.436,
+.430,
+.430,
+.506,
+.506,
+.433,
+.433,
+.433,
+.433,
+.5,
+.5
+]
+
+segment_COM_percentages = [
+.081,
+.497,
+.028,
+.028,
+.016,
+.016,
+.006,
+.006,
+.1,
+.1,
+.0465,
+.0465,
+.0145,
+.0145
+]
+
+
+#the joint connections above use some markers that mediapipe doesn't track. Each of these virtual markers is the
+#average of the mediapipe markers listed for it (or just stands in for a single marker)
+virtual_marker_definitions = {
+    'mid_chest_marker': ['left_shoulder', 'right_shoulder'],
+    'mid_hip_marker': ['left_hip', 'right_hip'],
+    'right_hand_marker': ['right_index'],
+    'left_hand_marker': ['left_index'],
+    'right_back_of_foot_marker': ['right_ankle'],
+    'left_back_of_foot_marker': ['left_ankle'],
+}
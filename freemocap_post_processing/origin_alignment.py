@@ -0,0 +1,161 @@
+import numpy as np
+
+
+def create_vector(point1, point2):
+    """Put two points in, make a vector"""
+    vector = point2 - point1
+    return vector
+
+
+def calculate_unit_vector(vector):
+    """Take in a vector, make it a unit vector"""
+    unit_vector = vector/np.linalg.norm(vector)
+    return unit_vector
+
+
+def calculate_mid_point_XYZ_coordinates(single_frame_skeleton_data, first_index, second_index):
+    """Take in two marker indices, and calculate the point halfway between them (i.e. mid hip, shoulder center, mid foot)"""
+    mid_point_XYZ_coordinates = (single_frame_skeleton_data[first_index, :] + single_frame_skeleton_data[second_index, :])/2
+    return mid_point_XYZ_coordinates
+
+
+def calculate_skewed_symmetric_cross_product(cross_product_vector):
+    #needed in the calculate_rotation_matrix function
+    skew_symmetric_cross_product = np.array([[0, -cross_product_vector[2], cross_product_vector[1]],
+                                             [cross_product_vector[2], 0, -cross_product_vector[0]],
+                                             [-cross_product_vector[1], cross_product_vector[0], 0]])
+    return skew_symmetric_cross_product
+
+
+def calculate_rotation_matrix(vector1, vector2):
+    """Put in two vectors to calculate the rotation matrix between those two vectors"""
+    #based on the code found here: https://math.stackexchange.com/questions/180418/calculate-rotation-matrix-to-align-vector-a-to-vector-b-in-3d"""
+
+    identity_matrix = np.identity(3)
+    vector_cross_product = np.cross(vector1, vector2)
+    vector_dot_product = np.dot(vector1, vector2)
+    skew_symmetric_cross_product = calculate_skewed_symmetric_cross_product(vector_cross_product)
+    rotation_matrix = identity_matrix + skew_symmetric_cross_product + (np.dot(skew_symmetric_cross_product, skew_symmetric_cross_product))*(1 - vector_dot_product)/(np.linalg.norm(vector_cross_product)**2)
+
+    return rotation_matrix
+
+
+def compose_rotation_matrices(*rotation_matrices):
+    """
+    Combine several rotation matrices into one matrix.
+
+    The matrices are given in the order they would be applied, so compose_rotation_matrices(first, second)
+    gives the same result as rotating by 'first' and then rotating the result by 'second'.
+    """
+    composed_rotation_matrix = np.identity(3)
+    for rotation_matrix in rotation_matrices:
+        composed_rotation_matrix = rotation_matrix @ composed_rotation_matrix
+    return composed_rotation_matrix
+
+
+def apply_rigid_transform(skeleton_data: np.ndarray, rotation_matrix: np.ndarray, translation_vector: np.ndarray, out: np.ndarray = None, frames_per_chunk: int = 4096) -> np.ndarray:
+    """
+    Translate every point in the skeleton by -translation_vector and then rotate it with rotation_matrix,
+    for every frame at once.
+
+    Input:
+        skeleton data: a (frames, markers, 3) numpy array of skeleton data in freemocap format
+        rotation matrix: a 3x3 rotation matrix (use compose_rotation_matrices to combine several rotations)
+        translation vector: the XYZ point that ends up at the origin
+        out: array to write the result into. Pass the skeleton data itself to transform it in place,
+             leave as None to get a new array
+        frames per chunk: how many frames are transformed per batch, which bounds the size of the temporary array
+
+    Output:
+        the transformed skeleton data (the 'out' array, if one was given)
+    """
+    if out is None:
+        out = np.empty(skeleton_data.shape, dtype=np.result_type(skeleton_data.dtype, np.float64))
+
+    #points are stored as rows, so rotating every point is a right multiply by the transposed matrix
+    transposed_rotation_matrix = np.ascontiguousarray(np.asarray(rotation_matrix, dtype=out.dtype).T)
+    translation_vector = np.asarray(translation_vector, dtype=out.dtype)
+
+    num_frames = skeleton_data.shape[0]
+    for chunk_start in range(0, num_frames, frames_per_chunk):
+        chunk_end = min(chunk_start + frames_per_chunk, num_frames)
+        translated_chunk = np.subtract(skeleton_data[chunk_start:chunk_end], translation_vector)
+        np.matmul(translated_chunk, transposed_rotation_matrix, out=out[chunk_start:chunk_end])
+
+    return out
+
+
+def calculate_origin_alignment_transform(skeleton_data: np.ndarray, skeleton_indices: list, good_frame: int):
+    """
+    Work out the translation and the combined rotation that align_skeleton_with_origin applies, using only the good frame.
+
+    Output:
+        translation vector: the mid foot point at the good frame, which gets moved to the origin
+        foot rotation matrix: rotates the heel vector onto -x so the skeleton faces +y
+        spine rotation matrix: rotates the (foot rotated) spine vector onto +z
+    """
+    left_shoulder_index = skeleton_indices.index('left_shoulder')
+    right_shoulder_index = skeleton_indices.index('right_shoulder')
+
+    left_hip_index = skeleton_indices.index('left_hip')
+    right_hip_index = skeleton_indices.index('right_hip')
+
+    left_heel_index = skeleton_indices.index('left_heel')
+    right_heel_index = skeleton_indices.index('right_heel')
+
+    x_vector = np.array([1, 0, 0])
+    z_vector = np.array([0, 0, 1])
+
+    good_frame_skeleton_data = np.asarray(skeleton_data[good_frame, :, :], dtype=np.float64)
+
+    #translating the skeleton doesn't change any of the vectors between markers, so only the rotations need the translated data
+    translation_vector = calculate_mid_point_XYZ_coordinates(good_frame_skeleton_data, left_heel_index, right_heel_index)
+
+    #rotate the skeleton to face the +y direction
+    heel_vector = create_vector(good_frame_skeleton_data[right_heel_index, :], good_frame_skeleton_data[left_heel_index, :])
+    foot_rotation_matrix = calculate_rotation_matrix(calculate_unit_vector(heel_vector), -1*x_vector)
+
+    #rotate the skeleton so that the spine is aligned with +z
+    mid_hip_XYZ = calculate_mid_point_XYZ_coordinates(good_frame_skeleton_data, left_hip_index, right_hip_index)
+    mid_shoulder_XYZ = calculate_mid_point_XYZ_coordinates(good_frame_skeleton_data, left_shoulder_index, right_shoulder_index)
+    y_aligned_spine_vector = foot_rotation_matrix @ create_vector(mid_hip_XYZ, mid_shoulder_XYZ)
+    spine_rotation_matrix = calculate_rotation_matrix(calculate_unit_vector(y_aligned_spine_vector), z_vector)
+
+    return translation_vector, foot_rotation_matrix, spine_rotation_matrix
+
+
+def align_skeleton_with_origin(skeleton_data: np.ndarray, skeleton_indices: list, good_frame: int, return_intermediate_stages: bool = True, in_place: bool = False):
+    """
+    Takes in freemocap skeleton data and translates the skeleton to the origin, and then rotates the data
+    so that the skeleton is facing the +y direction and standing in the +z direction
+
+    The translation and both rotations are worked out from the good frame and then applied to every frame
+    as one batched array operation, with the two rotations composed into a single matrix.
+
+    Input:
+        skeleton data: a 3D numpy array of skeleton data in freemocap format
+        skeleton indices: a list of joints being tracked by mediapipe/your 2d pose estimator
+        good frame: the frame that you want to base the rotation on (can be entered manually,
+                    or use find_good_frame to calculate it)
+        return intermediate stages: if True, also build and return the foot translated and y aligned
+                    skeletons (an extra full size array each). Set to False when you only need the final data
+        in place: if True, overwrite skeleton_data with the aligned data instead of allocating a new array
+                    (skeleton_data needs to be a float array)
+
+    Output:
+        if return_intermediate_stages is True: (spine aligned, y aligned, foot translated) skeleton data, like before
+        otherwise: just the spine aligned skeleton data, a 3d numpy array of the origin aligned data in freemocap format
+    """
+    translation_vector, foot_rotation_matrix, spine_rotation_matrix = calculate_origin_alignment_transform(skeleton_data, skeleton_indices, good_frame)
+
+    if return_intermediate_stages:
+        no_rotation = np.identity(3)
+        foot_translated_skeleton_data = apply_rigid_transform(skeleton_data, no_rotation, translation_vector)
+        y_aligned_skeleton_data = apply_rigid_transform(foot_translated_skeleton_data, foot_rotation_matrix, np.zeros(3))
+        spine_aligned_skeleton_data = apply_rigid_transform(y_aligned_skeleton_data, spine_rotation_matrix, np.zeros(3), out=skeleton_data if in_place else None)
+        return spine_aligned_skeleton_data, y_aligned_skeleton_data, foot_translated_skeleton_data
+
+    origin_alignment_rotation_matrix = compose_rotation_matrices(foot_rotation_matrix, spine_rotation_matrix)
+    spine_aligned_skeleton_data = apply_rigid_transform(skeleton_data, origin_alignment_rotation_matrix, translation_vector, out=skeleton_data if in_place else None)
+
+    return spine_aligned_skeleton_data
@@ -0,0 +1,190 @@
+from pathlib import Path
+
+import numpy as np
+
+from freemocap_post_processing.center_of_mass import calculate_segment_COM, calculate_total_body_COM
+from freemocap_post_processing.filtering import filter_skeleton
+from freemocap_post_processing.gap_filling import fill_gaps
+from freemocap_post_processing.good_frame_finder import find_good_frame
+from freemocap_post_processing.mediapipe_skeleton_definitions import mediapipe_indices, segments, joint_connections, segment_COM_lengths, segment_COM_percentages, virtual_marker_definitions
+from freemocap_post_processing.origin_alignment import align_skeleton_with_origin
+from freemocap_post_processing.segment_skeleton import SegmentDefinition
+from freemocap_post_processing.session_container import COMPRESSION_METHODS, SESSION_CONTAINER_FILE_NAME, write_session_container
+from freemocap_post_processing.stage_cache import CachedStage, StageCache, calculate_stage_key, write_output_if_changed
+from freemocap_post_processing.streaming import run_streaming_pipeline
+
+
+#the same settings the runme notebook uses, every one of these can be overridden per session
+DEFAULT_PIPELINE_PARAMETERS = {
+    'sampling_rate': 30,
+    'cutoff': 10,
+    'order': 4,
+    'use_sos': False,
+    'gap_filling_method': 'linear',
+    'max_gap': None,
+    'edge_fill': 'mean',
+    'good_frame': None, #None finds the good frame from the filtered data
+    'good_frame_exclusion_window': [0, 75],
+    'use_streaming': False,
+    'frames_per_chunk': 4096,
+    'session_container_dtype': None, #e.g. 'float32' to halve the size of the session container
+    'session_container_compression': 'deflate',
+    'save_npy_files': True, #also save the outputs as separate .npy files, for tools that read those (freemocap, blender scripts...)
+}
+
+INPUT_FILE_NAME = 'mediaPipeSkel_3d.npy'
+
+#saved only with save_npy_files, the session container holds everything but the filtered data
+#(the streaming pipeline writes the filtered and origin aligned data to disk as it goes, and deletes them once the container is written without save_npy_files)
+NPY_OUTPUT_FILE_NAMES = {
+    'filtered': 'mediaPipeSkel_3d_filtered.npy',
+    'origin_aligned': 'mediaPipeSkel_3d_origin_aligned.npy',
+    'segment_COM': 'segmentedCOM_frame_joint_XYZ.npy',
+    'total_body_COM': 'totalBodyCOM_frame_XYZ.npy',
+}
+
+
+def build_pipeline_parameters(parameter_overrides: dict = None) -> dict:
+    """Fill in DEFAULT_PIPELINE_PARAMETERS with the given overrides, raising on any parameter the pipeline doesn't know"""
+    parameter_overrides = parameter_overrides or {}
+    unknown_parameters = set(parameter_overrides) - set(DEFAULT_PIPELINE_PARAMETERS)
+    if unknown_parameters:
+        raise ValueError(f"Unknown pipeline parameters {sorted(unknown_parameters)}, expected some of {sorted(DEFAULT_PIPELINE_PARAMETERS)}")
+
+    parameters = dict(DEFAULT_PIPELINE_PARAMETERS)
+    parameters.update(parameter_overrides)
+
+    if parameters['session_container_compression'] not in COMPRESSION_METHODS:
+        raise ValueError(f"session_container_compression has to be one of {list(COMPRESSION_METHODS)}")
+
+    if parameters['use_streaming'] and parameters['gap_filling_method'] != 'linear':
+        raise ValueError("The streaming pipeline only fills gaps with the 'linear' method")
+
+    return parameters
+
+
+def find_sessions(freemocap_data_folder_path) -> list:
+    """Every session folder directly under the FreeMocap_Data folder that has 3d mediapipe data, sorted by name"""
+    freemocap_data_folder_path = Path(freemocap_data_folder_path)
+    return sorted(session_folder_path for session_folder_path in freemocap_data_folder_path.iterdir()
+                  if (session_folder_path/'DataArrays'/INPUT_FILE_NAME).is_file())
+
+
+def process_session(session_folder_path, parameter_overrides: dict = None, stage_cache: StageCache = None) -> dict:
+    """
+    Run interpolate -> filter -> align -> COM on one freemocap session and save the origin aligned skeleton, segments,
+    segment and total body COM into a session container (SESSION_CONTAINER_FILE_NAME) in the session's DataArrays
+    folder, along with the gap map (which samples were filled in rather than tracked), the marker and segment names,
+    fps and good frame. With save_npy_files, the outputs are also saved as the .npy files in NPY_OUTPUT_FILE_NAMES.
+    Gaps longer than max_gap stay NaN all the way through to the COM.
+    With use_streaming, the interpolated data and gap map the streaming pipeline writes to disk are deleted once the session container
+    (which has the gap map) is written, so the same files are left as without it.
+
+    Input:
+        session folder path: the freemocap session folder (the one holding DataArrays)
+        parameter overrides: a dictionary of DEFAULT_PIPELINE_PARAMETERS values to change for this session
+        stage cache: if given, every stage is looked up in (and saved to) this cache, so only the stages downstream of
+                     a changed parameter get recomputed and outputs that didn't change aren't rewritten.
+                     The streaming pipeline writes its outputs straight to disk, so only its COM stage is cached
+
+    Output:
+        a dictionary with the good frame that was used and the paths of the saved outputs
+    """
+    parameters = build_pipeline_parameters(parameter_overrides)
+    data_array_path = Path(session_folder_path)/'DataArrays'
+    output_paths = {output: data_array_path/file_name for output, file_name in NPY_OUTPUT_FILE_NAMES.items()} if parameters['save_npy_files'] else {}
+    input_key = stage_cache.hash_input_file(data_array_path/INPUT_FILE_NAME) if stage_cache is not None else None
+
+    if parameters['use_streaming']:
+        streamed_output_paths, good_frame = run_streaming_pipeline(data_array_path/INPUT_FILE_NAME, data_array_path, mediapipe_indices, parameters['good_frame'],
+                                                                   parameters['cutoff'], parameters['sampling_rate'], parameters['order'],
+                                                                   use_sos=parameters['use_sos'], max_gap=parameters['max_gap'], edge_fill=parameters['edge_fill'],
+                                                                   frames_per_chunk=parameters['frames_per_chunk'],
+                                                                   good_frame_exclusion_window=parameters['good_frame_exclusion_window'])
+        output_paths.update(streamed_output_paths)
+        streamed_parameters = {parameter: value for parameter, value in parameters.items() if parameter != 'good_frame'}
+        streamed_parameters['found_good_frame'] = good_frame
+        get_gap_map = lambda: np.load(streamed_output_paths['gap_map'], mmap_mode='r')
+        #the streamed outputs are already on disk, so this stage only gives the COM stage its key
+        origin_aligned_stage = CachedStage(stage_cache, 'streamed', streamed_parameters,
+                                           lambda: {'origin_aligned': np.load(streamed_output_paths['origin_aligned'], mmap_mode='r')},
+                                           upstream_key=input_key, cache_arrays=False)
+
+    else:
+        #with a stage cache, the upstream arrays might still be needed after a stage runs, so nothing is processed in place
+        in_place = stage_cache is None
+
+        interpolated_stage = CachedStage(stage_cache, 'interpolated',
+                                         {parameter: parameters[parameter] for parameter in ('gap_filling_method', 'max_gap', 'edge_fill')},
+                                         lambda: dict(zip(('interpolated', 'gap_map'), fill_gaps(np.load(data_array_path/INPUT_FILE_NAME), method=parameters['gap_filling_method'],
+                                                                                                 max_gap=parameters['max_gap'], edge_fill=parameters['edge_fill']))),
+                                         upstream_key=input_key)
+
+        filtered_stage = CachedStage(stage_cache, 'filtered',
+                                     {parameter: parameters[parameter] for parameter in ('cutoff', 'sampling_rate', 'order', 'use_sos')},
+                                     lambda interpolated: {'filtered': filter_skeleton(interpolated['interpolated'], parameters['cutoff'], parameters['sampling_rate'], parameters['order'],
+                                                                                       use_sos=parameters['use_sos'], out=interpolated['interpolated'] if in_place else None)},
+                                     upstream=interpolated_stage)
+
+        def align_filtered_data(filtered):
+            good_frame = parameters['good_frame']
+            if good_frame is None:
+                good_frame = find_good_frame(filtered['filtered'], mediapipe_indices, exclusion_window=parameters['good_frame_exclusion_window'])
+            origin_aligned_freemocap_marker_data = align_skeleton_with_origin(filtered['filtered'], mediapipe_indices, good_frame, return_intermediate_stages=False, in_place=in_place)
+            return {'origin_aligned': origin_aligned_freemocap_marker_data, 'good_frame': np.array(good_frame)}
+
+        origin_aligned_stage = CachedStage(stage_cache, 'origin_aligned',
+                                           {parameter: parameters[parameter] for parameter in ('good_frame', 'good_frame_exclusion_window')},
+                                           align_filtered_data, upstream=filtered_stage)
+
+        #the filtered data has to be saved before it gets aligned (in place, when there's no cache)
+        if parameters['save_npy_files']:
+            write_output_if_changed(output_paths['filtered'], filtered_stage.key, lambda output_path: np.save(output_path, filtered_stage.get()['filtered']))
+            write_output_if_changed(output_paths['origin_aligned'], origin_aligned_stage.key, lambda output_path: np.save(output_path, origin_aligned_stage.get()['origin_aligned']))
+
+        good_frame = parameters['good_frame'] if parameters['good_frame'] is not None else origin_aligned_stage.get()['good_frame']
+        get_gap_map = lambda: interpolated_stage.get()['gap_map']
+
+    def calculate_COM(origin_aligned):
+        mediapipe_segment_definition = SegmentDefinition(segments, joint_connections, mediapipe_indices)
+        skelcoordinates_frame_segment_joint_XYZ = mediapipe_segment_definition.build_segment_array(origin_aligned['origin_aligned'], frames_per_chunk=parameters['frames_per_chunk'])
+        segment_COM_frame_imgPoint_XYZ = calculate_segment_COM(skelcoordinates_frame_segment_joint_XYZ, segment_COM_lengths)
+        totalBodyCOM_frame_XYZ = calculate_total_body_COM(segment_COM_frame_imgPoint_XYZ, segment_COM_percentages)
+        return {'segments': skelcoordinates_frame_segment_joint_XYZ, 'segment_COM': segment_COM_frame_imgPoint_XYZ, 'total_body_COM': totalBodyCOM_frame_XYZ}
+
+    anthropometric_parameters = {'segments': segments, 'joint_connections': joint_connections, 'virtual_marker_definitions': virtual_marker_definitions,
+                                 'segment_COM_lengths': segment_COM_lengths, 'segment_COM_percentages': segment_COM_percentages}
+    COM_stage = CachedStage(stage_cache, 'COM', anthropometric_parameters, calculate_COM, upstream=origin_aligned_stage)
+
+    if parameters['save_npy_files']:
+        write_output_if_changed(output_paths['segment_COM'], COM_stage.key, lambda output_path: np.save(output_path, COM_stage.get()['segment_COM']))
+        write_output_if_changed(output_paths['total_body_COM'], COM_stage.key, lambda output_path: np.save(output_path, COM_stage.get()['total_body_COM']))
+
+    session_container_metadata = {
+        'skeleton_type': 'mediapipe',
+        'marker_names': mediapipe_indices, #names of the first len(marker_names) markers, the rest are the hand and face markers
+        'segment_names': segments,
+        'fps': parameters['sampling_rate'],
+        'good_frame': int(good_frame),
+        'pipeline_parameters': parameters,
+    }
+
+    def write_session_container_output(output_path):
+        write_session_container(output_path,
+                                {'origin_aligned': origin_aligned_stage.get()['origin_aligned'], 'segments': COM_stage.get()['segments'],
+                                 'segment_COM': COM_stage.get()['segment_COM'], 'total_body_COM': COM_stage.get()['total_body_COM'], 'gap_map': get_gap_map()},
+                                session_container_metadata, dtypes=dict.fromkeys(('origin_aligned', 'segments', 'segment_COM', 'total_body_COM'), parameters['session_container_dtype']),
+                                compression=parameters['session_container_compression'])
+
+    output_paths['session_container'] = data_array_path/SESSION_CONTAINER_FILE_NAME
+    session_container_key = calculate_stage_key(COM_stage.key, 'session_container', session_container_metadata) if stage_cache is not None else None
+    write_output_if_changed(output_paths['session_container'], session_container_key, write_session_container_output)
+
+    if parameters['use_streaming']:
+        streamed_scratch_outputs = ['interpolated', 'gap_map'] + ([] if parameters['save_npy_files'] else ['filtered', 'origin_aligned'])
+        origin_aligned_stage.arrays = None #let go of its memory map, a mapped file can't be deleted on windows
+        for streamed_output in streamed_scratch_outputs:
+            streamed_output_paths[streamed_output].unlink(missing_ok=True)
+            output_paths.pop(streamed_output, None)
+
+    return {'good_frame': int(good_frame), 'output_paths': {output: str(output_path) for output, output_path in output_paths.items()}}
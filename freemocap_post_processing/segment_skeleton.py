@@ -0,0 +1,62 @@
+import numpy as np
+
+from freemocap_post_processing.mediapipe_skeleton_definitions import virtual_marker_definitions as mediapipe_virtual_marker_definitions
+
+
+class SegmentDefinition:
+    """
+    A skeleton's segments, with the proximal and distal joint of every segment resolved to marker indices once.
+
+    Every segment endpoint is stored as a pair of marker indices and its position is the average of the two markers.
+    Virtual markers like the mid hip are the average of two real markers, and real markers are just paired with
+    themselves, so the whole skeleton can be built with fancy indexing instead of looping over frames and segments.
+    """
+
+    def __init__(self, segment_names: list, joint_connections: list, marker_names: list, virtual_marker_definitions: dict = mediapipe_virtual_marker_definitions):
+        self.segment_names = list(segment_names)
+        self.segment_name_to_index = {segment_name: segment_index for segment_index, segment_name in enumerate(self.segment_names)}
+
+        #endpoint_marker_indices[segment, proximal/distal, :] are the two markers that get averaged for that endpoint
+        self.endpoint_marker_indices = np.empty((len(self.segment_names), 2, 2), dtype=np.intp)
+        for segment_index, joint_connection in enumerate(joint_connections):
+            for endpoint, joint_name in enumerate(joint_connection):
+                self.endpoint_marker_indices[segment_index, endpoint, :] = self.resolve_joint_marker_indices(joint_name, marker_names, virtual_marker_definitions)
+
+    def resolve_joint_marker_indices(self, joint_name: str, marker_names: list, virtual_marker_definitions: dict):
+        joint_marker_names = virtual_marker_definitions.get(joint_name, [joint_name])
+        if len(joint_marker_names) not in (1, 2):
+            raise ValueError(f"virtual marker {joint_name} has to be made from one or two markers, got {joint_marker_names}")
+
+        joint_marker_indices = [marker_names.index(marker_name) for marker_name in joint_marker_names]
+        return joint_marker_indices*(2//len(joint_marker_indices))
+
+    @property
+    def num_segments(self):
+        return len(self.segment_names)
+
+    def build_segment_array(self, skeleton_data: np.ndarray, out: np.ndarray = None, frames_per_chunk: int = 4096) -> np.ndarray:
+        """
+        Build the skeleton segments for every frame.
+
+        Input:
+            skeleton data: a (frames, markers, 3) numpy array of skeleton data in freemocap format
+            out: optional (frames, segments, 2, 3) float array to write the segments into
+            frames per chunk: how many frames are built at a time, which bounds the size of the temporary arrays
+
+        Output:
+            segment array: a (frames, segments, 2, 3) array holding the proximal ([:, :, 0]) and distal ([:, :, 1])
+                           XYZ coordinates of each segment, in the order of segment_names
+        """
+        num_frames = skeleton_data.shape[0]
+        if out is None:
+            out = np.empty((num_frames, self.num_segments, 2, 3), dtype=np.result_type(skeleton_data.dtype, np.float32))
+
+        first_marker_indices = self.endpoint_marker_indices[:, :, 0]
+        second_marker_indices = self.endpoint_marker_indices[:, :, 1]
+        for chunk_start in range(0, num_frames, frames_per_chunk):
+            chunk_data = np.asarray(skeleton_data[chunk_start:chunk_start + frames_per_chunk])
+            chunk_out = out[chunk_start:chunk_start + frames_per_chunk]
+            np.add(chunk_data[:, first_marker_indices, :], chunk_data[:, second_marker_indices, :], out=chunk_out)
+            chunk_out /= 2
+
+        return out
@@ -0,0 +1,217 @@
+"""
+A single file holding a processed freemocap session: named datasets plus metadata (marker names, fps, good frame...).
+
+The container is a zip file. metadata.json describes the session and every dataset, and each dataset is split into
+chunks of frames saved as separate .npy members, optionally compressed. Reading a range of frames only decompresses
+the chunks that overlap it, so long sessions can be read a piece at a time. Nothing in the file is pickled.
+
+    with SessionContainer(path) as session:
+        total_body_COM = session['total_body_COM'][1000:2000]
+        good_frame = session.metadata['good_frame']
+"""
+import io
+import json
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+
+SESSION_CONTAINER_FILE_NAME = 'mediapipe_session.fmcsession'
+SESSION_CONTAINER_FORMAT_VERSION = 1
+METADATA_MEMBER_NAME = 'metadata.json'
+
+COMPRESSION_METHODS = {
+    None: zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+
+
+def get_chunk_member_name(dataset_name: str, chunk_index: int) -> str:
+    return f'datasets/{dataset_name}/chunk_{chunk_index:06d}.npy'
+
+
+class SessionContainerWriter:
+    """
+    Writes datasets into a new session container (overwriting any file already at the path).
+
+    Input:
+        container path: where to write the container
+        metadata: a json compatible dictionary of session information, e.g. marker_names, fps and good_frame
+        frames per chunk: how many frames go in each chunk, which is the smallest piece a reader has to decompress
+        compression: one of COMPRESSION_METHODS, the default for every dataset
+        compression level: passed to zipfile (e.g. 0-9 for deflate)
+    """
+
+    def __init__(self, container_path, metadata: dict = None, frames_per_chunk: int = 1024, compression: str = 'deflate', compression_level: int = None):
+        if compression not in COMPRESSION_METHODS:
+            raise ValueError(f"compression has to be one of {list(COMPRESSION_METHODS)}, got {compression}")
+
+        self.container_path = Path(container_path)
+        self.metadata = dict(metadata or {})
+        self.frames_per_chunk = frames_per_chunk
+        self.compression = compression
+        self.compression_level = compression_level
+        self.dataset_info = {}
+
+        self.temporary_container_path = self.container_path.with_name(self.container_path.name + '.tmp')
+        self.zip_file = zipfile.ZipFile(self.temporary_container_path, 'w', allowZip64=True)
+
+    def add_dataset(self, dataset_name: str, array: np.ndarray, dtype=None, compression: str = 'default', frames_per_chunk: int = None):
+        """
+        Add an array as a dataset, chunked along its first (frame) axis. dtype converts the data before it's saved
+        (e.g. np.float32 to halve the size), and compression and frames per chunk override the container's defaults.
+        """
+        if dataset_name in self.dataset_info:
+            raise ValueError(f"The container already has a dataset called {dataset_name}")
+
+        compression = self.compression if compression == 'default' else compression
+        if compression not in COMPRESSION_METHODS:
+            raise ValueError(f"compression has to be one of {list(COMPRESSION_METHODS)}, got {compression}")
+        frames_per_chunk = frames_per_chunk or self.frames_per_chunk
+        dtype = np.dtype(dtype) if dtype is not None else np.asarray(array[:0]).dtype
+
+        num_frames = array.shape[0]
+        num_chunks = 0
+        for chunk_start in range(0, max(num_frames, 1), frames_per_chunk):
+            chunk = np.ascontiguousarray(array[chunk_start:chunk_start + frames_per_chunk], dtype=dtype)
+            chunk_bytes = io.BytesIO()
+            np.lib.format.write_array(chunk_bytes, chunk, allow_pickle=False)
+            self.zip_file.writestr(get_chunk_member_name(dataset_name, num_chunks), chunk_bytes.getvalue(),
+                                   compress_type=COMPRESSION_METHODS[compression], compresslevel=self.compression_level)
+            num_chunks += 1
+
+        self.dataset_info[dataset_name] = {
+            'shape': list(array.shape),
+            'dtype': dtype.str,
+            'frames_per_chunk': frames_per_chunk,
+            'num_chunks': num_chunks,
+            'compression': compression,
+        }
+
+    def close(self):
+        if self.zip_file is None:
+            return
+        container_metadata = {'format_version': SESSION_CONTAINER_FORMAT_VERSION, 'metadata': self.metadata, 'datasets': self.dataset_info}
+        self.zip_file.writestr(METADATA_MEMBER_NAME, json.dumps(container_metadata, indent=1))
+        self.zip_file.close()
+        self.zip_file = None
+        #only replace the old container once the new one is complete
+        self.temporary_container_path.replace(self.container_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, exception_traceback):
+        if exception_type is None:
+            self.close()
+        else:
+            self.zip_file.close()
+            self.zip_file = None
+            self.temporary_container_path.unlink()
+
+
+def write_session_container(container_path, datasets: dict, metadata: dict = None, dtypes: dict = None, frames_per_chunk: int = 1024,
+                            compression: str = 'deflate', compression_level: int = None):
+    """Write a dictionary of arrays into a session container in one go, dtypes optionally maps dataset names to a dtype to save them as"""
+    dtypes = dtypes or {}
+    with SessionContainerWriter(container_path, metadata, frames_per_chunk=frames_per_chunk, compression=compression, compression_level=compression_level) as container_writer:
+        for dataset_name, array in datasets.items():
+            container_writer.add_dataset(dataset_name, array, dtype=dtypes.get(dataset_name))
+
+
+class SessionDataset:
+    """
+    One dataset of a session container. Nothing is read until it's indexed, e.g. dataset[100:200] or dataset[::2, :, 0],
+    and then only the chunks holding the requested frames are read. np.asarray(dataset) reads the whole thing.
+    """
+
+    def __init__(self, session_container, dataset_name: str, dataset_info: dict):
+        self.session_container = session_container
+        self.dataset_name = dataset_name
+        self.shape = tuple(dataset_info['shape'])
+        self.dtype = np.dtype(dataset_info['dtype'])
+        self.frames_per_chunk = dataset_info['frames_per_chunk']
+        self.num_chunks = dataset_info['num_chunks']
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read_chunk(self, chunk_index: int) -> np.ndarray:
+        with self.session_container.zip_file.open(get_chunk_member_name(self.dataset_name, chunk_index)) as chunk_member:
+            return np.lib.format.read_array(chunk_member, allow_pickle=False)
+
+    def read_frames(self, start_frame: int = 0, end_frame: int = None, step: int = 1) -> np.ndarray:
+        """Read frames start_frame:end_frame:step, only touching the chunks those frames are in"""
+        frame_numbers = np.arange(len(self))[start_frame:end_frame:step]
+        frames = np.empty((len(frame_numbers),) + self.shape[1:], dtype=self.dtype)
+        if len(frame_numbers) == 0:
+            return frames
+
+        chunk_indices = frame_numbers//self.frames_per_chunk
+        for chunk_index in np.unique(chunk_indices):
+            in_this_chunk = chunk_indices == chunk_index
+            frames[in_this_chunk] = self.read_chunk(chunk_index)[frame_numbers[in_this_chunk] - chunk_index*self.frames_per_chunk]
+
+        return frames
+
+    def __getitem__(self, index):
+        frame_index, other_indices = (index[0], index[1:]) if isinstance(index, tuple) else (index, ())
+
+        if isinstance(frame_index, slice):
+            return self.read_frames(frame_index.start, frame_index.stop, frame_index.step or 1)[(slice(None),) + other_indices]
+
+        if isinstance(frame_index, (int, np.integer)):
+            frame = frame_index + len(self) if frame_index < 0 else frame_index
+            if not 0 <= frame < len(self):
+                raise IndexError(f"frame {frame_index} is out of range for {self.dataset_name} with {len(self)} frames")
+            return self.read_frames(frame, frame + 1)[0][other_indices]
+
+        return np.asarray(self)[index]
+
+    def __array__(self, dtype=None):
+        frames = self.read_frames()
+        return frames if dtype is None else frames.astype(dtype)
+
+
+class SessionContainer:
+    """
+    Read access to a session container. Datasets are read lazily (see SessionDataset), keep the container open (or use
+    it as a context manager) for as long as its datasets are being read.
+    """
+
+    def __init__(self, container_path):
+        self.container_path = Path(container_path)
+        self.zip_file = zipfile.ZipFile(self.container_path, 'r')
+
+        container_metadata = json.loads(self.zip_file.read(METADATA_MEMBER_NAME))
+        if container_metadata['format_version'] > SESSION_CONTAINER_FORMAT_VERSION:
+            raise ValueError(f"{self.container_path} was written by a newer version of the session container (format version {container_metadata['format_version']})")
+
+        self.metadata = container_metadata['metadata']
+        self.datasets = {dataset_name: SessionDataset(self, dataset_name, dataset_info) for dataset_name, dataset_info in container_metadata['datasets'].items()}
+
+    @property
+    def dataset_names(self):
+        return list(self.datasets)
+
+    def __getitem__(self, dataset_name: str) -> SessionDataset:
+        return self.datasets[dataset_name]
+
+    def __contains__(self, dataset_name: str) -> bool:
+        return dataset_name in self.datasets
+
+    def close(self):
+        self.zip_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, exception_traceback):
+        self.close()
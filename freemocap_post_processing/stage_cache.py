@@ -0,0 +1,300 @@
+"""
+A disk cache for the outputs of each stage of the post-processing pipeline.
+
+Every stage's cache key is a hash of the key of the stage before it plus the stage's own parameters, and the first key
+is a hash of the input .npy file's contents, so a stage only gets recomputed when its input or anything upstream of
+it changed. Each entry is a folder of .npy files plus an entry.json describing it, so several processes can share one
+cache. The cache is kept under a maximum size by deleting the least recently used entries.
+
+Inspect or clear the cache from the repo root with:
+    python -m freemocap_post_processing.stage_cache list path/to/cache
+    python -m freemocap_post_processing.stage_cache purge path/to/cache --stage filtered
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+
+DEFAULT_MAX_CACHE_SIZE_BYTES = 20*1024**3
+CACHE_FOLDER_NAME = 'freemocap_stage_cache'
+ENTRY_FILE_NAME = 'entry.json'
+INPUT_HASHES_FOLDER_NAME = 'input_hashes'
+OUTPUT_KEYS_FILE_NAME = 'stage_cache_keys.json'
+
+HASH_DIGEST_SIZE = 16
+HASH_BLOCK_SIZE = 16*1024**2
+
+
+def convert_to_json_compatible(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, Path):
+        return str(value)
+    raise TypeError(f"Can't hash a stage parameter of type {type(value).__name__}")
+
+
+def calculate_stage_key(upstream_key: str, stage: str, parameters: dict) -> str:
+    """Hash the upstream stage's key together with this stage's name and parameters"""
+    stage_hash = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+    stage_hash.update(upstream_key.encode())
+    stage_hash.update(stage.encode())
+    stage_hash.update(json.dumps(parameters, sort_keys=True, default=convert_to_json_compatible).encode())
+    return stage_hash.hexdigest()
+
+
+def hash_file(file_path) -> str:
+    file_hash = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+    with open(file_path, 'rb') as file_to_hash:
+        for block in iter(lambda: file_to_hash.read(HASH_BLOCK_SIZE), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_directory_size(directory_path: Path) -> int:
+    return sum(file_path.stat().st_size for file_path in directory_path.iterdir() if file_path.is_file())
+
+
+class StageCache:
+    def __init__(self, cache_folder_path, max_size_bytes: int = DEFAULT_MAX_CACHE_SIZE_BYTES):
+        self.cache_folder_path = Path(cache_folder_path)
+        self.max_size_bytes = max_size_bytes
+        self.cache_folder_path.mkdir(parents=True, exist_ok=True)
+
+    def hash_input_file(self, input_file_path) -> str:
+        """
+        Hash the contents of a pipeline input file. The hash is remembered alongside the file's modification time and size,
+        so an unchanged file only ever gets read once.
+        """
+        input_file_path = Path(input_file_path).resolve()
+        input_file_stat = input_file_path.stat()
+
+        input_hashes_folder_path = self.cache_folder_path/INPUT_HASHES_FOLDER_NAME
+        input_hashes_folder_path.mkdir(exist_ok=True)
+        input_hash_path = input_hashes_folder_path/(hashlib.blake2b(str(input_file_path).encode(), digest_size=HASH_DIGEST_SIZE).hexdigest() + '.json')
+
+        if input_hash_path.exists():
+            with open(input_hash_path) as input_hash_file:
+                input_hash = json.load(input_hash_file)
+            if input_hash['mtime_ns'] == input_file_stat.st_mtime_ns and input_hash['size'] == input_file_stat.st_size:
+                return input_hash['hash']
+
+        input_hash = {'path': str(input_file_path), 'mtime_ns': input_file_stat.st_mtime_ns, 'size': input_file_stat.st_size, 'hash': hash_file(input_file_path)}
+        self.write_json_atomically(input_hash_path, input_hash)
+        return input_hash['hash']
+
+    def write_json_atomically(self, json_path: Path, contents: dict):
+        temporary_json_path = json_path.with_name(f'{json_path.name}.{os.getpid()}.tmp')
+        with open(temporary_json_path, 'w') as json_file:
+            json.dump(contents, json_file, indent=1)
+        os.replace(temporary_json_path, json_path)
+
+    def get_entry_folder_path(self, key: str) -> Path:
+        return self.cache_folder_path/key
+
+    def contains(self, key: str) -> bool:
+        return (self.get_entry_folder_path(key)/ENTRY_FILE_NAME).exists()
+
+    def load(self, key: str):
+        """The arrays cached under key as a dictionary, or None if there is no entry for it"""
+        entry_folder_path = self.get_entry_folder_path(key)
+        try:
+            with open(entry_folder_path/ENTRY_FILE_NAME) as entry_file:
+                entry = json.load(entry_file)
+            arrays = {array_name: np.load(entry_folder_path/f'{array_name}.npy') for array_name in entry['arrays']}
+        except (OSError, ValueError):
+            return None #missing, or evicted by another process while we were reading it
+
+        os.utime(entry_folder_path/ENTRY_FILE_NAME) #the entry file's modification time is when the entry was last used
+        return arrays
+
+    def save(self, key: str, stage: str, parameters: dict, arrays: dict, upstream_key: str = None):
+        entry_folder_path = self.get_entry_folder_path(key)
+        temporary_entry_folder_path = entry_folder_path.with_name(f'{key}.{os.getpid()}.tmp')
+        shutil.rmtree(temporary_entry_folder_path, ignore_errors=True)
+        temporary_entry_folder_path.mkdir()
+
+        for array_name, array in arrays.items():
+            np.save(temporary_entry_folder_path/f'{array_name}.npy', array)
+
+        entry = {
+            'key': key,
+            'stage': stage,
+            'upstream_key': upstream_key,
+            'parameters': parameters,
+            'arrays': list(arrays),
+            'size_bytes': get_directory_size(temporary_entry_folder_path),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        with open(temporary_entry_folder_path/ENTRY_FILE_NAME, 'w') as entry_file:
+            json.dump(entry, entry_file, indent=1, default=convert_to_json_compatible)
+
+        try:
+            os.replace(temporary_entry_folder_path, entry_folder_path)
+        except OSError:
+            shutil.rmtree(temporary_entry_folder_path, ignore_errors=True) #another process already cached the same stage
+
+        self.evict(keep_key=key)
+
+    def list_entries(self) -> list:
+        """Every entry in the cache, least recently used first"""
+        entries = []
+        for entry_file_path in self.cache_folder_path.glob(f'*/{ENTRY_FILE_NAME}'):
+            if entry_file_path.parent.suffix == '.tmp':
+                continue #an entry that is still being written
+            try:
+                with open(entry_file_path) as entry_file:
+                    entry = json.load(entry_file)
+                entry['last_used_at'] = entry_file_path.stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            entries.append(entry)
+        return sorted(entries, key=lambda entry: entry['last_used_at'])
+
+    def get_size_bytes(self) -> int:
+        return sum(entry['size_bytes'] for entry in self.list_entries())
+
+    def remove(self, key: str):
+        shutil.rmtree(self.get_entry_folder_path(key), ignore_errors=True)
+
+    def evict(self, keep_key: str = None) -> list:
+        """Delete the least recently used entries until the cache fits in max_size_bytes, returns the evicted keys"""
+        entries = self.list_entries()
+        cache_size_bytes = sum(entry['size_bytes'] for entry in entries)
+
+        evicted_keys = []
+        for entry in entries:
+            if cache_size_bytes <= self.max_size_bytes:
+                break
+            if entry['key'] == keep_key:
+                continue
+            self.remove(entry['key'])
+            cache_size_bytes -= entry['size_bytes']
+            evicted_keys.append(entry['key'])
+
+        return evicted_keys
+
+    def purge(self, keys: list = None, stage: str = None, older_than_days: float = None) -> list:
+        """Delete the entries matching all the given filters (every entry if none are given), returns the purged keys"""
+        purged_keys = []
+        for entry in self.list_entries():
+            if keys is not None and entry['key'] not in keys:
+                continue
+            if stage is not None and entry['stage'] != stage:
+                continue
+            if older_than_days is not None and time.time() - entry['last_used_at'] < older_than_days*24*60*60:
+                continue
+            self.remove(entry['key'])
+            purged_keys.append(entry['key'])
+
+        return purged_keys
+
+
+class CachedStage:
+    """
+    One stage of the pipeline, which is only computed (or loaded from the cache) the first time its arrays are asked for.
+
+    compute_stage gets the upstream stage's arrays (or nothing, for the first stage) and returns a dictionary of arrays.
+    With no stage cache the stage has no key and is just computed. With cache_arrays=False the stage still gets a key
+    (so the stages after it can be cached) but its own arrays are always computed, e.g. when they are already on disk.
+    """
+
+    def __init__(self, stage_cache: StageCache, stage: str, parameters: dict, compute_stage, upstream=None, upstream_key: str = None, cache_arrays: bool = True):
+        self.stage_cache = stage_cache
+        self.cache_arrays = cache_arrays and stage_cache is not None
+        self.stage = stage
+        self.parameters = parameters
+        self.compute_stage = compute_stage
+        self.upstream = upstream
+
+        self.upstream_key = upstream.key if upstream is not None else upstream_key
+        self.key = calculate_stage_key(self.upstream_key, stage, parameters) if stage_cache is not None else None
+        self.arrays = None
+
+    def get(self) -> dict:
+        if self.arrays is not None:
+            return self.arrays
+
+        if self.cache_arrays:
+            self.arrays = self.stage_cache.load(self.key)
+
+        if self.arrays is None:
+            upstream_arrays = (self.upstream.get(),) if self.upstream is not None else ()
+            self.arrays = self.compute_stage(*upstream_arrays)
+            if self.cache_arrays:
+                self.stage_cache.save(self.key, self.stage, self.parameters, self.arrays, upstream_key=self.upstream_key)
+
+        return self.arrays
+
+
+def load_output_keys(data_array_path: Path) -> dict:
+    output_keys_path = data_array_path/OUTPUT_KEYS_FILE_NAME
+    if not output_keys_path.exists():
+        return {}
+    with open(output_keys_path) as output_keys_file:
+        return json.load(output_keys_file)
+
+
+def write_output_if_changed(output_path, key: str, write_output) -> bool:
+    """
+    Call write_output(output_path) unless the file there was already written from the stage with this key (and hasn't
+    been touched since). The keys of written outputs are kept in OUTPUT_KEYS_FILE_NAME next to them. Returns whether
+    the output was written.
+    """
+    output_path = Path(output_path)
+    output_keys = load_output_keys(output_path.parent)
+
+    recorded_output = output_keys.get(output_path.name)
+    if key is not None and recorded_output is not None and recorded_output['key'] == key and output_path.exists():
+        output_stat = output_path.stat()
+        if recorded_output['mtime_ns'] == output_stat.st_mtime_ns and recorded_output['size'] == output_stat.st_size:
+            return False
+
+    write_output(output_path)
+
+    if key is None:
+        output_keys.pop(output_path.name, None)
+    else:
+        output_stat = output_path.stat()
+        output_keys[output_path.name] = {'key': key, 'mtime_ns': output_stat.st_mtime_ns, 'size': output_stat.st_size}
+    with open(output_path.parent/OUTPUT_KEYS_FILE_NAME, 'w') as output_keys_file:
+        json.dump(output_keys, output_keys_file, indent=1)
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or clear the freemocap post-processing stage cache')
+    parser.add_argument('command', choices=['list', 'purge'])
+    parser.add_argument('cache_folder', type=Path)
+    parser.add_argument('--stage', default=None, help='only purge entries of this stage')
+    parser.add_argument('--keys', nargs='+', default=None, help='only purge these entries')
+    parser.add_argument('--older-than-days', type=float, default=None, help='only purge entries not used in this many days')
+    args = parser.parse_args()
+
+    stage_cache = StageCache(args.cache_folder)
+
+    if args.command == 'list':
+        entries = stage_cache.list_entries()
+        for entry in entries:
+            last_used_at = datetime.fromtimestamp(entry['last_used_at']).isoformat(timespec='seconds')
+            entry_parameters = json.dumps(entry['parameters'], sort_keys=True)
+            entry_parameters = entry_parameters if len(entry_parameters) <= 100 else entry_parameters[:97] + '...'
+            print(f"{entry['key']}  {entry['stage']:<16} {entry['size_bytes']/1e6:10.1f} MB  last used {last_used_at}  {entry_parameters}")
+        print(f"{len(entries)} entries, {sum(entry['size_bytes'] for entry in entries)/1e6:.1f} MB")
+
+    else:
+        purged_keys = stage_cache.purge(keys=args.keys, stage=args.stage, older_than_days=args.older_than_days)
+        print(f'Purged {len(purged_keys)} entries')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+from pathlib import Path
+
+import numpy as np
+from rich.progress import track
+from scipy import signal
+
+from freemocap_post_processing.filtering import butter_lowpass_filter, butter_lowpass_filter_finite_runs, calculate_filtfilt_padding, design_butter_lowpass_filter
+from freemocap_post_processing.gap_filling import EDGE_FILL_METHODS
+from freemocap_post_processing.good_frame_finder import find_good_frame
+from freemocap_post_processing.origin_alignment import apply_rigid_transform, calculate_origin_alignment_transform, compose_rotation_matrices
+
+
+#with the default tolerance, every streamed stage matches the in memory path (fill_gaps -> filter_skeleton -> align_skeleton_with_origin)
+#to within 1e-6 mm for skeleton data in millimeters (the gap filling and alignment stages match exactly, up to float rounding)
+DEFAULT_STREAMING_TOLERANCE = 1e-9
+
+STREAMED_FILE_NAMES = {
+    'interpolated': 'mediaPipeSkel_3d_interpolated.npy',
+    'gap_map': 'mediaPipeSkel_3d_gap_map.npy',
+    'filtered': 'mediaPipeSkel_3d_filtered.npy',
+    'origin_aligned': 'mediaPipeSkel_3d_origin_aligned.npy',
+}
+
+
+def iterate_frame_chunks(num_frames: int, frames_per_chunk: int, description: str = None):
+    """Yield (chunk start, chunk end) frame numbers that cover the whole session"""
+    chunk_starts = range(0, num_frames, frames_per_chunk)
+    if description is not None:
+        chunk_starts = track(chunk_starts, description=description)
+    for chunk_start in chunk_starts:
+        yield chunk_start, min(chunk_start + frames_per_chunk, num_frames)
+
+
+def estimate_filter_padding(cutoff, sampling_rate, order, use_sos=False, tolerance=DEFAULT_STREAMING_TOLERANCE) -> int:
+    """
+    Work out how many frames of padding each side of a chunk needs so that filtering the padded chunk gives the same
+    result (to within tolerance, relative to the size of the data) as filtering the whole session.
+
+    This is the number of frames it takes for the filter's impulse response to die down below the tolerance, plus the
+    padding filtfilt adds to each end of the signal.
+    """
+    impulse_length = 64
+    while True:
+        impulse = np.zeros(impulse_length)
+        impulse[0] = 1
+        if use_sos:
+            sos = design_butter_lowpass_filter(cutoff, sampling_rate, order, use_sos=True)
+            impulse_response = np.abs(signal.sosfilt(sos, impulse))
+        else:
+            b, a = design_butter_lowpass_filter(cutoff, sampling_rate, order)
+            impulse_response = np.abs(signal.lfilter(b, a, impulse))
+
+        #remaining_response[n] is how much of the response is still to come after n samples
+        remaining_response = np.cumsum(impulse_response[::-1])[::-1]
+        settled_samples = np.flatnonzero(remaining_response <= tolerance*remaining_response[0])
+        if settled_samples.size > 0:
+            return int(settled_samples[0]) + calculate_filtfilt_padding(cutoff, sampling_rate, order, use_sos=use_sos)
+        impulse_length *= 2
+
+
+def open_output_npy(output_path, shape, dtype):
+    """Create a memory mapped .npy file that a stage writes its output straight into"""
+    return np.lib.format.open_memmap(str(output_path), mode='w+', dtype=dtype, shape=shape)
+
+
+class StreamingGapFiller:
+    """
+    Linear gap filling that is fed the session a chunk of frames at a time.
+
+    Gaps that run past the end of a chunk are left as NaN in the output until the chunk where the marker comes back,
+    then the earlier part of the gap is filled in directly in the (memory mapped) output. This gives the same result
+    as fill_gaps(method='linear') for gaps of any length.
+    """
+
+    def __init__(self, filled_column_data, max_gap=None, edge_fill='mean', observed_column_means=None):
+        if edge_fill not in EDGE_FILL_METHODS:
+            raise ValueError(f"edge_fill must be one of {EDGE_FILL_METHODS}, got {edge_fill!r}")
+        if edge_fill == 'mean' and observed_column_means is None:
+            raise ValueError("edge_fill='mean' needs the observed mean of every column")
+
+        self.filled_column_data = filled_column_data
+        self.max_gap = max_gap
+        self.edge_fill = edge_fill
+        self.observed_column_means = observed_column_means
+
+        num_columns = filled_column_data.shape[1]
+        self.last_valid_frame = np.full(num_columns, -1, dtype=np.int64)
+        self.last_valid_value = np.full(num_columns, np.nan)
+
+    def process_chunk(self, column_data: np.ndarray, chunk_start: int):
+        """Fill a (frames, columns) chunk that starts at frame chunk_start and write it to the output"""
+        num_chunk_frames = column_data.shape[0]
+        chunk_end = chunk_start + num_chunk_frames
+        filled_column_data = column_data.copy()
+        missing_data_mask = ~np.isfinite(column_data)
+        column_numbers = np.arange(column_data.shape[1])
+
+        chunk_frame_numbers = np.arange(chunk_start, chunk_end, dtype=np.int64)[:, np.newaxis]
+        previous_valid_frame = np.vstack([self.last_valid_frame, np.where(missing_data_mask, -1, chunk_frame_numbers)])
+        previous_valid_frame = np.maximum.accumulate(previous_valid_frame, axis=0)[1:]
+        next_valid_frame = np.where(missing_data_mask, chunk_end, chunk_frame_numbers)[::-1]
+        next_valid_frame = np.minimum.accumulate(next_valid_frame, axis=0)[::-1]
+
+        #the values at the start of each gap come either from this chunk or from the last valid sample of an earlier chunk
+        carried_and_chunk_data = np.vstack([self.last_valid_value, column_data])
+        def value_at_frame(frames, columns):
+            return carried_and_chunk_data[np.where(frames >= chunk_start, frames - chunk_start + 1, 0), columns]
+
+        interior_gap_mask = missing_data_mask & (previous_valid_frame >= 0) & (next_valid_frame < chunk_end)
+        if self.max_gap is not None:
+            interior_gap_mask &= (next_valid_frame - previous_valid_frame - 1) <= self.max_gap
+        gap_frames, gap_columns = np.nonzero(interior_gap_mask)
+        gap_start_frames = previous_valid_frame[gap_frames, gap_columns]
+        gap_end_frames = next_valid_frame[gap_frames, gap_columns]
+        gap_start_values = value_at_frame(gap_start_frames, gap_columns)
+        gap_end_values = column_data[gap_end_frames - chunk_start, gap_columns]
+        fraction_of_gap = (gap_frames + chunk_start - gap_start_frames)/(gap_end_frames - gap_start_frames)
+        filled_column_data[gap_frames, gap_columns] = gap_start_values + fraction_of_gap*(gap_end_values - gap_start_values)
+
+        leading_gap_frames, leading_gap_columns = np.nonzero(missing_data_mask & (previous_valid_frame < 0) & (next_valid_frame < chunk_end))
+        filled_column_data[leading_gap_frames, leading_gap_columns] = self.leading_edge_values(leading_gap_columns, column_data[next_valid_frame[leading_gap_frames, leading_gap_columns] - chunk_start, leading_gap_columns])
+
+        #fill in the part of any gap that started in an earlier chunk and ended in this one
+        first_valid_frame = next_valid_frame[0]
+        closed_gap_columns = np.flatnonzero((self.last_valid_frame + 1 < chunk_start) & (first_valid_frame < chunk_end))
+        for column in closed_gap_columns:
+            self.fill_earlier_part_of_gap(column, chunk_start, first_valid_frame[column], column_data[first_valid_frame[column] - chunk_start, column])
+
+        self.filled_column_data[chunk_start:chunk_end] = filled_column_data
+
+        self.last_valid_frame = previous_valid_frame[-1]
+        self.last_valid_value = value_at_frame(self.last_valid_frame, column_numbers)
+
+    def leading_edge_values(self, columns, first_valid_values):
+        if self.edge_fill == 'mean':
+            return self.observed_column_means[columns]
+        if self.edge_fill == 'nearest':
+            return first_valid_values
+        return np.full(len(columns), np.nan)
+
+    def fill_earlier_part_of_gap(self, column, chunk_start, gap_end_frame, gap_end_value):
+        gap_start_frame = self.last_valid_frame[column]
+        earlier_gap_frames = np.arange(gap_start_frame + 1, chunk_start)
+
+        if gap_start_frame < 0:
+            self.filled_column_data[earlier_gap_frames, column] = self.leading_edge_values([column], np.array([gap_end_value]))[0]
+            return
+        if self.max_gap is not None and gap_end_frame - gap_start_frame - 1 > self.max_gap:
+            return
+
+        gap_start_value = self.last_valid_value[column]
+        fraction_of_gap = (earlier_gap_frames - gap_start_frame)/(gap_end_frame - gap_start_frame)
+        self.filled_column_data[earlier_gap_frames, column] = gap_start_value + fraction_of_gap*(gap_end_value - gap_start_value)
+
+    def finish(self):
+        """Fill the NaNs after the last valid sample of each column, once the whole session has been processed"""
+        num_frames = self.filled_column_data.shape[0]
+        for column in np.flatnonzero(self.last_valid_frame + 1 < num_frames):
+            if self.last_valid_frame[column] < 0:
+                continue #a column with no data at all stays NaN, like in fill_gaps
+            if self.edge_fill == 'mean':
+                trailing_value = self.observed_column_means[column]
+            elif self.edge_fill == 'nearest':
+                trailing_value = self.last_valid_value[column]
+            else:
+                continue
+            self.filled_column_data[self.last_valid_frame[column] + 1:, column] = trailing_value
+
+
+def stream_fill_gaps(freemocap_marker_data, output_path, gap_map_output_path=None, max_gap=None, edge_fill='mean', frames_per_chunk=4096):
+    """
+    Streaming version of fill_gaps(method='linear') that reads the (memory mapped) marker data a chunk of frames at a time
+    and writes the filled data (and optionally the gap map) straight to memory mapped .npy files
+
+    Output:
+        the memory mapped filled data (and the memory mapped gap map, if gap_map_output_path was given)
+    """
+    num_frames = freemocap_marker_data.shape[0]
+    filled_data = open_output_npy(output_path, freemocap_marker_data.shape, np.float64)
+    filled_column_data = filled_data.reshape(num_frames, -1)
+
+    observed_column_means = None
+    if edge_fill == 'mean':
+        observed_sample_sum = np.zeros(filled_column_data.shape[1])
+        observed_sample_count = np.zeros(filled_column_data.shape[1], dtype=np.int64)
+        for chunk_start, chunk_end in iterate_frame_chunks(num_frames, frames_per_chunk, 'Measuring Marker Means'):
+            column_data = np.asarray(freemocap_marker_data[chunk_start:chunk_end], dtype=np.float64).reshape(chunk_end - chunk_start, -1)
+            observed_data_mask = np.isfinite(column_data)
+            observed_sample_sum += np.where(observed_data_mask, column_data, 0).sum(axis=0)
+            observed_sample_count += observed_data_mask.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            observed_column_means = observed_sample_sum/observed_sample_count
+
+    gap_filler = StreamingGapFiller(filled_column_data, max_gap=max_gap, edge_fill=edge_fill, observed_column_means=observed_column_means)
+    for chunk_start, chunk_end in iterate_frame_chunks(num_frames, frames_per_chunk, 'Interpolating Data'):
+        column_data = np.asarray(freemocap_marker_data[chunk_start:chunk_end], dtype=np.float64).reshape(chunk_end - chunk_start, -1)
+        gap_filler.process_chunk(column_data, chunk_start)
+    gap_filler.finish()
+    filled_data.flush()
+
+    if gap_map_output_path is None:
+        return filled_data
+
+    gap_map = open_output_npy(gap_map_output_path, freemocap_marker_data.shape, bool)
+    for chunk_start, chunk_end in iterate_frame_chunks(num_frames, frames_per_chunk):
+        gap_map[chunk_start:chunk_end] = ~np.isfinite(freemocap_marker_data[chunk_start:chunk_end]) & np.isfinite(filled_data[chunk_start:chunk_end])
+    gap_map.flush()
+
+    return filled_data, gap_map
+
+
+def stream_filter_skeleton(skeleton_3d_data, output_path, cutoff, sampling_rate, order, use_sos=False, dtype=np.float64, frames_per_chunk=4096, tolerance=DEFAULT_STREAMING_TOLERANCE):
+    """
+    Streaming version of filter_skeleton. Each chunk of frames is filtered together with enough padding from its
+    neighbouring chunks for the filtfilt edge effects to die out, and only the middle of the filtered chunk is kept.
+    Chunks with NaNs in them are filtered a run of finite frames at a time, like filter_skeleton does.
+
+    Output:
+        the memory mapped filtered data
+    """
+    num_frames = skeleton_3d_data.shape[0]
+    filtered_data = open_output_npy(output_path, skeleton_3d_data.shape, dtype)
+    chunk_padding = estimate_filter_padding(cutoff, sampling_rate, order, use_sos=use_sos, tolerance=tolerance)
+
+    for chunk_start, chunk_end in iterate_frame_chunks(num_frames, frames_per_chunk, 'Filtering Data'):
+        padded_chunk_start = max(chunk_start - chunk_padding, 0)
+        padded_chunk_end = min(chunk_end + chunk_padding, num_frames)
+        padded_chunk_data = np.asarray(skeleton_3d_data[padded_chunk_start:padded_chunk_end], dtype=np.float64)
+
+        if np.isfinite(padded_chunk_data).all():
+            filtered_padded_chunk = butter_lowpass_filter(padded_chunk_data, cutoff, sampling_rate, order, axis=0, use_sos=use_sos)
+        else:
+            filtered_padded_chunk = butter_lowpass_filter_finite_runs(padded_chunk_data.reshape(padded_chunk_data.shape[0], -1), cutoff, sampling_rate, order,
+                                                                      use_sos=use_sos).reshape(padded_chunk_data.shape)
+        filtered_data[chunk_start:chunk_end] = filtered_padded_chunk[chunk_start - padded_chunk_start:chunk_end - padded_chunk_start]
+
+    filtered_data.flush()
+    return filtered_data
+
+
+def stream_align_skeleton_with_origin(skeleton_data, output_path, skeleton_indices: list, good_frame: int, frames_per_chunk=4096):
+    """
+    Streaming version of align_skeleton_with_origin (without the intermediate stages), which reads the good frame to work
+    out the transform and then applies it a chunk of frames at a time
+
+    Output:
+        the memory mapped origin aligned data
+    """
+    num_frames = skeleton_data.shape[0]
+    aligned_data = open_output_npy(output_path, skeleton_data.shape, skeleton_data.dtype if skeleton_data.dtype in (np.float32, np.float64) else np.float64)
+
+    translation_vector, foot_rotation_matrix, spine_rotation_matrix = calculate_origin_alignment_transform(skeleton_data, skeleton_indices, good_frame)
+    origin_alignment_rotation_matrix = compose_rotation_matrices(foot_rotation_matrix, spine_rotation_matrix)
+
+    for chunk_start, chunk_end in iterate_frame_chunks(num_frames, frames_per_chunk, 'Aligning Data with Origin'):
+        apply_rigid_transform(skeleton_data[chunk_start:chunk_end], origin_alignment_rotation_matrix, translation_vector, out=aligned_data[chunk_start:chunk_end])
+
+    aligned_data.flush()
+    return aligned_data
+
+
+def run_streaming_pipeline(input_npy_path, output_folder, skeleton_indices: list, good_frame: int, cutoff, sampling_rate, order,
+                           use_sos=False, max_gap=None, edge_fill='mean', dtype=np.float64, frames_per_chunk=4096, tolerance=DEFAULT_STREAMING_TOLERANCE,
+                           good_frame_exclusion_window=(0, 75)):
+    """
+    Run the interpolate -> filter -> align pipeline on a session that doesn't fit in memory.
+
+    The input .npy is memory mapped and every stage reads and writes chunks of frames, writing its output straight to a
+    memory mapped .npy in output_folder (see STREAMED_FILE_NAMES), so only a few chunks are ever held in memory.
+    With the default tolerance, results match the in memory path to within 1e-6 mm for skeleton data in millimeters (see the note at the top of this module;
+    tolerance is how far the filter's impulse response has to die down within the chunk padding, not a bound on the output).
+    If good_frame is None, it is found from the filtered data with find_good_frame (skipping good_frame_exclusion_window).
+
+    Output:
+        output paths: a dictionary of the paths each stage was written to, keyed like STREAMED_FILE_NAMES
+        good frame: the frame the alignment was based on
+    """
+    output_folder = Path(output_folder)
+    output_paths = {stage: output_folder/file_name for stage, file_name in STREAMED_FILE_NAMES.items()}
+
+    freemocap_marker_data = np.load(str(input_npy_path), mmap_mode='r')
+
+    interpolated_data, gap_map = stream_fill_gaps(freemocap_marker_data, output_paths['interpolated'], output_paths['gap_map'], max_gap=max_gap, edge_fill=edge_fill, frames_per_chunk=frames_per_chunk)
+    del gap_map
+
+    filtered_data = stream_filter_skeleton(interpolated_data, output_paths['filtered'], cutoff, sampling_rate, order, use_sos=use_sos, dtype=dtype, frames_per_chunk=frames_per_chunk, tolerance=tolerance)
+    del interpolated_data
+
+    if good_frame is None:
+        good_frame = find_good_frame(filtered_data, skeleton_indices, exclusion_window=good_frame_exclusion_window)
+
+    aligned_data = stream_align_skeleton_with_origin(filtered_data, output_paths['origin_aligned'], skeleton_indices, good_frame, frames_per_chunk=frames_per_chunk)
+    del filtered_data, aligned_data
+
+    return output_paths, good_frame
@@ -75,7 +75,7 @@ def create_initial_skeleton(x, y, z, skeleton_connection_dict):
     rFoot_x, rFoot_y, rFoot_z = body_segment_data(x, y, z, "rFoot", skeleton_connection_dict)
     rFoot_line, = ax.plot(rFoot_x, rFoot_y, rFoot_z, color = "cornflowerblue")
 
-    lFoot_x, lFoot_y, lFoot_z = body_segment_data(x, y, z, "lHand", skeleton_connection_dict)
+    lFoot_x, lFoot_y, lFoot_z = body_segment_data(x, y, z, "lFoot", skeleton_connection_dict)
     lFoot_line, = ax.plot(lFoot_x, lFoot_y, lFoot_z, color = "cornflowerblue")
 
     #returning all of these directly seems like an ungodly solution
@@ -6,6 +6,10 @@ import matplotlib.animation as animation
 from matplotlib.animation import FuncAnimation
 
 from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parents[1])) #so the freemocap_visualizers package can be imported from the repo root
+from freemocap_visualizers.raw_frame_writer import export_animation
 
 class SkeletonAnimation:
     def __init__(self):
@@ -17,15 +21,16 @@ class SkeletonAnimation:
         mediapipe_file_name = "mediapipe_origin_aligned_skeleton_3D.npy"
         mediapipe_3d_data_path = data_arrays_path / mediapipe_file_name
 
-        # load in saved mediapipe data
-        self.mediapipe_skel_fr_mar_xyz = np.load(str(mediapipe_3d_data_path))
+        # load in saved mediapipe data, memory mapped so only the frames that get played are read from disk
+        self.mediapipe_skel_fr_mar_xyz = np.load(str(mediapipe_3d_data_path), mmap_mode="r")
 
         # define video parameters
         self.number_of_frames = self.mediapipe_skel_fr_mar_xyz.shape[0]
-        self.frame_interval = 16.6667 # eventually will get this out of fmc pipeline rather than hardcoding
+        self.capture_fps = 60 # eventually will get this out of fmc pipeline rather than hardcoding
 
         self.initialize_figure()
         self.define_skeleton_dict()
+        self.compile_skeleton_connections(self.skeleton_connection_dict)
 
         # create spatial variables
         self.get_frame_data(0, self.mediapipe_skel_fr_mar_xyz)
@@ -34,7 +39,7 @@ class SkeletonAnimation:
         self.tracked_point_graph = self.ax.scatter(self.single_frame_x_data, self.single_frame_y_data, self.single_frame_z_data, color="salmon") #plots all 33 tracked points from mediapipe
 
         # plot initial skeleton data
-        self.create_initial_skeleton(self.single_frame_x_data, self.single_frame_y_data, self.single_frame_z_data, self.skeleton_connection_dict)
+        self.create_initial_skeleton(self.single_frame_xyz)
 
     def initialize_figure(self):
         # set up figure
@@ -96,115 +101,45 @@ class SkeletonAnimation:
             "lFoot": [27, 29, 31, 27], #repeated start values to close loop
         }
 
-    def get_frame_data(self, frame, mediapipe_skel_fr_mar_xyz):
-        '''Given a frame number, get 3 arrays containing x, y, z data'''
-        self.single_frame_x_data = []
-        self.single_frame_y_data = []
-        self.single_frame_z_data = []
-
-        for tracked_point in mediapipe_skel_fr_mar_xyz[frame][:33]: #only interested in 33 body points, not hand and face points
-            self.single_frame_x_data.append(tracked_point[0]) 
-            self.single_frame_y_data.append(tracked_point[1])
-            self.single_frame_z_data.append(tracked_point[2])
-            
-
-    def body_segment_data(self, x, y, z, segment_key, skeleton_connection_dict):
-        '''Creates body segment data for a body segment given by the segment_key, based on the joints given in the skeleton_connection_dict.
-        Returns separate XYZ lists in proper format for plotting.
-        '''
-
-        x_connections, y_connections, z_connections = [], [], []
-
-        for joint in skeleton_connection_dict[segment_key]:
-            x_connections.append(x[joint])
-            y_connections.append(y[joint])
-            z_connections.append(z[joint])
-
-        return x_connections, y_connections, z_connections
-
-    def create_initial_skeleton(self, x, y, z, skeleton_connection_dict):
-        # create eyes
-        eyes_x, eyes_y, eyes_z = self.body_segment_data(x, y, z, "eyes", skeleton_connection_dict)
-        self.eye_line, = self.ax.plot(eyes_x, eyes_y, eyes_z, color = "cornflowerblue")
-
-        # create mouth
-        mouth_x, mouth_y, mouth_z = self.body_segment_data(x, y, z, "mouth", skeleton_connection_dict)
-        self.mouth_line, = self.ax.plot(mouth_x, mouth_y, mouth_z, color = "cornflowerblue")
-
-        # create torso
-        torso_x, torso_y, torso_z = self.body_segment_data(x, y, z, "torso", skeleton_connection_dict)
-        self.torso_line, = self.ax.plot(torso_x, torso_y, torso_z, color = "cornflowerblue")
-
-        # create arms
-        rArm_x, rArm_y, rArm_z = self.body_segment_data(x, y, z, "rArm", skeleton_connection_dict)
-        self.rArm_line, = self.ax.plot(rArm_x, rArm_y, rArm_z, color = "cornflowerblue")
-
-        lArm_x, lArm_y, lArm_z = self.body_segment_data(x, y, z, "lArm", skeleton_connection_dict)
-        self.lArm_line, = self.ax.plot(lArm_x, lArm_y, lArm_z, color = "cornflowerblue")
-
-        # create hands
-        rHand_x, rHand_y, rHand_z = self.body_segment_data(x, y, z, "rHand", skeleton_connection_dict)
-        self.rHand_line, = self.ax.plot(rHand_x, rHand_y, rHand_z, color = "cornflowerblue")
-
-        lHand_x, lHand_y, lHand_z = self.body_segment_data(x, y, z, "lHand", skeleton_connection_dict)
-        self.lHand_line, = self.ax.plot(lHand_x, lHand_y, lHand_z, color = "cornflowerblue")
-
-        # create legs
-        rLeg_x, rLeg_y, rLeg_z = self.body_segment_data(x, y, z, "rLeg", skeleton_connection_dict)
-        self.rLeg_line, = self.ax.plot(rLeg_x, rLeg_y, rLeg_z, color = "cornflowerblue")
-
-        lLeg_x, lLeg_y, lLeg_z = self.body_segment_data(x, y, z, "lLeg", skeleton_connection_dict)
-        self.lLeg_line, = self.ax.plot(lLeg_x, lLeg_y, lLeg_z, color = "cornflowerblue")
-
-        # create feet
-        rFoot_x, rFoot_y, rFoot_z = self.body_segment_data(x, y, z, "rFoot", skeleton_connection_dict)
-        self.rFoot_line, = self.ax.plot(rFoot_x, rFoot_y, rFoot_z, color = "cornflowerblue")
-
-        lFoot_x, lFoot_y, lFoot_z = self.body_segment_data(x, y, z, "lHand", skeleton_connection_dict)
-        self.lFoot_line, = self.ax.plot(lFoot_x, lFoot_y, lFoot_z, color = "cornflowerblue")
-
-    def update_skeleton(self, x, y, z, skeleton_connection_dict):
-        # update eyes
-        eyes_x, eyes_y, eyes_z = self.body_segment_data(x, y, z, "eyes", skeleton_connection_dict)
-        self.eye_line.set_data_3d(eyes_x, eyes_y, eyes_z)
-
-        # update mouth
-        mouth_x, mouth_y, mouth_z = self.body_segment_data(x, y, z, "mouth", skeleton_connection_dict)
-        self.mouth_line.set_data_3d(mouth_x, mouth_y, mouth_z)
-
-        # update torso
-        torso_x, torso_y, torso_z = self.body_segment_data(x, y, z, "torso", skeleton_connection_dict)
-        self.torso_line.set_data_3d(torso_x, torso_y, torso_z)
-
-        # update arms
-        rArm_x, rArm_y, rArm_z = self.body_segment_data(x, y, z, "rArm", skeleton_connection_dict)
-        self.rArm_line.set_data_3d(rArm_x, rArm_y, rArm_z)
-
-        lArm_x, lArm_y, lArm_z = self.body_segment_data(x, y, z, "lArm", skeleton_connection_dict)
-        self.lArm_line.set_data_3d(lArm_x, lArm_y, lArm_z)
-
-        # update hands
-        rHand_x, rHand_y, rHand_z = self.body_segment_data(x, y, z, "rHand", skeleton_connection_dict)
-        self.rHand_line.set_data_3d(rHand_x, rHand_y, rHand_z)
-
-        lHand_x, lHand_y, lHand_z = self.body_segment_data(x, y, z, "lHand", skeleton_connection_dict)
-        self.lHand_line.set_data_3d(lHand_x, lHand_y, lHand_z)
-
-        # update legs
-        rLeg_x, rLeg_y, rLeg_z = self.body_segment_data(x, y, z, "rLeg", skeleton_connection_dict)
-        self.rLeg_line.set_data_3d(rLeg_x, rLeg_y, rLeg_z)
-
-        lLeg_x, lLeg_y, lLeg_z = self.body_segment_data(x, y, z, "lLeg", skeleton_connection_dict)
-        self.lLeg_line.set_data_3d(lLeg_x, lLeg_y, lLeg_z)
-
-        # update feet
-        rFoot_x, rFoot_y, rFoot_z = self.body_segment_data(x, y, z, "rFoot", skeleton_connection_dict)
-        self.rFoot_line.set_data_3d(rFoot_x, rFoot_y, rFoot_z)
-
-        lFoot_x, lFoot_y, lFoot_z = self.body_segment_data(x, y, z, "lFoot", skeleton_connection_dict)
-        self.lFoot_line.set_data_3d(lFoot_x, lFoot_y, lFoot_z)
+    def compile_skeleton_connections(self, skeleton_connection_dict):
+        '''Turn the skeleton connection dict into one array of joint indices (every segment's joints, one segment after the other)
+        plus the slice of that array each segment takes up, so a frame's segments can all be pulled out with a single index.'''
+        self.segment_names = list(skeleton_connection_dict.keys())
+        self.skeleton_joint_indices = np.concatenate([skeleton_connection_dict[segment_name] for segment_name in self.segment_names]).astype(int)
 
+        self.segment_slices = {}
+        segment_start = 0
+        for segment_name in self.segment_names:
+            segment_end = segment_start + len(skeleton_connection_dict[segment_name])
+            self.segment_slices[segment_name] = slice(segment_start, segment_end)
+            segment_start = segment_end
 
+    def get_frame_data(self, frame, mediapipe_skel_fr_mar_xyz):
+        '''Given a frame number, get the (33, 3) xyz data of the body points, plus x, y, z arrays (views of it)'''
+        self.single_frame_xyz = mediapipe_skel_fr_mar_xyz[frame, :33] #only interested in 33 body points, not hand and face points
+        self.single_frame_x_data = self.single_frame_xyz[:, 0]
+        self.single_frame_y_data = self.single_frame_xyz[:, 1]
+        self.single_frame_z_data = self.single_frame_xyz[:, 2]
+
+    def body_segment_data(self, single_frame_xyz, segment_key):
+        '''Get the x, y, z data of the joints of the body segment given by the segment_key, in the order given in the skeleton_connection_dict.'''
+        segment_xyz = single_frame_xyz[self.skeleton_joint_indices[self.segment_slices[segment_key]]]
+
+        return segment_xyz[:, 0], segment_xyz[:, 1], segment_xyz[:, 2]
+
+    def create_initial_skeleton(self, single_frame_xyz):
+        # one line per body segment, in the order of the skeleton connection dict
+        self.skeleton_lines = {}
+        for segment_name in self.segment_names:
+            segment_x, segment_y, segment_z = self.body_segment_data(single_frame_xyz, segment_name)
+            self.skeleton_lines[segment_name], = self.ax.plot(segment_x, segment_y, segment_z, color = "cornflowerblue")
+
+    def update_skeleton(self, single_frame_xyz):
+        # pull out every segment's joints at once, then hand each line its slice
+        skeleton_xyz = single_frame_xyz[self.skeleton_joint_indices]
+        for segment_name, segment_slice in self.segment_slices.items():
+            segment_xyz = skeleton_xyz[segment_slice]
+            self.skeleton_lines[segment_name].set_data_3d(segment_xyz[:, 0], segment_xyz[:, 1], segment_xyz[:, 2])
 
     def animate_frame(self, frame_number, x_limits=None, y_limits=None, z_limits=None, scale_factor=None):
         # set title to frame number
@@ -217,17 +152,41 @@ class SkeletonAnimation:
         self.tracked_point_graph._offsets3d = (self.single_frame_x_data, self.single_frame_y_data, self.single_frame_z_data)
 
         # update skeleton plotting
-        self.update_skeleton(self.single_frame_x_data, self.single_frame_y_data, self.single_frame_z_data, self.skeleton_connection_dict)
+        self.update_skeleton(self.single_frame_xyz)
 
-    def run_animation(self):
-        self.anim = FuncAnimation(self.fig, self.animate_frame, frames=np.arange(0, self.number_of_frames, 1), interval=self.frame_interval, save_count=self.number_of_frames)
+    def get_playback_frames(self, start_time=None, end_time=None, frame_stride=1):
+        '''Get the frame numbers to play between start_time and end_time (in seconds from the start of the recording, None for the start/end), taking every frame_stride-th frame.
+        Returns a range, so the frame numbers are generated as they're played rather than stored.'''
+        start_frame = 0 if start_time is None else min(max(int(round(start_time * self.capture_fps)), 0), self.number_of_frames)
+        end_frame = self.number_of_frames if end_time is None else min(max(int(round(end_time * self.capture_fps)), 0), self.number_of_frames)
+        if frame_stride < 1:
+            raise Exception(f"frame stride must be at least 1, not {frame_stride}")
+        if start_frame >= end_frame:
+            raise Exception(f"no frames between {start_time} s and {end_time} s, the recording is {self.number_of_frames / self.capture_fps:.2f} s long")
 
+        return range(start_frame, end_frame, frame_stride)
 
-def main(display_video_bool, save_video_bool):
+    def get_output_fps(self, frame_stride=1, output_fps=None):
+        '''The fps to play or save at, by default the one that plays the strided frames back in real time'''
+        return output_fps if output_fps is not None else self.capture_fps / frame_stride
+
+    def run_animation(self, start_time=None, end_time=None, frame_stride=1, output_fps=None):
+        # cache_frame_data=False so matplotlib doesn't keep every frame it has played, the frames are just numbers into the (memory mapped) data
+        playback_frames = self.get_playback_frames(start_time, end_time, frame_stride)
+        self.anim = FuncAnimation(self.fig, self.animate_frame, frames=playback_frames, interval=1000 / self.get_output_fps(frame_stride, output_fps), cache_frame_data=False)
+
+
+def main(display_video_bool, save_video_bool, raw_frame_writer_bool=True, start_time=None, end_time=None, frame_stride=1, output_fps=None):
+    '''Play and/or save the skeleton animation between start_time and end_time (seconds, None for the whole recording),
+    showing every frame_stride-th frame at output_fps (by default real time, i.e. capture fps / frame_stride).'''
     start_timer = time.time()
 
     skeleton_animation = SkeletonAnimation()
-    skeleton_animation.run_animation()
+    output_fps = skeleton_animation.get_output_fps(frame_stride, output_fps)
+
+    # the FuncAnimation is only needed to play the animation or to save it through matplotlib's writer
+    if display_video_bool or (save_video_bool and not raw_frame_writer_bool):
+        skeleton_animation.run_animation(start_time, end_time, frame_stride, output_fps)
 
     # display plot if parameter set to true
     if display_video_bool:
@@ -236,8 +195,13 @@ def main(display_video_bool, save_video_bool):
     # save video if parameter set to true
     if save_video_bool:
         animation_path = os.path.join(skeleton_animation.session_folder_path, "simple_skeleton_animation.mp4")
-        video_writer = animation.FFMpegWriter(fps=60, bitrate=500)
-        skeleton_animation.anim.save(animation_path, writer=video_writer)
+        if raw_frame_writer_bool:
+            # render each frame on the Agg canvas and pipe its buffer straight to ffmpeg, instead of going through savefig for every frame
+            export_animation(skeleton_animation.fig, skeleton_animation.animate_frame, skeleton_animation.get_playback_frames(start_time, end_time, frame_stride), animation_path,
+                             fps=output_fps, extra_output_args=["-b:v", "500k"])
+        else:
+            video_writer = animation.FFMpegWriter(fps=output_fps, bitrate=500)
+            skeleton_animation.anim.save(animation_path, writer=video_writer)
 
     end_timer = time.time()
     time_elapsed = end_timer - start_timer
@@ -245,4 +209,5 @@ def main(display_video_bool, save_video_bool):
 
 if __name__ == "__main__":
     main(display_video_bool=True, save_video_bool=False) # uncomment to display animation
-    # main(display_video_bool=False, save_video_bool=True) # uncomment to save animation
\ No newline at end of file
+    # main(display_video_bool=False, save_video_bool=True) # uncomment to save animation
+    # main(display_video_bool=True, save_video_bool=False, start_time=30, end_time=45, frame_stride=2) # uncomment to preview 15 seconds at every other frame
\ No newline at end of file
@@ -0,0 +1,310 @@
+"""
+Scrub through a processed freemocap session interactively, instead of rendering the whole COM/BOS video to watch it.
+
+Everything that gets drawn (bones, COM, feet bounds, COM tail) is computed for every frame up front, so moving to a frame
+just hands each artist its slice of the precomputed arrays. The synced video frames are decoded on demand and the most
+recently shown ones are kept in a small cache.
+
+    python -m freemocap_visualizers.interactive_session_viewer path/to/FreeMocap_Data sessionID --stance natural
+
+left/right: one frame, up/down: 10 frames, page up/page down: 100 frames, home/end: first/last frame, space: play/pause
+"""
+import argparse
+import sys
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.widgets import Slider
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
+
+sys.path.append(str(Path(__file__).resolve().parents[1])) #so the freemocap_post_processing package can be imported from the repo root
+from freemocap_visualizers.mediapipe_COM_BOS_plotter import mediapipe_indices, skeleton_data_holder, skeleton_data_for_plotting, video_frame_source
+
+
+STANCE_FEET = {'natural': ['left', 'right'], 'left_leg': ['left'], 'right_leg': ['right']}
+FOOT_COLORS = {'left': 'blue', 'right': 'red'}
+COM_TAIL_LENGTH = 120
+DEFAULT_VIDEO_CACHE_SIZE = 32
+SCRUB_KEY_STEPS = {'left': -1, 'right': 1, 'down': -10, 'up': 10, 'pagedown': -100, 'pageup': 100}
+
+
+class session_geometry:
+    """Every frame's bones, feet bounds and COM as arrays, computed once from the sliced plotting data (see skeleton_data_for_plotting)."""
+
+    def __init__(self, freemocap_plotting_data, stance, fps):
+        if stance not in STANCE_FEET:
+            raise Exception('stance must be one of {}, not {}'.format(list(STANCE_FEET), stance))
+        self.feet = STANCE_FEET[stance]
+
+        self.skeleton_XYZ = np.asarray(freemocap_plotting_data.skeleton_XYZ_data, dtype=float)
+        self.total_body_COM_XYZ = np.asarray(freemocap_plotting_data.total_body_COM_data, dtype=float)
+        self.num_frames = len(self.skeleton_XYZ)
+        self.frame_numbers = np.asarray(freemocap_plotting_data.num_frame_range)[:self.num_frames]
+        self.time_array = np.arange(self.num_frames)/fps
+
+        self.bone_segments_XYZ = self.get_bone_segments(freemocap_plotting_data)
+        self.bone_segments_XY = self.bone_segments_XYZ[..., :2]
+        self.BOS_segments_XY, self.BOS_segment_colors = self.get_BOS_segments(freemocap_plotting_data)
+        self.foot_average_XYZ = {foot: np.asarray(getattr(freemocap_plotting_data, '{}_foot_average_XYZ'.format(foot))) for foot in self.feet}
+
+    def get_bone_segments(self, freemocap_plotting_data):
+        #(frames, bones, proximal/distal, XYZ), the skeleton segments plus the hip and shoulder connections the plotter draws between the left and right thigh/upper arm
+        skel_connections_XYZ = np.asarray(freemocap_plotting_data.skel_connections_XYZ_data, dtype=float)
+        segment_name_to_index = freemocap_plotting_data.skeleton_segment_name_to_index
+
+        connection_segments = [np.stack([skel_connections_XYZ[:, segment_name_to_index['left_' + segment], 0], skel_connections_XYZ[:, segment_name_to_index['right_' + segment], 0]], axis=1)
+                               for segment in ['thigh', 'upper_arm']]
+        return np.concatenate([skel_connections_XYZ] + [connection_segment[:, np.newaxis] for connection_segment in connection_segments], axis=1)
+
+    def get_BOS_segments(self, freemocap_plotting_data):
+        #(frames, segments, heel/toe, XY): each foot's heel to toe, plus the posterior (heels) and anterior (toes) bounds when standing on both feet
+        foot_XYZ = {foot: np.asarray(getattr(freemocap_plotting_data, '{}_foot_XYZ'.format(foot)), dtype=float) for foot in self.feet} #(heel/toe, frames, XYZ)
+        BOS_segments = [foot_XYZ[foot][:, :, :2].transpose(1, 0, 2) for foot in self.feet]
+        BOS_segment_colors = [FOOT_COLORS[foot] for foot in self.feet]
+        if len(self.feet) == 2:
+            left_foot_XY, right_foot_XY = foot_XYZ['left'][:, :, :2], foot_XYZ['right'][:, :, :2]
+            BOS_segments += [np.stack([left_foot_XY[0], right_foot_XY[0]], axis=1), np.stack([left_foot_XY[1], right_foot_XY[1]], axis=1)]
+            BOS_segment_colors += ['coral', 'forestgreen']
+        return np.stack(BOS_segments, axis=1), BOS_segment_colors
+
+
+class video_frame_cache:
+    """Keeps the last cache_size frames fetched from a video_frame_source, so scrubbing back and forth over the same frames doesn't decode them again."""
+
+    def __init__(self, frame_source, cache_size=DEFAULT_VIDEO_CACHE_SIZE):
+        self.frame_source = frame_source
+        self.cache_size = cache_size
+        self.cached_frames = OrderedDict()
+
+    def get_frame(self, frame):
+        if frame in self.cached_frames:
+            self.cached_frames.move_to_end(frame)
+            return self.cached_frames[frame]
+        image = self.frame_source.get_frame(frame)
+        self.cached_frames[frame] = image
+        if len(self.cached_frames) > self.cache_size:
+            self.cached_frames.popitem(last=False)
+        return image
+
+    def close(self):
+        self.frame_source.close()
+        self.cached_frames.clear()
+
+
+class interactive_session_viewer:
+
+    def __init__(self, geometry, video_frames=None, azimuth=-70):
+        self.geometry = geometry
+        self.video_frames = video_frames
+        self.azimuth = azimuth
+        self.frame = 0
+        self.playback_timer = None
+
+        self.create_figure()
+        self.create_artists()
+        self.create_controls()
+        self.show_frame(0)
+
+    def create_figure(self):
+        figure = plt.figure(figsize=(10,10))
+        figure.suptitle('Center of Mass (COM) Comparison', fontsize = 16, y = .97, color = 'royalblue')
+
+        self.ax_3d = figure.add_axes([.02,.45,.5,.5], projection = '3d')
+        self.ax_video = figure.add_axes([.55,.55,.42,.35])
+        self.ax_2d = figure.add_axes([.08,.1,.35,.3])
+        self.ax_1d_lateral = figure.add_axes([.55,.32,.4,.17])
+        self.ax_1d_ap = figure.add_axes([.55,.1,.4,.17])
+        self.ax_slider = figure.add_axes([.12,.02,.76,.025])
+        self.ax_video.axis('off')
+        self.figure = figure
+
+    def create_artists(self):
+        #every artist is created once here, show_frame only ever changes their data
+        geometry = self.geometry
+        skel_3d_range, com_2d_range = 900, 600
+        mx_skel, my_skel = np.nanmean(geometry.skeleton_XYZ[:, :, 0]), np.nanmean(geometry.skeleton_XYZ[:, :, 1])
+        mz_skel = np.nanmean(geometry.skeleton_XYZ[geometry.num_frames//2, :, 2])
+        mx_com, my_com = np.nanmean(geometry.total_body_COM_XYZ[:, 0]), np.nanmean(geometry.total_body_COM_XYZ[:, 1])
+
+        ax_3d = self.ax_3d
+        ax_3d.set_xlim([mx_skel-skel_3d_range, mx_skel+skel_3d_range])
+        ax_3d.set_ylim([my_skel-skel_3d_range, my_skel+skel_3d_range])
+        ax_3d.set_zlim([mz_skel-skel_3d_range, mz_skel+skel_3d_range])
+        ax_3d.view_init(elev = 0, azim = self.azimuth)
+        ax_3d.set_xlabel('X (mm)')
+        ax_3d.set_ylabel('Y (mm)')
+        ax_3d.set_zlabel('Z (mm)')
+        self.frame_number_text = ax_3d.text2D(.5, .95, '', transform = ax_3d.transAxes, ha = 'center', fontsize = 12) #not the axes title, which axes move around when they draw
+        self.bones_3d = Line3DCollection(geometry.bone_segments_XYZ[0], colors = 'magenta')
+        ax_3d.add_collection3d(self.bones_3d)
+        self.skeleton_scatter_3d = ax_3d.scatter(*geometry.skeleton_XYZ[0].T, color = 'darkmagenta', label = 'MediaPipe')
+        self.total_body_COM_scatter_3d = ax_3d.scatter(*geometry.total_body_COM_XYZ[0:1].T, color = 'magenta', label = 'Total Body COM', marker = '*', s = 70, edgecolor = 'purple')
+        ax_3d.legend(loc = 'lower left')
+
+        ax_2d = self.ax_2d
+        ax_2d.set_title('Total Body COM Trajectory')
+        ax_2d.set_xlim([mx_com-com_2d_range, mx_com+com_2d_range])
+        ax_2d.set_ylim([my_com-com_2d_range, my_com+com_2d_range])
+        ax_2d.set_aspect('equal', adjustable='box')
+        ax_2d.set_xlabel('X Position (mm)')
+        ax_2d.set_ylabel('Y Position (mm)')
+        self.bones_2d = ax_2d.add_collection(LineCollection(geometry.bone_segments_XY[0], colors = 'magenta', alpha = .4))
+        self.BOS_lines_2d = ax_2d.add_collection(LineCollection(geometry.BOS_segments_XY[0], colors = geometry.BOS_segment_colors))
+        self.COM_tail_2d, = ax_2d.plot([], [], color = 'grey')
+        self.COM_marker_2d, = ax_2d.plot([], [], marker = '*', color = 'magenta', markeredgecolor = 'purple', ms = 8)
+
+        self.time_cursors, self.COM_markers_1d = [], []
+        for ax_1d, axis_index, title, y_label in [(self.ax_1d_lateral, 0, 'Lateral COM Position vs. Time', 'X Position (mm)'),
+                                                  (self.ax_1d_ap, 1, 'Anterior/Posterior COM Position vs. Time', 'Y Position (mm)')]:
+            #the whole session is drawn once, only the cursor and the marker move
+            ax_1d.set_title(title)
+            ax_1d.set_ylabel(y_label)
+            ax_1d.set_xlim(geometry.time_array[0], geometry.time_array[-1])
+            for foot, foot_average_XYZ in geometry.foot_average_XYZ.items():
+                ax_1d.plot(geometry.time_array, foot_average_XYZ[:, axis_index], color = FOOT_COLORS[foot], alpha = .5)
+            ax_1d.plot(geometry.time_array, geometry.total_body_COM_XYZ[:, axis_index], color = 'grey')
+            self.time_cursors.append(ax_1d.axvline(geometry.time_array[0], color = 'black'))
+            self.COM_markers_1d.append(ax_1d.plot([], [], '*', color = 'magenta', ms = 8, markeredgecolor = 'purple')[0])
+        self.ax_1d_lateral.axes.xaxis.set_ticks([])
+        self.ax_1d_ap.set_xlabel('Time (s)')
+
+        self.video_image = None
+        if self.video_frames is not None:
+            if hasattr(self.video_frames.frame_source, 'fit_to_axis'):
+                self.video_frames.frame_source.fit_to_axis(self.ax_video)
+            self.video_image = self.ax_video.imshow(self.video_frames.get_frame(0))
+
+        #the artists that change from frame to frame. When the canvas can blit they're animated, i.e. left out of the full redraws,
+        #and drawn on their own on top of a saved background of everything else (see on_draw and show_frame)
+        self.frame_artists = [self.frame_number_text, self.bones_3d, self.skeleton_scatter_3d, self.total_body_COM_scatter_3d,
+                              self.bones_2d, self.BOS_lines_2d, self.COM_tail_2d, self.COM_marker_2d, *self.time_cursors, *self.COM_markers_1d]
+        if self.video_image is not None:
+            self.frame_artists.append(self.video_image)
+
+    def create_controls(self):
+        self.frame_slider = Slider(self.ax_slider, 'Frame', 0, self.geometry.num_frames - 1, valinit = 0, valstep = 1)
+        self.frame_slider.on_changed(lambda slider_value: self.show_frame(int(slider_value)))
+        self.figure.canvas.mpl_connect('key_press_event', self.on_key_press)
+
+        self.background = None
+        self.use_blit = self.figure.canvas.supports_blit
+        if self.use_blit:
+            self.frame_slider.drawon = False #the slider (label and value text included, which sit outside its axes) is drawn with the frame artists instead of redrawing the whole figure
+            self.frame_artists.append(self.ax_slider)
+            for frame_artist in self.frame_artists:
+                frame_artist.set_animated(True)
+            self.figure.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        #after any full redraw (the first one, resizing, rotating the 3d view...) save the new background and put the frame artists back on it
+        self.background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+        self.draw_frame_artists()
+
+    def draw_frame_artists(self):
+        for frame_artist in self.frame_artists:
+            if hasattr(frame_artist, 'do_3d_projection'):
+                frame_artist.do_3d_projection() #3d artists are only projected onto the screen when their axes draws, which blitting skips
+            self.figure.draw_artist(frame_artist)
+
+    def on_key_press(self, event):
+        if event.key in SCRUB_KEY_STEPS:
+            self.set_frame(self.frame + SCRUB_KEY_STEPS[event.key])
+        elif event.key == 'home':
+            self.set_frame(0)
+        elif event.key == 'end':
+            self.set_frame(self.geometry.num_frames - 1)
+        elif event.key == ' ':
+            self.toggle_playback()
+
+    def set_frame(self, frame):
+        #through the slider, so it moves too (and calls show_frame)
+        self.frame_slider.set_val(min(max(frame, 0), self.geometry.num_frames - 1))
+
+    def toggle_playback(self):
+        if self.playback_timer is not None:
+            self.playback_timer.stop()
+            self.playback_timer = None
+            return
+        frame_interval_ms = 1000*(self.geometry.time_array[1] - self.geometry.time_array[0]) if self.geometry.num_frames > 1 else 1000
+        self.playback_timer = self.figure.canvas.new_timer(interval = max(int(frame_interval_ms), 1))
+        self.playback_timer.add_callback(lambda: self.set_frame((self.frame + 1) % self.geometry.num_frames))
+        self.playback_timer.start()
+
+    def show_frame(self, frame):
+        geometry = self.geometry
+        self.frame = frame
+
+        self.frame_number_text.set_text('Frame# {}'.format(geometry.frame_numbers[frame]))
+        self.bones_3d.set_segments(geometry.bone_segments_XYZ[frame])
+        self.skeleton_scatter_3d._offsets3d = tuple(geometry.skeleton_XYZ[frame].T)
+        self.total_body_COM_scatter_3d._offsets3d = tuple(geometry.total_body_COM_XYZ[frame:frame+1].T)
+
+        self.bones_2d.set_segments(geometry.bone_segments_XY[frame])
+        self.BOS_lines_2d.set_segments(geometry.BOS_segments_XY[frame])
+        COM_tail = geometry.total_body_COM_XYZ[max(frame - COM_TAIL_LENGTH, 0):frame]
+        self.COM_tail_2d.set_data(COM_tail[:, 0], COM_tail[:, 1])
+        self.COM_marker_2d.set_data(geometry.total_body_COM_XYZ[frame:frame+1, 0], geometry.total_body_COM_XYZ[frame:frame+1, 1])
+
+        for axis_index, (time_cursor, COM_marker) in enumerate(zip(self.time_cursors, self.COM_markers_1d)):
+            time_cursor.set_xdata([geometry.time_array[frame], geometry.time_array[frame]])
+            COM_marker.set_data(geometry.time_array[frame:frame+1], geometry.total_body_COM_XYZ[frame:frame+1, axis_index])
+
+        if self.video_image is not None:
+            self.video_image.set_data(self.video_frames.get_frame(frame))
+
+        if self.use_blit and self.background is not None:
+            self.figure.canvas.restore_region(self.background)
+            self.draw_frame_artists()
+            self.figure.canvas.blit(self.figure.bbox)
+        else:
+            self.figure.canvas.draw_idle()
+
+    def close(self):
+        if self.video_frames is not None:
+            self.video_frames.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scrub through a processed freemocap session (skeleton, COM, BOS and the synced video) with a slider or the arrow keys')
+    parser.add_argument('freemocap_data_folder', type=Path, help='the folder holding the session folders')
+    parser.add_argument('session_id')
+    parser.add_argument('--stance', default='natural', choices=list(STANCE_FEET), help='which feet make up the base of support')
+    parser.add_argument('--skeleton-type', default='mediapipe')
+    parser.add_argument('--fps', type=float, default=None, help="the session's frame rate, read from the session container if it has one (30 otherwise)")
+    parser.add_argument('--no-video', action='store_true', help="don't show the synced video")
+    parser.add_argument('--video-cache-size', type=int, default=DEFAULT_VIDEO_CACHE_SIZE, help='number of decoded video frames to keep around for scrubbing back')
+    args = parser.parse_args()
+
+    session_info = {'sessionID': args.session_id, 'skeleton_type': args.skeleton_type}
+    load_start_time = time.perf_counter()
+    skeleton_data = skeleton_data_holder(args.freemocap_data_folder, session_info)
+
+    fps = args.fps
+    if fps is None and hasattr(skeleton_data, 'session_container'):
+        fps = skeleton_data.session_container.metadata.get('fps')
+    fps = fps or 30
+
+    num_frame_range = range(0, len(skeleton_data.skeleton_XYZ_data))
+    freemocap_plotting_data = skeleton_data_for_plotting(skeleton_data, num_frame_range, 1, mediapipe_indices)
+    freemocap_plotting_data.skeleton_XYZ_data = freemocap_plotting_data.skeleton_XYZ_data[:, 0:33, :] #only the body points, same as the plotter
+    geometry = session_geometry(freemocap_plotting_data, args.stance, fps)
+
+    video_frames = None
+    if not args.no_video:
+        try:
+            video_frames = video_frame_cache(video_frame_source(args.freemocap_data_folder, session_info, num_frame_range, buffer_size=8), args.video_cache_size)
+        except Exception as error:
+            print('Not showing the video: {}'.format(error))
+
+    print('Loaded {} frames in {:.1f} s'.format(geometry.num_frames, time.perf_counter() - load_start_time))
+    viewer = interactive_session_viewer(geometry, video_frames)
+    plt.show()
+    viewer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,15 +2,25 @@
 
 import numpy as np
 
+import matplotlib
 import matplotlib.pyplot as plt
 import pickle
 import cv2
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from matplotlib.animation import FuncAnimation
 import matplotlib.animation as animation
 import matplotlib.ticker as mticker
 
 from pathlib import Path 
 from datetime import datetime
+import sys
+import threading
+
+sys.path.append(str(Path(__file__).resolve().parents[1])) #so the freemocap_post_processing package can be imported from the repo root
+from freemocap_post_processing.session_container import SESSION_CONTAINER_FILE_NAME, SessionContainer
+from freemocap_visualizers.raw_frame_writer import export_animation
 
 
 
@@ -51,6 +61,10 @@ mediapipe_indices = [
     'right_foot_index'
     ]
     
+#'persistent' creates every line, scatter and legend once and only updates their data each frame, 'redraw' clears and replots all the axes every frame
+RENDER_MODES = ['persistent','redraw']
+#'raw' pipes each frame's Agg buffer straight to ffmpeg (see raw_frame_writer.py), 'ffmpeg' saves through FuncAnimation and matplotlib's FFMpegWriter
+VIDEO_WRITERS = ['raw','ffmpeg']
 
 
 #you can skip every 10th frame 
@@ -66,10 +80,25 @@ class skeleton_data_holder:
 
     def run(self,path_to_data_array_folder,skeleton_type):
 
+        session_container_path = path_to_data_array_folder/SESSION_CONTAINER_FILE_NAME
+        if session_container_path.exists():
+            self.load_session_container(session_container_path)
+            return
+
+        #sessions processed before the session container existed
         self.skeleton_XYZ_data = self.load_skeleton_XYZ_data(path_to_data_array_folder,skeleton_type)
         self.total_body_COM_data = self.load_total_body_COM_XYZ_data(path_to_data_array_folder)
         self.segment_COM_data = self.load_segment_COM_XYZ_data(path_to_data_array_folder)
         self.skeleton_connections_data = self.load_skeleton_connections_data(path_to_data_array_folder,skeleton_type)
+
+    def load_session_container(self, session_container_path):
+        #the datasets are read lazily, so only the frames that get sliced out for plotting are ever loaded
+        self.session_container = SessionContainer(session_container_path)
+        self.skeleton_XYZ_data = self.session_container['origin_aligned']
+        self.total_body_COM_data = self.session_container['total_body_COM']
+        self.segment_COM_data = self.session_container['segment_COM']
+        self.skeleton_connections_data = self.session_container['segments']
+        self.skeleton_segment_names = self.session_container.metadata['segment_names']
          
     def load_skeleton_XYZ_data(self, path_to_data_array_folder, skeleton_type):
 
@@ -93,46 +122,45 @@ class skeleton_data_holder:
         return segment_COM_XYZ_data
 
     def load_skeleton_connections_data(self, path_to_data_array_folder,skeleton_type):
-
-        skeleton_connections_file_name = 'mediapipe_skeleton_segments_dict.pkl'.format(skeleton_type)
+        #the segments were saved as a pickled list of {segment: [proximal, distal]} dicts, turned into a (frames, segments, proximal/distal, XYZ) array here
+        skeleton_connections_file_name = '{}_skeleton_segments_dict.pkl'.format(skeleton_type)
     
         open_file = open(path_to_data_array_folder/skeleton_connections_file_name, "rb")
-        skel_connections_XYZ = pickle.load(open_file)
+        skel_connections_frame_dicts = pickle.load(open_file)
         open_file.close()
 
+        self.skeleton_segment_names = list(skel_connections_frame_dicts[0].keys())
+        skel_connections_XYZ = np.array([[this_frame_segments[segment] for segment in self.skeleton_segment_names] for this_frame_segments in skel_connections_frame_dicts])
+
         return skel_connections_XYZ
 
 
-class video_loader:
+class video_frame_source:
+    #frames are decoded on a background thread into a small read-ahead buffer as the animation asks for them, instead of all being loaded up front
+    #(1100 frames of 1080p video is ~7GB as a list of arrays)
 
-    def __init__(self,path_to_freemocap_data_folder,session_info,num_frame_range):
+    def __init__(self,path_to_freemocap_data_folder,session_info,num_frame_range,step_interval = 1,buffer_size = 64,downscale_to_axis = True):
         
         self.start_frame = num_frame_range[0]
         self.end_frame = num_frame_range[-1]
+        self.step_interval = step_interval
+        self.buffer_size = buffer_size
+        self.downscale_to_axis = downscale_to_axis
         sessionID = session_info['sessionID']
-        
-        self.run(path_to_freemocap_data_folder,sessionID)
 
-    def run(self,path_to_freemocap_data_folder,sessionID):
-        synced_vid_path = self.create_synced_vid_path(path_to_freemocap_data_folder,sessionID)
-        cap = self.load_video_capture_object(synced_vid_path)
-        self.video_frames_to_plot = self.get_video_frames_to_plot(cap)
+        self.synced_vid_path = self.create_synced_vid_path(path_to_freemocap_data_folder,sessionID)
+        self.num_frames = len(range(self.start_frame,self.end_frame,self.step_interval)) #frame index i is video frame start_frame + i*step_interval, same as the sliced skeleton data
 
-        f = 2
-
-    def get_video_frames_to_plot(self,cap):
-
-        video_frames_to_plot = []
-        frame = self.start_frame
-        cap.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
-        while frame < self.end_frame:
-            success, image = cap.read()
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            video_frames_to_plot.append(image)
-            frame += 1
+        cap = self.load_video_capture_object(self.synced_vid_path)
+        self.video_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.video_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         cap.release()
+        self.display_size = None #(width, height) to resize the frames to, None keeps the video size
 
-        return video_frames_to_plot    
+        self.buffer_condition = threading.Condition()
+        self.frame_buffer = {} #frame index: RGB image, only ever holds buffer_size frames
+        self.decode_thread = None
+        self.last_frame = None #the last frame handed out, shown again for any frame the video doesn't have
 
     def create_synced_vid_path(self,path_to_freemocap_data_folder,sessionID):
         #synced_video_name = sessionID + '_annotated_video_1.mp4'
@@ -143,8 +171,124 @@ class video_loader:
 
     def load_video_capture_object(self,synced_vid_path):
         cap = cv2.VideoCapture(str(synced_vid_path))
+        if not cap.isOpened():
+            raise Exception('Could not open video {}'.format(synced_vid_path))
         return cap
 
+    def fit_to_axis(self,ax):
+        #the video only ever gets drawn at the size of its axis, so there's no point keeping (or drawing) anything bigger
+        if not self.downscale_to_axis:
+            return
+        axis_extent = ax.get_window_extent()
+        scale = min(axis_extent.width/self.video_width, axis_extent.height/self.video_height, 1)
+        display_size = (max(int(round(self.video_width*scale)),1), max(int(round(self.video_height*scale)),1))
+        if display_size != self.display_size:
+            self.stop_decoding() #anything already buffered is the wrong size
+            self.display_size = display_size
+
+    def start_decoding(self,frame):
+        self.stop_decoding()
+        with self.buffer_condition:
+            self.frame_buffer = {}
+            self.next_frame = frame #the next frame the decode thread will put in the buffer
+            self.video_ended = False
+            self.stop_requested = False
+        self.decode_thread = threading.Thread(target=self.decode_frames, args=(frame,), daemon=True)
+        self.decode_thread.start()
+
+    def stop_decoding(self):
+        if self.decode_thread is None:
+            return
+        with self.buffer_condition:
+            self.stop_requested = True
+            self.buffer_condition.notify_all()
+        self.decode_thread.join()
+        self.decode_thread = None
+
+    def decode_frames(self,frame):
+        #runs on the decode thread, reads the video in order from frame until the buffer is full, then waits for get_frame to use some up
+        cap = self.load_video_capture_object(self.synced_vid_path)
+        cap.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame + frame*self.step_interval)
+        first_frame = frame
+        try:
+            while frame < self.num_frames:
+                with self.buffer_condition:
+                    while len(self.frame_buffer) >= self.buffer_size and not self.stop_requested:
+                        self.buffer_condition.wait()
+                    if self.stop_requested:
+                        return
+
+                success, image = True, None
+                if frame > first_frame:
+                    success = all(cap.grab() for skipped_frame in range(self.step_interval - 1)) #the frames in between the plotted ones
+                if success:
+                    success, image = cap.read()
+                if not success or image is None:
+                    print('Could not read video frame {}, showing the last frame read from here on'.format(self.start_frame + frame*self.step_interval))
+                    break
+
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                if self.display_size is not None and self.display_size != (self.video_width,self.video_height):
+                    image = cv2.resize(image, self.display_size, interpolation = cv2.INTER_AREA)
+
+                with self.buffer_condition:
+                    self.frame_buffer[frame] = image
+                    self.next_frame = frame + 1
+                    self.buffer_condition.notify_all()
+                frame += 1
+        finally:
+            cap.release()
+            with self.buffer_condition:
+                self.video_ended = True
+                self.buffer_condition.notify_all()
+
+    def get_frame(self,frame):
+        #frames are expected in order, anything before the requested frame is dropped from the buffer.
+        #asking for a frame behind the buffer or too far ahead of it seeks the video there and starts decoding again
+        if self.decode_thread is None:
+            self.start_decoding(frame)
+        with self.buffer_condition:
+            past_end_of_video = self.video_ended and frame >= self.next_frame
+            needs_seek = frame not in self.frame_buffer and not past_end_of_video and (frame < min(self.frame_buffer, default=self.next_frame) or frame >= self.next_frame + self.buffer_size)
+        if needs_seek:
+            self.start_decoding(frame)
+
+        with self.buffer_condition:
+            while True:
+                #the frames before the requested one are dropped before waiting too, a full buffer would otherwise stop the decode thread short of it
+                for buffered_frame in [buffered_frame for buffered_frame in self.frame_buffer if buffered_frame < frame]:
+                    del self.frame_buffer[buffered_frame]
+                self.buffer_condition.notify_all()
+                if frame in self.frame_buffer or (self.video_ended and frame >= self.next_frame):
+                    break
+                self.buffer_condition.wait()
+            image = self.frame_buffer.get(frame)
+
+        if image is not None:
+            self.last_frame = image
+        elif self.last_frame is None:
+            display_width, display_height = self.display_size or (self.video_width,self.video_height)
+            self.last_frame = np.zeros((display_height, display_width, 3), dtype = np.uint8) #nothing could be read at all
+        return self.last_frame
+
+    def close(self):
+        self.stop_decoding()
+        self.frame_buffer = {}
+
+    def __getstate__(self):
+        #sent to the chunk rendering processes without its thread or buffer, each process decodes its own frames
+        state = self.__dict__.copy()
+        for decoding_state in ['buffer_condition','frame_buffer','decode_thread','last_frame','next_frame','video_ended','stop_requested']:
+            state.pop(decoding_state, None)
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.buffer_condition = threading.Condition()
+        self.frame_buffer = {}
+        self.decode_thread = None
+        self.last_frame = None
+
 
 class skeleton_data_for_plotting:
     def __init__(self, skeleton_data_class, num_frame_range, step_interval,skeleton_indices):
@@ -176,6 +320,7 @@ class skeleton_data_for_plotting:
         self.total_body_COM_data = skeleton_data_class.total_body_COM_data[self.start_frame:self.end_frame:self.step_interval,:]
         self.segment_COM_data = skeleton_data_class.segment_COM_data[self.start_frame:self.end_frame:self.step_interval,:,:]
         self.skel_connections_XYZ_data = skeleton_data_class.skeleton_connections_data[self.start_frame:self.end_frame:self.step_interval]
+        self.skeleton_segment_name_to_index = {segment_name:segment_index for segment_index,segment_name in enumerate(skeleton_data_class.skeleton_segment_names)}
 
 
 
@@ -227,11 +372,24 @@ class skeleton_data_for_plotting:
 
 class COM_plot_creator:
 
-    def __init__(self,freemocap_session_path,freemocap_plotting_data,output_video_fps, video_frames_to_plot,stance):
+    def __init__(self,freemocap_session_path,freemocap_plotting_data,output_video_fps, video_frames_to_plot,stance, render_mode = 'persistent', num_workers = 1,
+                 frames_to_render = None, output_video_path = None, video_writer = 'raw'):
+        #num_workers > 1 splits the frames into that many chunks, each rendered to its own video by a separate process and then joined without re-encoding.
+        #frames_to_render and output_video_path are how each of those processes is told which frames to render and where (all of them to the session folder by default)
         
-        self.azimuth = -70
+        if render_mode not in RENDER_MODES:
+            raise Exception('render_mode must be one of {}, not {}'.format(RENDER_MODES, render_mode))
+        if video_writer not in VIDEO_WRITERS:
+            raise Exception('video_writer must be one of {}, not {}'.format(VIDEO_WRITERS, video_writer))
+        self.start_azimuth = -70
+        self.azimuth = self.start_azimuth
         self.stance = stance
+        self.render_mode = render_mode
+        self.num_workers = num_workers
+        self.video_writer = video_writer
         self.num_frame_range = freemocap_plotting_data.num_frame_range
+        self.frames_to_render = frames_to_render if frames_to_render is not None else freemocap_plotting_data.num_frames_to_plot
+        self.output_video_path = output_video_path if output_video_path is not None else freemocap_session_path/'medaipipe_testing_{}.mp4'.format(stance)
 
         self.run(freemocap_session_path,freemocap_plotting_data,output_video_fps,video_frames_to_plot)
 
@@ -244,16 +402,53 @@ class COM_plot_creator:
         
 
         self.img_artist = None
+        self.persistent_artists_created = False
+
+        if self.num_workers > 1:
+            self.render_in_chunks(freemocap_session_path,freemocap_plotting_data,output_video_fps,video_frames_to_plot)
+            print('Animation has been saved to {}'.format(self.output_video_path))
+            return
 
         figure = self.create_figure()
+        video_frames_to_plot.fit_to_axis(self.ax_video)
 
         print('Starting Frame Animation') 
-        ani = FuncAnimation(figure, self.animate, frames= freemocap_plotting_data.num_frames_to_plot, interval=.1, repeat=False, fargs = (video_frames_to_plot,), init_func= self.animation_init)
-        writervideo = animation.FFMpegWriter(fps=output_video_fps)
-        ani.save(freemocap_session_path/'medaipipe_testing_{}.mp4'.format(self.stance), writer=writervideo)
-        print('Animation has been saved to {}'.format(freemocap_session_path))
+        if self.video_writer == 'raw':
+            export_animation(figure, self.animate, self.frames_to_render, self.output_video_path, output_video_fps, init_function = self.animation_init, fargs = (video_frames_to_plot,))
+        else:
+            ani = FuncAnimation(figure, self.animate, frames= self.frames_to_render, interval=.1, repeat=False, fargs = (video_frames_to_plot,), init_func= self.animation_init)
+            writervideo = animation.FFMpegWriter(fps=output_video_fps)
+            ani.save(self.output_video_path, writer=writervideo)
+        video_frames_to_plot.close()
+        plt.close(figure)
+        print('Animation has been saved to {}'.format(self.output_video_path))
         f=2
 
+    def render_in_chunks(self,freemocap_session_path,freemocap_plotting_data,output_video_fps,video_frames_to_plot):
+        #every frame is plotted from its own frame number (the azimuth, COM tail and traces included), so the chunks join up seamlessly
+        frame_chunks = [frame_chunk for frame_chunk in np.array_split(np.array(self.frames_to_render), self.num_workers) if len(frame_chunk) > 0]
+        with tempfile.TemporaryDirectory(dir = freemocap_session_path) as chunk_folder:
+            chunk_video_paths = [Path(chunk_folder)/'chunk_{}.mp4'.format(chunk_number) for chunk_number in range(len(frame_chunks))]
+
+            print('Rendering {} frames in {} chunks'.format(len(self.frames_to_render),len(frame_chunks)))
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                chunk_futures = [executor.submit(render_COM_plot_chunk,freemocap_session_path,freemocap_plotting_data,output_video_fps,video_frames_to_plot,self.stance,
+                                                 self.render_mode,range(frame_chunk[0],frame_chunk[-1]+1),chunk_video_path,self.video_writer)
+                                 for frame_chunk, chunk_video_path in zip(frame_chunks,chunk_video_paths)]
+                for chunk_future in chunk_futures:
+                    chunk_future.result() #re-raise anything that went wrong in a chunk
+
+            self.join_chunk_videos(chunk_video_paths,Path(chunk_folder)/'chunk_list.txt')
+
+    def join_chunk_videos(self,chunk_video_paths,chunk_list_path):
+        #the chunks are all encoded the same way, so ffmpeg can join them by copying the streams without re-encoding anything
+        with open(chunk_list_path,'w') as chunk_list_file:
+            chunk_list_file.writelines("file '{}'\n".format(chunk_video_path.as_posix()) for chunk_video_path in chunk_video_paths)
+        ffmpeg_process = subprocess.run([matplotlib.rcParams['animation.ffmpeg_path'],'-hide_banner','-v','error','-y','-f','concat','-safe','0','-i',str(chunk_list_path),
+                                         '-c','copy',str(self.output_video_path)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if ffmpeg_process.returncode != 0:
+            raise Exception('Could not join the chunk videos: {}'.format(ffmpeg_process.stderr.decode(errors='replace')))
+
     def create_figure(self):
 
         figure = plt.figure(figsize=(10,10))
@@ -308,13 +503,20 @@ class COM_plot_creator:
         ax_1d_lat.cla()
         ax_1d_ap.cla()
         
+        self.set_title_and_view(frame,ax_3d)
+        self.set_axes(ax_3d,ax_2d,ax_1d_lat,ax_1d_ap,ax_video)
+
+    def set_title_and_view(self,frame,ax_3d):
         ax_3d.set_title('Frame# {}'.format(str(self.num_frame_range[frame])),pad = -20, y = 1.)
-        ax_3d.set_xlim([self.mx_skel-self.skel_3d_range, self.mx_skel+self.skel_3d_range]) #maybe set ax limits before the function? if we're using cla() they probably don't need to be redefined every time 
+
+        self.azimuth = self.start_azimuth + .25*(frame + 1) #from the frame number, not the previous frame's azimuth, so chunks rendered separately still rotate continuously
+        ax_3d.view_init(elev = 0, azim = self.azimuth)
+
+    def set_axes(self,ax_3d,ax_2d,ax_1d_lat,ax_1d_ap,ax_video):
+        #limits, ticks and labels, which only need setting once if the axes aren't cleared
+        ax_3d.set_xlim([self.mx_skel-self.skel_3d_range, self.mx_skel+self.skel_3d_range])
         ax_3d.set_ylim([self.my_skel-self.skel_3d_range, self.my_skel+self.skel_3d_range])
         ax_3d.set_zlim([self.mz_skel-self.skel_3d_range, self.mz_skel+self.skel_3d_range])
-        
-        self.azimuth = self.azimuth + .25
-        ax_3d.view_init(elev = 0, azim = self.azimuth)
 
         ax_3d.xaxis.set_major_locator(mticker.MultipleLocator(400))
         ax_3d.xaxis.set_minor_locator(mticker.MultipleLocator(200))
@@ -365,17 +567,16 @@ class COM_plot_creator:
         left_segment_name = 'left_' + segment
         right_segment_name = 'right_' + segment
 
-        left_joint = skeleton_connection_data[frame][left_segment_name][0]
-        right_joint = skeleton_connection_data[frame][right_segment_name][0]
+        segment_name_to_index = self.freemocap_plotting_data.skeleton_segment_name_to_index
+        left_joint = skeleton_connection_data[frame,segment_name_to_index[left_segment_name],0]
+        right_joint = skeleton_connection_data[frame,segment_name_to_index[right_segment_name],0]
         segment_connection_x, segment_connection_y, segment_connection_z = [[left_joint[0],right_joint[0]],[left_joint[1],right_joint[1]],[left_joint[2],right_joint[2]]]
 
         return segment_connection_x, segment_connection_y, segment_connection_z
 
     def plot_skeleton_bones(self,frame,ax_3d,ax_2d,skeleton_connection_data, color_str, alpha_val_3d = 1, alpha_val_2d = .4):
         this_frame_skeleton_data = skeleton_connection_data[frame]
-        for segment in this_frame_skeleton_data.keys():
-            prox_joint = this_frame_skeleton_data[segment][0] 
-            dist_joint = this_frame_skeleton_data[segment][1]
+        for prox_joint, dist_joint in this_frame_skeleton_data:
             
             bone_x,bone_y,bone_z = [prox_joint[0],dist_joint[0]],[prox_joint[1],dist_joint[1]],[prox_joint[2],dist_joint[2]] 
 
@@ -399,7 +600,9 @@ class COM_plot_creator:
 
     def animation_init(self):
         #the FuncAnimation needs an initial function that it will run, otherwise it will run animate() twice for frame 0 
-        pass  
+        if self.render_mode == 'persistent' and not self.persistent_artists_created:
+            self.create_persistent_artists()
+            self.persistent_artists_created = True
 
     def get_this_frame_foot_data(self,frame,foot_data):
         this_frame_foot_data_x = [foot_data[0][frame][0],foot_data[1][frame][0]]
@@ -475,6 +678,24 @@ class COM_plot_creator:
 
     def animate(self,frame,video_frames_to_plot):
 
+        if frame % 100 == 0:
+            now = datetime.now()
+            current_time = now.strftime("%H:%M:%S")
+            print("Currently on frame: {} at {}".format(frame,current_time))
+
+        if self.render_mode == 'persistent':
+            self.update_persistent_artists(frame)
+        else:
+            self.redraw_frame(frame)
+
+        video_frame = video_frames_to_plot.get_frame(frame)
+        if self.img_artist is None:
+            self.img_artist = self.ax_video.imshow(video_frame)
+        else:
+            self.img_artist.set_data(video_frame)
+
+    def redraw_frame(self,frame):
+
         ax_3d = self.ax_3d
         ax_2d = self.ax_2d 
         ax_video = self.ax_video
@@ -483,10 +704,6 @@ class COM_plot_creator:
         
         
         freemocap_bone_color = 'magenta'
-        if frame % 100 == 0:
-            now = datetime.now()
-            current_time = now.strftime("%H:%M:%S")
-            print("Currently on frame: {} at {}".format(frame,current_time))
 
         self.clear_and_set_axes(frame,ax_3d,ax_2d,ax_1d_lat,ax_1d_ap,ax_video)
 
@@ -551,12 +768,9 @@ class COM_plot_creator:
         ax_1d_ap.plot(self.time_array[frame],self.freemocap_plotting_data.total_body_COM_data[frame,1], '*', color = 'magenta', ms = 8, markeredgecolor = 'purple')
 
 
-        video_frame = video_frames_to_plot.video_frames_to_plot[frame]
-        if self.img_artist is None:
-            self.img_artist = ax_video.imshow(video_frame)
-        else:
-            self.img_artist.set_data(video_frame)
+        self.create_legends(ax_3d,ax_2d)
 
+    def create_legends(self,ax_3d,ax_2d):
         a = ax_3d.get_legend_handles_labels()
         b = {l:h for h,l in zip(*a)}
         c = [*zip(*b.items())]              # c = [(l1 l2) (h1 h2)]
@@ -569,8 +783,120 @@ class COM_plot_creator:
         d1 = c1[::-1]
         ax_2d.legend(*d1,fontsize = 10, bbox_to_anchor=(1.15, -.55),ncol = 2)  
 
+    def create_persistent_artists(self):
+        #plots frame 0 the same way redraw_frame does (same artists, created in the same order), keeping hold of every artist so update_persistent_artists can move it
+        ax_3d = self.ax_3d
+        ax_2d = self.ax_2d 
+        ax_1d_lat = self.ax_1d_lateral
+        ax_1d_ap = self.ax_1d_ap
+        plotting_data = self.freemocap_plotting_data
+        last_frame = len(self.time_array) - 1
+
+        freemocap_bone_color = 'magenta'
+        self.set_axes(ax_3d,ax_2d,ax_1d_lat,ax_1d_ap,self.ax_video)
+
+        num_3d_lines, num_2d_lines = len(ax_3d.lines), len(ax_2d.lines)
+        self.plot_skeleton_bones(0,ax_3d,ax_2d,plotting_data.skel_connections_XYZ_data, color_str = freemocap_bone_color)
+        self.bone_lines_3d, self.bone_lines_2d = ax_3d.lines[num_3d_lines:], ax_2d.lines[num_2d_lines:]
+
+        hip_connection_x,hip_connection_y,hip_connection_z = self.create_segment_connection(plotting_data.skel_connections_XYZ_data,0,'thigh')
+        shoulder_connection_x,shoulder_connection_y,shoulder_connection_z = self.create_segment_connection(plotting_data.skel_connections_XYZ_data,0,'upper_arm')
+        self.hip_line_3d = ax_3d.plot(hip_connection_x,hip_connection_y,hip_connection_z,color = freemocap_bone_color, alpha = 1)[0]
+        self.shoulder_line_3d = ax_3d.plot(shoulder_connection_x,shoulder_connection_y,shoulder_connection_z,color = freemocap_bone_color, alpha = 1)[0]
+
+        self.skeleton_scatter_3d = ax_3d.scatter(plotting_data.skeleton_XYZ_data[0,:,0],plotting_data.skeleton_XYZ_data[0,:,1],plotting_data.skeleton_XYZ_data[0,:,2],color = 'darkmagenta', label = 'MediaPipe')
+        self.plot_3d_segment_and_total_body_COM(0,ax_3d,plotting_data.segment_COM_data,plotting_data.total_body_COM_data)
+        self.total_body_COM_scatter_3d = ax_3d.collections[-1]
+
+        self.hip_line_2d = ax_2d.plot(hip_connection_x,hip_connection_y,color = freemocap_bone_color, alpha = .4)[0]
+        self.shoulder_line_2d = ax_2d.plot(shoulder_connection_x,shoulder_connection_y,color = freemocap_bone_color, alpha = .4)[0]
+        self.COM_trail_2d = ax_2d.plot(plotting_data.total_body_COM_data[0:0,0],plotting_data.total_body_COM_data[0:0,1],color = 'grey')[0]
+        self.COM_marker_2d = ax_2d.plot(plotting_data.total_body_COM_data[0,0],plotting_data.total_body_COM_data[0,1],marker = '*', color = 'magenta', markeredgecolor = 'purple', ms = 8)[0]
+
+        #the future traces never change, the current ones are plotted whole once and then shown up to the current frame
+        num_2d_lines, num_lat_lines, num_ap_lines = len(ax_2d.lines), len(ax_1d_lat.lines), len(ax_1d_ap.lines)
+        self.time_lines = []
+        current_lat_lines, current_ap_lines = [], []
+        if self.stance in ['natural','right_leg']:
+            if self.stance == 'natural':
+                self.plot_BOS_bounds(0,ax_2d,plotting_data,1,.3)
+            else:
+                self.plot_BOS_right_leg_bound(0,ax_2d,plotting_data,1,.5)
+
+            self.plot_future_COM_and_lateral_BOS_positions(ax_1d_lat,plotting_data)
+            self.time_lines.append(ax_1d_lat.axvline(self.time_array[0], color = 'black'))
+            num_lat_lines = len(ax_1d_lat.lines)
+            self.plot_current_COM_and_lateral_BOS_positions(last_frame,ax_1d_lat,plotting_data,.5)
+            current_lat_lines = ax_1d_lat.lines[num_lat_lines:]
+
+            self.plot_future_COM_and_antpos_BOS_positions(ax_1d_ap,plotting_data)
+            self.time_lines.append(ax_1d_ap.axvline(self.time_array[0], color = 'black'))
+            num_ap_lines = len(ax_1d_ap.lines)
+            self.plot_current_COM_and_antpos_BOS_positions(last_frame,ax_1d_ap,plotting_data,.5)
+            current_ap_lines = ax_1d_ap.lines[num_ap_lines:]
+        self.BOS_lines_2d = ax_2d.lines[num_2d_lines:]
+        self.current_trace_lines = [(line, *[np.asarray(line_data) for line_data in line.get_data()]) for line in current_lat_lines + current_ap_lines]
+
+        self.COM_marker_lat = ax_1d_lat.plot(self.time_array[0],plotting_data.total_body_COM_data[0,0], '*', color = 'magenta', ms = 8, markeredgecolor = 'purple')[0]
+        self.COM_marker_ap = ax_1d_ap.plot(self.time_array[0],plotting_data.total_body_COM_data[0,1], '*', color = 'magenta', ms = 8, markeredgecolor = 'purple')[0]
+
+        self.create_legends(ax_3d,ax_2d)
+
+    def update_persistent_artists(self,frame):
+        plotting_data = self.freemocap_plotting_data
+        self.set_title_and_view(frame,self.ax_3d)
+
+        for bone_line_3d, bone_line_2d, (prox_joint, dist_joint) in zip(self.bone_lines_3d,self.bone_lines_2d,plotting_data.skel_connections_XYZ_data[frame]):
+            bone_x,bone_y,bone_z = [prox_joint[0],dist_joint[0]],[prox_joint[1],dist_joint[1]],[prox_joint[2],dist_joint[2]] 
+            bone_line_3d.set_data_3d(bone_x,bone_y,bone_z)
+            bone_line_2d.set_data(bone_x,bone_y)
+
+        hip_connection_x,hip_connection_y,hip_connection_z = self.create_segment_connection(plotting_data.skel_connections_XYZ_data,frame,'thigh')
+        shoulder_connection_x,shoulder_connection_y,shoulder_connection_z = self.create_segment_connection(plotting_data.skel_connections_XYZ_data,frame,'upper_arm')
+        self.hip_line_3d.set_data_3d(hip_connection_x,hip_connection_y,hip_connection_z)
+        self.shoulder_line_3d.set_data_3d(shoulder_connection_x,shoulder_connection_y,shoulder_connection_z)
+        self.hip_line_2d.set_data(hip_connection_x,hip_connection_y)
+        self.shoulder_line_2d.set_data(shoulder_connection_x,shoulder_connection_y)
+
+        this_frame_skeleton_XYZ = plotting_data.skeleton_XYZ_data[frame]
+        self.skeleton_scatter_3d._offsets3d = (this_frame_skeleton_XYZ[:,0],this_frame_skeleton_XYZ[:,1],this_frame_skeleton_XYZ[:,2])
+        this_frame_total_body_COM = plotting_data.total_body_COM_data[frame]
+        self.total_body_COM_scatter_3d._offsets3d = ([this_frame_total_body_COM[0]],[this_frame_total_body_COM[1]],[this_frame_total_body_COM[2]])
+
+        tail_length = 120
+        plot_fade_frame = max(frame - tail_length, 0)
+        self.COM_trail_2d.set_data(plotting_data.total_body_COM_data[plot_fade_frame:frame,0],plotting_data.total_body_COM_data[plot_fade_frame:frame,1])
+        self.COM_marker_2d.set_data([this_frame_total_body_COM[0]],[this_frame_total_body_COM[1]])
+
+        this_frame_right_foot_x, this_frame_right_foot_y = self.get_this_frame_foot_data(frame,plotting_data.right_foot_XYZ)
+        if self.stance == 'natural':
+            this_frame_left_foot_x, this_frame_left_foot_y = self.get_this_frame_foot_data(frame,plotting_data.left_foot_XYZ)
+            BOS_line_data = [(this_frame_left_foot_x,this_frame_left_foot_y), (this_frame_right_foot_x,this_frame_right_foot_y),
+                             ([this_frame_left_foot_x[0],this_frame_right_foot_x[0]],[this_frame_left_foot_y[0],this_frame_right_foot_y[0]]),
+                             ([this_frame_left_foot_x[1],this_frame_right_foot_x[1]],[this_frame_left_foot_y[1],this_frame_right_foot_y[1]])]
+        elif self.stance == 'right_leg':
+            BOS_line_data = [(this_frame_right_foot_x,this_frame_right_foot_y), ([this_frame_right_foot_x[0]],[this_frame_right_foot_y[0]]), ([this_frame_right_foot_x[1]],[this_frame_right_foot_y[1]])]
+        else:
+            BOS_line_data = []
+        for BOS_line, (BOS_line_x, BOS_line_y) in zip(self.BOS_lines_2d,BOS_line_data):
+            BOS_line.set_data(BOS_line_x,BOS_line_y)
+
+        for time_line in self.time_lines:
+            time_line.set_xdata([self.time_array[frame],self.time_array[frame]])
+        for current_trace_line, trace_time, trace_position in self.current_trace_lines:
+            current_trace_line.set_data(trace_time[0:frame+1],trace_position[0:frame+1])
+
+        self.COM_marker_lat.set_data([self.time_array[frame]],[this_frame_total_body_COM[0]])
+        self.COM_marker_ap.set_data([self.time_array[frame]],[this_frame_total_body_COM[1]])
+
+def render_COM_plot_chunk(freemocap_session_path,freemocap_plotting_data,output_video_fps,video_frames_to_plot,stance,render_mode,frames_to_render,output_video_path,video_writer):
+    #runs in its own process for COM_plot_creator.render_in_chunks
+    plt.switch_backend('Agg')
+    COM_plot_creator(freemocap_session_path,freemocap_plotting_data,output_video_fps,video_frames_to_plot,stance,render_mode,
+                     frames_to_render = frames_to_render, output_video_path = output_video_path, video_writer = video_writer)
+    return output_video_path
+
 
-        f = 2   
 if __name__ == '__main__':
 
     path_to_freemocap_data_folder = Path(r"D:\Dropbox\FreeMoCapProject\FreeMocap_Data")
@@ -583,6 +909,7 @@ if __name__ == '__main__':
     stance = 'left_leg'
     step_interval = 1 #leave at 1 unless using qualisys (step interval refers to skipping frames in the plotting to have the output video fps match for qualisys and mediapipe)
     output_video_fps = 30
+    num_workers = 1 #more than 1 renders the animation in that many chunks at the same time
     
     if stance == 'natural':
         mediapipe_num_frame_range = range(0,1100)
@@ -602,10 +929,10 @@ if __name__ == '__main__':
     mediapipe_data_to_plot.skeleton_XYZ_data = mediapipe_data_to_plot.skeleton_XYZ_data[:,0:33,:]
 
 
-    print('Loading video data')
-    video_frames_to_plot = video_loader(path_to_freemocap_data_folder,session_one_info,mediapipe_num_frame_range)
+    print('Opening video')
+    video_frames_to_plot = video_frame_source(path_to_freemocap_data_folder,session_one_info,mediapipe_num_frame_range,step_interval)
 
-    COM_plot = COM_plot_creator(freemocap_session_path,mediapipe_data_to_plot,output_video_fps,video_frames_to_plot, stance)
+    COM_plot = COM_plot_creator(freemocap_session_path,mediapipe_data_to_plot,output_video_fps,video_frames_to_plot, stance, num_workers = num_workers)
     
     f=2
 
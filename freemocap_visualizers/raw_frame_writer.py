@@ -0,0 +1,155 @@
+"""
+Export a matplotlib animation by piping the Agg canvas's RGBA buffer straight into ffmpeg.
+
+matplotlib's FFMpegWriter calls savefig for every frame, which goes through the whole savefig machinery before the
+pixels reach ffmpeg. Here each frame is drawn once on the figure's Agg canvas and its buffer is handed to a writer
+thread through a bounded queue, so the next frame renders while ffmpeg is still taking the last one.
+
+    export_animation(figure, animate, range(number_of_frames), output_video_path, fps=30)
+"""
+import queue
+import subprocess
+import threading
+
+import matplotlib
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+#libx264 presets run the same on any machine (no hardware encoder needed), faster presets give bigger files
+DEFAULT_CODEC = 'libx264'
+DEFAULT_PRESET = 'medium'
+DEFAULT_PIXEL_FORMAT = 'yuv420p'
+DEFAULT_QUEUE_SIZE = 8
+
+
+class RawFrameWriter:
+    """
+    Pipes raw RGBA frames of a fixed size into an ffmpeg process that encodes them into output_video_path.
+
+    With queue_size > 0 the frames are written by a separate thread. Each frame is copied once into one of queue_size
+    preallocated buffers (the canvas reuses its buffer for the next frame, so it can't be queued as is) and the buffers
+    are recycled, so nothing is allocated per frame. With queue_size = 0 the canvas buffer itself is written to the pipe
+    before write_frame returns, with no copy at all but no overlap either.
+    """
+
+    def __init__(self, output_video_path, fps, frame_size, pixel_format: str = DEFAULT_PIXEL_FORMAT, codec: str = DEFAULT_CODEC,
+                 preset: str = DEFAULT_PRESET, queue_size: int = DEFAULT_QUEUE_SIZE, extra_output_args=(), ffmpeg_path: str = None):
+        self.frame_width, self.frame_height = frame_size
+        ffmpeg_path = ffmpeg_path or matplotlib.rcParams['animation.ffmpeg_path']
+
+        ffmpeg_command = [ffmpeg_path, '-hide_banner', '-v', 'error', '-y',
+                          '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '{}x{}'.format(self.frame_width, self.frame_height), '-r', str(fps), '-i', '-',
+                          '-c:v', codec]
+        if preset is not None:
+            ffmpeg_command += ['-preset', preset]
+        if pixel_format.startswith('yuv420') and (self.frame_width % 2 or self.frame_height % 2):
+            ffmpeg_command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2'] #4:2:0 chroma needs an even width and height
+        ffmpeg_command += ['-pix_fmt', pixel_format, *extra_output_args, str(output_video_path)]
+
+        self.ffmpeg_process = subprocess.Popen(ffmpeg_command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        self.write_error = None
+        self.write_thread = None
+        if queue_size > 0:
+            self.free_buffers = queue.Queue()
+            for buffer_number in range(queue_size):
+                self.free_buffers.put(np.empty((self.frame_height, self.frame_width, 4), dtype=np.uint8))
+            self.frame_queue = queue.Queue(maxsize=queue_size)
+            self.write_thread = threading.Thread(target=self.write_queued_frames, daemon=True)
+            self.write_thread.start()
+
+    def write_queued_frames(self):
+        while True:
+            frame_buffer = self.frame_queue.get()
+            if frame_buffer is None:
+                return
+            try:
+                if self.write_error is None:
+                    self.ffmpeg_process.stdin.write(frame_buffer.data)
+            except (BrokenPipeError, OSError) as error:
+                self.write_error = error #raised from write_frame/close, keep emptying the queue so they don't block
+            self.free_buffers.put(frame_buffer)
+
+    def write_frame(self, rgba_buffer):
+        """Write one (height, width, 4) uint8 RGBA frame, e.g. an Agg canvas's buffer_rgba()."""
+        rgba_frame = np.asarray(rgba_buffer)
+        if rgba_frame.shape != (self.frame_height, self.frame_width, 4):
+            raise ValueError('Frame is {}, the video is {}x{} RGBA'.format(rgba_frame.shape, self.frame_width, self.frame_height))
+        self.raise_write_error()
+
+        if self.write_thread is None:
+            self.ffmpeg_process.stdin.write(memoryview(rgba_buffer))
+            return
+
+        frame_buffer = self.free_buffers.get() #waits for the writer thread to free a buffer once queue_size frames are queued
+        np.copyto(frame_buffer, rgba_frame)
+        self.frame_queue.put(frame_buffer)
+
+    def raise_write_error(self):
+        if self.write_error is not None:
+            self.ffmpeg_process.stdin.close()
+            self.ffmpeg_process.wait()
+            raise RuntimeError('ffmpeg stopped taking frames ({}): {}'.format(self.write_error, self.ffmpeg_process.stderr.read().decode(errors='replace')))
+
+    def close(self):
+        """Wait for the queued frames to be written and for ffmpeg to finish encoding."""
+        if self.write_thread is not None:
+            self.frame_queue.put(None)
+            self.write_thread.join()
+            self.write_thread = None
+        self.raise_write_error()
+
+        self.ffmpeg_process.stdin.close()
+        ffmpeg_stderr = self.ffmpeg_process.stderr.read()
+        if self.ffmpeg_process.wait() != 0:
+            raise RuntimeError('ffmpeg failed to encode the video: {}'.format(ffmpeg_stderr.decode(errors='replace')))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, exception_traceback):
+        if exception_type is None:
+            self.close()
+        else:
+            #don't mask the original error with whatever ffmpeg thinks of the half written video.
+            #ffmpeg goes first so a writer thread stuck writing to it gets a broken pipe instead of waiting forever
+            self.ffmpeg_process.kill()
+            self.ffmpeg_process.wait()
+            if self.write_thread is not None:
+                self.frame_queue.put(None)
+                self.write_thread.join()
+
+
+def get_agg_canvas(figure):
+    """The figure's canvas if it renders with Agg (Agg and every interactive backend built on it), otherwise a new Agg canvas for it."""
+    if isinstance(figure.canvas, FigureCanvasAgg):
+        return figure.canvas
+    return FigureCanvasAgg(figure)
+
+
+def export_animation(figure, animate_function, frames, output_video_path, fps, init_function=None, fargs=(), **writer_kwargs):
+    """
+    Save an animation the way FuncAnimation(figure, animate_function, frames, init_func=init_function, fargs=fargs).save(...) would,
+    rendering every frame on the figure's Agg canvas and piping its RGBA buffer to a RawFrameWriter (writer_kwargs are passed on to it).
+    """
+    canvas = get_agg_canvas(figure)
+    if init_function is not None:
+        init_function()
+
+    def render_frame(frame):
+        animate_function(frame, *fargs)
+        canvas.draw()
+        return canvas.buffer_rgba()
+
+    frames = iter(frames)
+    first_frame = next(frames, None)
+    if first_frame is None:
+        return
+    rgba_buffer = render_frame(first_frame)
+    frame_height, frame_width = np.asarray(rgba_buffer).shape[:2] #the canvas size in pixels, only known once it has drawn
+
+    with RawFrameWriter(output_video_path, fps, (frame_width, frame_height), **writer_kwargs) as writer:
+        writer.write_frame(rgba_buffer)
+        for frame in frames:
+            writer.write_frame(render_frame(frame))
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from freemocap_post_processing.gap_filling import fill_gaps
+
+
+def make_marker_data_with_gaps(num_frames=300, num_markers=20):
+    rng = np.random.default_rng(0)
+    marker_data = rng.normal(size=(num_frames, num_markers, 3))
+    marker_data[rng.random(marker_data.shape) < 0.1] = np.nan
+    marker_data[100:150, 3] = np.nan
+    return marker_data
+
+
+def test_non_contiguous_out():
+    marker_data = make_marker_data_with_gaps()
+    expected_filled_data, expected_gap_map = fill_gaps(marker_data)
+
+    out = np.empty(marker_data.shape[::-1]).transpose(2, 1, 0)
+    filled_data, gap_map = fill_gaps(marker_data, out=out, columns_per_block=7)
+    assert filled_data is out
+    np.testing.assert_array_equal(out, expected_filled_data)
+    np.testing.assert_array_equal(gap_map, expected_gap_map)
+
+
+@pytest.mark.parametrize("out", [np.empty((300, 20, 2)), np.empty((300, 20, 3), dtype=int)])
+def test_invalid_out(out):
+    with pytest.raises(ValueError):
+        fill_gaps(make_marker_data_with_gaps(), out=out)
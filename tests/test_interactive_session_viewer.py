@@ -0,0 +1,21 @@
+from freemocap_visualizers.interactive_session_viewer import SCRUB_KEY_STEPS, video_frame_cache
+
+from test_video_frame_source import get_frame_within_timeout, make_frame_source
+
+
+def test_scrubbing_jumps():
+    #the same frame source the viewer scrubs through, pressing up/pageup (+10/+100) and dragging the slider ahead and back
+    frame_source = make_frame_source(buffer_size=8)
+    video_frames = video_frame_cache(frame_source, cache_size=4)
+    scrub_keys = ['right', 'up', 'up', 'right', 'up', 'pageup', 'up', 'down', 'pageup', 'left', 'pagedown', 'up', 'up']
+    try:
+        frame = 0
+        assert get_frame_within_timeout(video_frames, frame)[0, 0, 0] == frame
+        for scrub_key in scrub_keys:
+            frame = min(max(frame + SCRUB_KEY_STEPS[scrub_key], 0), frame_source.num_frames - 1)
+            assert get_frame_within_timeout(video_frames, frame)[0, 0, 0] == frame % 256, 'wrong frame after {}'.format(scrub_key)
+
+        for slider_frame in [frame + 3, frame + 7, 20, 27, 250, 5]:
+            assert get_frame_within_timeout(video_frames, slider_frame)[0, 0, 0] == slider_frame % 256
+    finally:
+        video_frames.close()
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from freemocap_post_processing.pipeline import INPUT_FILE_NAME, NPY_OUTPUT_FILE_NAMES, process_session
+from freemocap_post_processing.session_container import SESSION_CONTAINER_FILE_NAME
+
+NUM_FRAMES = 200
+NUM_MARKERS = 33 + 21*2 + 468 #mediapipe body, hands and face
+
+
+def make_session(session_folder_path):
+    rng = np.random.default_rng(0)
+    skeleton_data = 1000*rng.random((1, NUM_MARKERS, 3)) + rng.normal(size=(NUM_FRAMES, NUM_MARKERS, 3))
+    skeleton_data[rng.random(skeleton_data.shape[:2]) < 0.05] = np.nan
+    data_array_path = session_folder_path/'DataArrays'
+    data_array_path.mkdir(parents=True)
+    np.save(data_array_path/INPUT_FILE_NAME, skeleton_data)
+    return data_array_path
+
+
+@pytest.mark.parametrize("save_npy_files", [True, False])
+def test_streaming_leaves_the_same_files(tmp_path, save_npy_files):
+    in_memory_data_array_path = make_session(tmp_path/'in_memory')
+    streamed_data_array_path = make_session(tmp_path/'streamed')
+    in_memory_result = process_session(tmp_path/'in_memory', {'save_npy_files': save_npy_files})
+    streamed_result = process_session(tmp_path/'streamed', {'save_npy_files': save_npy_files, 'use_streaming': True, 'frames_per_chunk': 64})
+
+    streamed_file_names = {path.name for path in streamed_data_array_path.iterdir()}
+    assert streamed_file_names == {path.name for path in in_memory_data_array_path.iterdir()}
+    assert {SESSION_CONTAINER_FILE_NAME, *NPY_OUTPUT_FILE_NAMES.values()} & streamed_file_names == \
+           {SESSION_CONTAINER_FILE_NAME, *(NPY_OUTPUT_FILE_NAMES.values() if save_npy_files else [])}
+    assert streamed_result['output_paths'].keys() == in_memory_result['output_paths'].keys()
+    if save_npy_files:
+        for file_name in NPY_OUTPUT_FILE_NAMES.values():
+            np.testing.assert_allclose(np.load(streamed_data_array_path/file_name), np.load(in_memory_data_array_path/file_name), atol=1e-6)
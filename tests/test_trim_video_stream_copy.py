@@ -0,0 +1,62 @@
+import subprocess
+
+import numpy as np
+import pytest
+from moviepy.config import get_setting
+
+from SlimVideoSynchAndTrim import VideoSynchTrimming
+from VideoProbe import scan_video_packets
+
+FPS = 30
+NUM_SOURCE_FRAMES = 240
+FRAME_WIDTH, FRAME_HEIGHT = 64, 32
+KEYFRAME_INTERVAL = 24
+
+
+def make_numbered_video(video_path):
+    """A libx264 video (with audio) whose left half is grey level 16*(frame % 16) + 8 and right half 16*(frame // 16) + 8,
+    flat enough to survive compression, so every decoded frame can be traced back to the source frame it came from"""
+    frames = np.zeros((NUM_SOURCE_FRAMES, FRAME_HEIGHT, FRAME_WIDTH), dtype=np.uint8)
+    for frame in range(NUM_SOURCE_FRAMES):
+        frames[frame, :, :FRAME_WIDTH // 2] = (frame % 16) * 16 + 8
+        frames[frame, :, FRAME_WIDTH // 2:] = (frame // 16) * 16 + 8
+    subprocess.run([get_setting("FFMPEG_BINARY"), "-hide_banner", "-v", "error", "-y",
+                    "-f", "rawvideo", "-pix_fmt", "gray", "-s", f"{FRAME_WIDTH}x{FRAME_HEIGHT}", "-r", str(FPS), "-i", "-",
+                    "-f", "lavfi", "-i", f"sine=frequency=440:duration={NUM_SOURCE_FRAMES / FPS}", "-shortest",
+                    "-c:v", "libx264", "-pix_fmt", "yuv420p", "-g", str(KEYFRAME_INTERVAL), "-sc_threshold", "0", "-c:a", "aac", str(video_path)],
+                   input=frames.tobytes(), check=True)
+
+
+def decode_frame_numbers(video_path):
+    """The source frame number of every frame in the video, in the order they're decoded (with their own timestamps, no frames added or dropped)"""
+    raw_frames = subprocess.run([get_setting("FFMPEG_BINARY"), "-hide_banner", "-v", "error", "-i", str(video_path), "-fps_mode", "passthrough",
+                                 "-f", "rawvideo", "-pix_fmt", "gray", "-"], stdout=subprocess.PIPE, check=True).stdout
+    frames = np.frombuffer(raw_frames, dtype=np.uint8).reshape(-1, FRAME_HEIGHT, FRAME_WIDTH)
+    low_digit = np.round((frames[:, :, :FRAME_WIDTH // 2].mean(axis=(1, 2)) - 8) / 16).astype(int)
+    high_digit = np.round((frames[:, :, FRAME_WIDTH // 2:].mean(axis=(1, 2)) - 8) / 16).astype(int)
+    return high_digit * 16 + low_digit
+
+
+@pytest.fixture(scope="module")
+def numbered_video_path(tmp_path_factory):
+    video_path = tmp_path_factory.mktemp("source") / "raw_Cam0.mp4"
+    make_numbered_video(video_path)
+    return video_path
+
+
+# a head and no tail, a tail and no head, both, and a start right on a keyframe
+@pytest.mark.parametrize("start_time", [1.23, 0.0, 0.5, 1.6])
+def test_stream_copy_keeps_the_same_frames_as_reencode(numbered_video_path, tmp_path, start_time):
+    synch_and_trim = VideoSynchTrimming()
+    duration = 6
+    reencoded_path, stream_copied_path = tmp_path / "synced_reencode.mp4", tmp_path / "synced_stream_copy.mp4"
+    synch_and_trim.trim_video_reencode(numbered_video_path, str(reencoded_path), start_time, duration)
+    trim_info = synch_and_trim.trim_video_stream_copy(numbered_video_path, str(stream_copied_path), start_time, duration, FPS)
+    assert trim_info is not None and trim_info["mode"] == "stream_copy"
+
+    first_frame, frame_count = synch_and_trim.get_trim_frames(start_time, duration, FPS)
+    expected_frames = np.arange(first_frame, first_frame + frame_count)
+    np.testing.assert_array_equal(decode_frame_numbers(reencoded_path), expected_frames)
+    np.testing.assert_array_equal(decode_frame_numbers(stream_copied_path), expected_frames)
+    # and every frame is shown at its own time, the joins don't squeeze or stretch the re-encoded parts
+    np.testing.assert_allclose(scan_video_packets(stream_copied_path), np.arange(frame_count) / FPS, atol=0.0005)
@@ -0,0 +1,106 @@
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from freemocap_visualizers.mediapipe_COM_BOS_plotter import video_frame_source
+
+NUM_VIDEO_FRAMES = 300
+GET_FRAME_TIMEOUT = 5 #seconds, a get_frame that takes longer than this is stuck
+
+
+class stub_video_capture:
+    """Stands in for cv2.VideoCapture on a tiny video whose every pixel holds the number of the frame it's in"""
+
+    def __init__(self, num_frames=NUM_VIDEO_FRAMES):
+        self.num_frames = num_frames
+        self.position = 0
+
+    def isOpened(self):
+        return True
+
+    def get(self, property_id):
+        return {cv2.CAP_PROP_FRAME_WIDTH: 4, cv2.CAP_PROP_FRAME_HEIGHT: 2}.get(property_id, 0)
+
+    def set(self, property_id, value):
+        if property_id == cv2.CAP_PROP_POS_FRAMES:
+            self.position = int(value)
+        return True
+
+    def grab(self):
+        if self.position >= self.num_frames:
+            return False
+        self.position += 1
+        return True
+
+    def read(self):
+        if self.position >= self.num_frames:
+            return False, None
+        image = np.full((2, 4, 3), self.position % 256, dtype=np.uint8)
+        self.position += 1
+        return True, image
+
+    def release(self):
+        pass
+
+
+class stub_video_frame_source(video_frame_source):
+    def load_video_capture_object(self, synced_vid_path):
+        return stub_video_capture()
+
+
+def make_frame_source(buffer_size=8, step_interval=1):
+    return stub_video_frame_source(Path('freemocap_data'), {'sessionID': 'session'}, range(0, NUM_VIDEO_FRAMES), step_interval=step_interval,
+                                   buffer_size=buffer_size, downscale_to_axis=False)
+
+
+def get_frame_within_timeout(frame_source, frame):
+    """Call get_frame on another thread, failing the test instead of hanging it if the frame never arrives"""
+    result = {}
+    get_frame_thread = threading.Thread(target=lambda: result.update(image=frame_source.get_frame(frame)), daemon=True)
+    get_frame_thread.start()
+    get_frame_thread.join(GET_FRAME_TIMEOUT)
+    assert not get_frame_thread.is_alive(), 'get_frame({}) is stuck waiting for the decode thread'.format(frame)
+    return result['image']
+
+
+def test_frames_in_order():
+    frame_source = make_frame_source()
+    try:
+        for frame in range(20):
+            assert get_frame_within_timeout(frame_source, frame)[0, 0, 0] == frame
+    finally:
+        frame_source.close()
+
+
+def test_forward_jump_past_full_buffer():
+    frame_source = make_frame_source(buffer_size=8)
+    try:
+        assert get_frame_within_timeout(frame_source, 0)[0, 0, 0] == 0
+        #once the decode thread has filled the buffer, 10 is neither in it nor far enough ahead to seek
+        with frame_source.buffer_condition:
+            frame_source.buffer_condition.wait_for(lambda: len(frame_source.frame_buffer) >= frame_source.buffer_size, GET_FRAME_TIMEOUT)
+        assert get_frame_within_timeout(frame_source, 10)[0, 0, 0] == 10
+        assert get_frame_within_timeout(frame_source, 11)[0, 0, 0] == 11
+    finally:
+        frame_source.close()
+
+
+def test_backward_jump_and_step_interval():
+    frame_source = make_frame_source(step_interval=3)
+    try:
+        assert get_frame_within_timeout(frame_source, 30)[0, 0, 0] == 90
+        assert get_frame_within_timeout(frame_source, 2)[0, 0, 0] == 6
+    finally:
+        frame_source.close()
+
+
+def test_past_end_of_video_shows_last_frame():
+    frame_source = make_frame_source()
+    try:
+        last_frame = frame_source.num_frames - 1
+        assert get_frame_within_timeout(frame_source, last_frame)[0, 0, 0] == last_frame % 256
+        assert get_frame_within_timeout(frame_source, last_frame + 5)[0, 0, 0] == last_frame % 256
+    finally:
+        frame_source.close()